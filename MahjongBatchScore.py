@@ -0,0 +1,198 @@
+import os
+import sys
+import csv
+import time
+import argparse
+from multiprocessing import Pool
+
+import numpy as np
+
+import MahjongTile as Mahjong
+import MahjongHandTable as HandTable
+import MahjongFaanRules as FaanRules
+from MahjongFaanCalculator import best_faan, FaanError
+
+# A batch of hands is an (N, 45) int matrix, one hand per row:
+#   columns 0-33  : the 34 tile counts (Mahjong.tile_values order)
+#   columns 34-41 : number of flowers of each Flower value 1-8
+#   columns 42-44 : game_wind, seat_wind, seat (-1 when unknown)
+tile_columns = 34
+flower_columns = 8
+context_columns = 3
+row_width = tile_columns + flower_columns + context_columns
+
+# pad an (N, 34) count matrix with no flowers and unknown winds
+def to_batch(counts, flowers=None, context=None):
+    counts = np.asarray(counts, dtype=np.int16).reshape(-1, tile_columns)
+    batch = np.full((len(counts), row_width), -1, dtype=np.int16)
+    batch[:, :tile_columns] = counts
+    batch[:, tile_columns:tile_columns + flower_columns] = 0 if flowers is None else flowers
+    if context is not None:
+        batch[:, tile_columns + flower_columns:] = context
+    return batch
+
+# one hand per line: tile class names separated by spaces, e.g. "b1 b2 b3 ... f1 s2",
+# optionally followed by "| game_wind seat_wind seat"
+def parse_text_line(line):
+    tiles, _, context = line.partition('|')
+    row = [0] * tile_columns + [0] * flower_columns + [-1] * context_columns
+    for class_name in tiles.split():
+        if class_name not in Mahjong.class_slot:
+            raise ValueError(f"Unknown tile class '{class_name}'")
+        row[Mahjong.class_slot[class_name]] += 1
+    for i, value in enumerate(context.split()[:context_columns]):
+        row[tile_columns + flower_columns + i] = int(value)
+    return row
+
+# load a hand batch from .npy, .csv (34 or 45 numeric columns, optional header) or text
+def load_hands(path):
+    _, ext = os.path.splitext(path)
+    if ext == '.npy':
+        hands = np.load(path, mmap_mode='r')
+    elif ext == '.csv':
+        with open(path) as f:
+            first = f.readline()
+        skip = 0 if first.split(',')[0].strip().lstrip('-').isdigit() else 1
+        hands = np.loadtxt(path, delimiter=',', skiprows=skip, dtype=np.int16, ndmin=2)
+    else:
+        with open(path) as f:
+            hands = np.array([parse_text_line(line) for line in f if line.strip()], dtype=np.int16).reshape(-1, row_width)
+
+    if hands.ndim != 2 or hands.shape[1] not in (tile_columns, row_width):
+        raise ValueError(f'{path}: expected {tile_columns} or {row_width} columns, got shape {hands.shape}')
+    if hands.shape[1] == tile_columns:
+        hands = to_batch(hands)
+    return np.asarray(hands, dtype=np.int16)
+
+# score hand rows in one worker process
+def score_rows(rows):
+    HandTable.check_worker()
+    results = []
+    # the tile and flower columns have the Mahjong.Hand layout
+    hands = rows[:, :Mahjong.hand_size].astype(np.uint8)
+    for row, hand_bytes in zip(rows, hands):
+        game_wind, seat_wind, seat = row[tile_columns + flower_columns:].tolist()
+        try:
+            result = best_faan(Mahjong.Hand(hand_bytes.tobytes()), game_wind, seat_wind, seat)
+            results.append((result['faan'], result['name'].strip()))
+        except FaanError as e:
+            results.append((-1, f'Error: {e}'))
+    return results
+
+# Score a hand batch, returns (faan, names) in input order, faan is -1 for invalid hands
+#
+# The cheap parts run on the whole matrix at once: identical rows are scored once,
+# rows with a bad tile or flower count are rejected and the flower limit hands (7 or 8 flowers)
+# are scored without looking at the tiles. The remaining unique rows are split into
+# chunks and scored on a process pool.
+def score_hands(hands, workers=None, chunk_size=2048):
+    hands = np.asarray(hands, dtype=np.int16)
+    unique_rows, inverse = np.unique(hands, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    faan = np.full(len(unique_rows), -1, dtype=np.int16)
+    names = np.empty(len(unique_rows), dtype=object)
+
+    counts = unique_rows[:, :tile_columns]
+    tile_total = counts.sum(axis=1)
+    flowers = unique_rows[:, tile_columns:tile_columns + flower_columns]
+    flower_total = flowers.sum(axis=1)
+
+    bad_count = (counts.min(axis=1) < 0) | (counts.max(axis=1) > 4)
+    # every flower and season is a single tile, a negative count would wrap around in the uint8 Hand
+    bad_flower = (flowers.min(axis=1) < 0) | (flowers.max(axis=1) > 1)
+    all_flowers = flower_total == 8
+    seven_flowers = flower_total == 7
+    bad_total = ~all_flowers & ~seven_flowers & ((tile_total < 14) | (tile_total > 18))
+
+    names[bad_count] = 'Error: a tile is counted more than 4 times'
+    names[bad_flower & ~bad_count] = 'Error: a flower is counted less than 0 or more than once'
+    names[bad_total & ~bad_count & ~bad_flower] = 'Error: a hand needs 14 to 18 tiles'
+    done = bad_count | bad_flower | bad_total
+    faan[all_flowers & ~done] = 8
+    names[all_flowers & ~done] = 'All Flowers'
+    faan[seven_flowers & ~done] = 3
+    names[seven_flowers & ~done] = 'Seven Flowers'
+    done |= all_flowers | seven_flowers
+
+    todo = np.flatnonzero(~done)
+    chunks = [unique_rows[todo[i:i + chunk_size]] for i in range(0, len(todo), chunk_size)]
+    # the table is built or loaded here first, the workers only map the finished file
+    HandTable.get_table()
+    pool = None
+    if workers != 1 and len(chunks) > 1:
+        pool = Pool(processes=workers, initializer=HandTable.init_worker)
+        chunk_results = pool.imap(score_rows, chunks)
+    else:
+        chunk_results = map(score_rows, chunks)
+
+    position = 0
+    try:
+        for results in chunk_results:
+            for value, name in results:
+                faan[todo[position]] = value
+                names[todo[position]] = name
+                position += 1
+    except BaseException:
+        # a failed worker or ^C, the other chunks are not waited for
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return faan[inverse], names[inverse].tolist()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', help='Hands to score: .npy / .csv with 34 or 45 columns, or a text file with one hand per line',
+                        required=True)
+    parser.add_argument('--output', help='CSV file for the results (row, faan, result_name), otherwise print them',
+                        default=None)
+    parser.add_argument('--workers', help='Number of scoring processes, defaults to the number of cores',
+                        type=int, default=None)
+    parser.add_argument('--chunk', help='Number of hands sent to a worker at a time',
+                        type=int, default=2048)
+    parser.add_argument('--rule_stats', help='Print the evaluation time and hit rate of every faan rule, scores in this process only',
+                        action='store_true')
+    args = parser.parse_args()
+
+    try:
+        hands = load_hands(args.input)
+    except (ValueError, OSError) as e:
+        print(f'ERROR: {e}')
+        sys.exit(1)
+
+    if args.rule_stats:
+        # the counters live in the scoring process
+        FaanRules.faan_engine.profile = True
+        args.workers = 1
+
+    t_start = time.perf_counter()
+    try:
+        faan, names = score_hands(hands, args.workers, args.chunk)
+    except (RuntimeError, OSError, ValueError) as e:
+        print(f'ERROR: {e}')
+        sys.exit(1)
+    elapsed = time.perf_counter() - t_start
+
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        writer = csv.writer(out)
+        writer.writerow(['row', 'faan', 'result_name'])
+        writer.writerows((i, value, name) for i, (value, name) in enumerate(zip(faan.tolist(), names)))
+    finally:
+        if args.output:
+            out.close()
+
+    print(f'Scored {len(hands)} hands in {elapsed:.2f}s ({len(hands) / max(elapsed, 1e-9):.0f} hands/sec)', file=sys.stderr)
+    if args.rule_stats:
+        for stat in FaanRules.faan_engine.stats():
+            print(f"{stat['rule']:<24}{stat['evaluations']:>10} evals {stat['hit_rate']:>8.2%} hits {stat['mean_us']:>8.3f} us/eval",
+                  file=sys.stderr)
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+import os
+import sys
+import json
+import glob
+import time
+import random
+import platform
+import argparse
+
+import numpy as np
+
+import MahjongTile as Mahjong
+import MahjongHandTable as HandTable
+import MahjongDetect as Detect
+import MahjongModelRegistry as Registry
+from MahjongFaanCalculator import best_faan, FaanError
+
+# Latency and throughput of every stage of the detect and score pipeline
+#
+# Image stages read Test/ and TestData/images, the box stages use the TestData/labels boxes
+# and the scoring stages use seeded synthetic winning hands, so only model inference and the
+# end to end run need a model file. Results are written as JSON and can be compared with a
+# saved run: a stage whose p50 or p95 got slower than the tolerance fails the run.
+
+path_prefix = os.path.dirname(os.path.abspath(__file__))
+default_image_dirs = [os.path.join(path_prefix, 'Test'), os.path.join(path_prefix, 'TestData', 'images')]
+default_label_dir = os.path.join(path_prefix, 'TestData', 'labels')
+default_classes_file = os.path.join(path_prefix, 'TestData', 'classes.txt')
+default_model_path = Registry.default_model_path()
+
+# p50 / p95 / p99 of per call samples in seconds
+def latency_summary(samples, items_per_call=1):
+    samples_ms = np.asarray(samples) * 1000
+    total = samples_ms.sum() / 1000
+    return {
+        'calls': len(samples_ms),
+        'mean_ms': float(samples_ms.mean()),
+        'p50_ms': float(np.percentile(samples_ms, 50)),
+        'p95_ms': float(np.percentile(samples_ms, 95)),
+        'p99_ms': float(np.percentile(samples_ms, 99)),
+        'throughput_per_s': len(samples_ms) * items_per_call / total if total > 0 else 0.0,
+    }
+
+# time fn on every input, repeat times, after one untimed warm up pass
+def time_stage(fn, inputs, repeat=1, warmup=True):
+    if warmup:
+        for item in inputs:
+            fn(item)
+    clock = time.perf_counter
+    samples = []
+    for _ in range(repeat):
+        for item in inputs:
+            t_start = clock()
+            fn(item)
+            samples.append(clock() - t_start)
+    return samples
+
+# a random 14 tile hand of 4 melds and an eye
+def random_winning_hand(rng, chow_rate=0.5):
+    while True:
+        counts = [0] * 34
+        for _ in range(4):
+            if rng.random() < chow_rate:
+                start = rng.randrange(3) * 9 + rng.randrange(7)
+                for index in range(start, start + 3):
+                    counts[index] += 1
+            else:
+                counts[rng.randrange(34)] += 3
+        counts[rng.randrange(34)] += 2
+        if max(counts) <= 4:
+            flowers = rng.sample(range(1, 9), rng.choice((0, 0, 1, 2)))
+            return Mahjong.Hand.from_counts(counts, flowers)
+
+def synthetic_hands(count, seed=0):
+    rng = random.Random(seed)
+    return [random_winning_hand(rng) for _ in range(count)]
+
+def list_bench_images(image_dirs):
+    img_files = []
+    for image_dir in image_dirs:
+        img_files += sorted(path for path in glob.glob(os.path.join(image_dir, '*'))
+                            if os.path.splitext(path)[1] in Detect.img_ext_list)
+    return img_files
+
+# (frame, Detections) of every labelled image, the labels stand in for the model output
+def labelled_detections(image_dirs, label_dir, classes_file):
+    names = Detect.label_array(Detect.read_class_names(classes_file))
+    results = []
+    for img_filename in list_bench_images(image_dirs):
+        label_file = os.path.join(label_dir, os.path.splitext(os.path.basename(img_filename))[0] + '.txt')
+        if not os.path.exists(label_file):
+            continue
+        frame = Detect.read_image(img_filename)
+        xyxy, cls = Detect.read_labels(label_file, frame.shape[1], frame.shape[0])
+        conf = np.linspace(0.3, 0.99, len(cls)).astype(np.float32)
+        results.append((frame, Detect.Detections(xyxy, conf, cls, names)))
+    return results
+
+def run_benchmarks(image_dirs=default_image_dirs, label_dir=default_label_dir, classes_file=default_classes_file,
+                   model_path=default_model_path, resolution=(1280, 1280), hands=2000, repeat=5, seed=0, backend=None):
+    results = {}
+    skipped = {}
+    img_files = list_bench_images(image_dirs)
+    encoded = []
+    for img_filename in img_files:
+        with open(img_filename, 'rb') as f:
+            encoded.append(f.read())
+    frames = [Detect.decode_image(data) for data in encoded]
+
+    # image decode, from bytes already in memory
+    results['decode'] = latency_summary(time_stage(Detect.decode_image, encoded, repeat))
+
+    # ROI crop and letterbox to the model input size, the ROI is the middle of the resized frame
+    roi = (resolution[0] // 4, resolution[1] // 4, resolution[0] * 3 // 4, resolution[1] * 3 // 4)
+    imgsz = Detect.training_imgsz(model_path)
+    buffer = np.empty((imgsz, imgsz, 3), dtype=np.uint8)
+    results['preprocess'] = latency_summary(
+        time_stage(lambda frame: Detect.prepare_frame(frame, imgsz, resolution, roi, out=buffer), frames, repeat))
+
+    # box post-processing and layout on the labelled boxes
+    labelled = labelled_detections(image_dirs, label_dir, classes_file)
+    if labelled:
+        names = labelled[0][1].names
+        ignore_array = np.array([[0, 0, 40, 40]], dtype=np.int32)
+        box_inputs = [(d.xyxy.astype(np.float32), d.conf, d.cls.astype(np.float32)) for _, d in labelled]
+        results['postprocess'] = latency_summary(time_stage(
+            lambda boxes: Detect.filter_boxes(boxes[0], boxes[1], boxes[2], names, 0.2, ignore_array), box_inputs, repeat * 20))
+        results['layout'] = latency_summary(time_stage(lambda d: d.layout(), [d for _, d in labelled], repeat * 20))
+    else:
+        skipped['postprocess'] = skipped['layout'] = f'no labelled images in {label_dir}'
+
+    # meld extraction and scoring on synthetic hands
+    table = HandTable.get_table()
+    hand_list = synthetic_hands(hands, seed)
+    results['meld_extraction'] = latency_summary(time_stage(lambda hand: table.decompose(hand.counts), hand_list))
+
+    def score(hand):
+        try:
+            best_faan(hand)
+        except FaanError:
+            pass
+    results['scoring'] = latency_summary(time_stage(score, hand_list))
+
+    # model inference and end to end, only with a model
+    detector = None
+    if not os.path.exists(model_path):
+        skipped['inference'] = skipped['end_to_end'] = f'model not found: {model_path}'
+    else:
+        try:
+            detector = Detect.TileDetector(model_path, 0.2, f'{resolution[0]}x{resolution[1]}', device='cpu', backend=backend)
+        except (ImportError, ValueError, FileNotFoundError) as e:
+            skipped['inference'] = skipped['end_to_end'] = f'cannot load the model: {e}'
+
+    if detector is not None:
+        prepared = [detector.preprocess(frame) for frame in frames]
+        results['inference'] = latency_summary(time_stage(detector.infer, prepared, repeat))
+
+        def end_to_end(img_filename):
+            detections = detector.detect_file(img_filename)
+            try:
+                best_faan(detections.to_hand())
+            except (FaanError, ValueError):
+                pass
+        results['end_to_end'] = latency_summary(time_stage(end_to_end, img_files, repeat))
+
+    return {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'images': len(img_files),
+            'hands': hands,
+            'repeat': repeat,
+            'seed': seed,
+            'model': detector.model_path if detector is not None else None,
+            'backend': detector.backend if detector is not None else None,
+        },
+        'stages': results,
+        'skipped': skipped,
+    }
+
+# stages whose p50 or p95 is slower than the baseline by more than tolerance
+def compare(report, baseline, tolerance=0.2):
+    regressions = []
+    for stage, current in report['stages'].items():
+        previous = baseline.get('stages', {}).get(stage)
+        if previous is None:
+            continue
+        for key in ('p50_ms', 'p95_ms'):
+            if current[key] > previous[key] * (1 + tolerance):
+                regressions.append((stage, key, previous[key], current[key]))
+    return regressions
+
+def print_report(report, out=sys.stdout):
+    print(f"{'stage':<18}{'calls':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'per sec':>12}", file=out)
+    for stage, result in report['stages'].items():
+        print(f"{stage:<18}{result['calls']:>8}{result['p50_ms']:>10.3f}{result['p95_ms']:>10.3f}"
+              f"{result['p99_ms']:>10.3f}{result['throughput_per_s']:>12.1f}", file=out)
+    for stage, reason in report['skipped'].items():
+        print(f'{stage:<18}skipped, {reason}', file=out)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', help='Path to YOLO model file or model generation ("5"), inference is skipped when it is missing',
+                        default=default_model_path)
+    parser.add_argument('--backend', help='Inference backend of the inference and end to end stages',
+                        choices=Detect.backends, default=None)
+    parser.add_argument('--images', help='Image folders to benchmark on', nargs='+', default=default_image_dirs)
+    parser.add_argument('--labels', help='YOLO label folder for the post-processing and layout stages', default=default_label_dir)
+    parser.add_argument('--classes', help='classes.txt of the label folder', default=default_classes_file)
+    parser.add_argument('--resolution', help='Resize the images to WxH (example: "1280x1280")', default='1280x1280')
+    parser.add_argument('--hands', help='Number of synthetic hands for the scoring stages', type=int, default=2000)
+    parser.add_argument('--repeat', help='Number of timed passes over the images', type=int, default=5)
+    parser.add_argument('--seed', help='Seed of the synthetic hands', type=int, default=0)
+    parser.add_argument('--output', help='Write the results to this JSON file', default=None)
+    parser.add_argument('--baseline', help='Compare with the JSON results of an earlier run, exit 1 on a regression',
+                        default=None)
+    parser.add_argument('--tolerance', help='Allowed slowdown against the baseline (example: "0.2" for 20%%)',
+                        type=float, default=0.2)
+    args = parser.parse_args()
+
+    resolution = tuple(int(v) for v in args.resolution.split('x'))
+    report = run_benchmarks(args.images, args.labels, args.classes, Registry.resolve_model(args.model), resolution, args.hands, args.repeat, args.seed,
+                            args.backend)
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f'\nREGRESSION against {args.baseline}:', file=sys.stderr)
+            for stage, key, previous, current in regressions:
+                print(f'  {stage} {key}: {previous:.3f} -> {current:.3f} ({current / previous - 1:+.0%})', file=sys.stderr)
+            sys.exit(1)
+        print(f'\nNo regression against {args.baseline} (tolerance {args.tolerance:.0%})')
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
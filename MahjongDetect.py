@@ -1,226 +1,886 @@
 import os
+import re
 import sys
+import json
 import argparse
 import glob
 import time
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 import numpy as np
-from ultralytics import YOLO
-
-# Define and parse user input arguments
-parser = argparse.ArgumentParser()
-parser.add_argument('--model', help='Path to YOLO model file (example: "runs/detect/train/weights/best.pt")',
-                    required=True)
-parser.add_argument('--source', help='Image source, can be image file ("test.jpg"), image folder ("test_dir")', 
-                    required=True)
-parser.add_argument('--threshold', help='Minimum confidence threshold for displaying detected objects (example: "0.4")',
-                    default=0.2)
-parser.add_argument('--resolution', help='Resolution in WxH to display inference results at (example: "640x480"), \
-                    otherwise, match source resolution',
-                    default=None)
-parser.add_argument('--showRes', help='show the result of the dectection in a new window',
-                    default=False)
-parser.add_argument('--showAll', help='show the result below the threshold with black bounding box',
-                    default=False)
-parser.add_argument('--ROI', help='Adjust the ROI (example: top-left (100,100), bottom-right (500,400)), \
-                    otherwise, detect on the whole image',
-                    nargs=4, type=int, metavar=('x1', 'y1', 'x2', 'y2'),
-                    default=(-1,-1,-1,-1)) # Default ROI is the whole image
-parser.add_argument('--ignore', help='Ignore area: specify as x1 y1 x2 y2. Can be used multiple times.',
-                    nargs=4, type=int, metavar=('x1', 'y1', 'x2', 'y2'),
-                    action='append',
-                    default=[])
-args = parser.parse_args()
-
-
-# Parse user inputs
-model_path = args.model
-img_source = args.source
-min_threshold = args.threshold
-user_res = args.resolution
-show_res = args.showRes
-show_all = args.showAll
-roi_x1, roi_y1, roi_x2, roi_y2 = args.ROI
-ignore_areas = args.ignore
-
-# validate the ignore area values
-for area in ignore_areas:
-    if len(area) != 4:
-        # delete the area if it is not a valid ignore area
-        ignore_areas.remove(area)
-    if area[0] >= area[2] or area[1] >= area[3]:
-        print('ERROR: Invalid ignore area coordinates specified. Please try again.')
-        sys.exit(1)
-
-# sort the ignore areas by x1, y1
-if len(ignore_areas) > 2:
-    ignore_areas.sort(key=lambda x: (x[0], x[1]))
-
-# Check if model file exists and is valid
-if (not os.path.exists(model_path)):
-    print('ERROR: Model path is invalid or model was not found. Make sure the model filename was entered correctly.')
-    sys.exit(1)
 
-# Load the model into memory and get labemap
-model = YOLO(model_path, task='detect')
-labels = model.names
+import MahjongTile as Mahjong
+import MahjongMetrics as Metrics
+import MahjongLayout as Layout
 
-# Parse input to determine if image source is a file, folder
+# Image extensions accepted as a source
 img_ext_list = ['.jpg','.JPG','.jpeg','.JPEG','.png','.PNG','.bmp','.BMP']
 
-if os.path.isdir(img_source):
-    source_type = 'folder'
-elif os.path.isfile(img_source):
-    _, ext = os.path.splitext(img_source)
-    if ext in img_ext_list:
-        source_type = 'image'
-    else:
-        print(f'ERROR: File extension {ext} is not supported.')
-        sys.exit(1)
-else:
-    print(f'ERROR: Input {img_source} is invalid. Please try again.')
-    sys.exit(1)
-
-# Parse user-specified display resolution
-resize = False
-if user_res:
-    resize = True
-    resW, resH = int(user_res.split('x')[0]), int(user_res.split('x')[1])
-
-# Load or initialize image source
-if source_type == 'image':
-    imgs_list = [img_source]
-elif source_type == 'folder':
-    imgs_list = []
-    filelist = glob.glob(img_source + '/*')
-    for file in filelist:
-        _, file_ext = os.path.splitext(file)
-        if file_ext in img_ext_list:
-            imgs_list.append(file)
-
 # Set bounding box colors (using the Tableu 10 color scheme)
-bbox_colors = [(164,120,87), (68,148,228), (93,97,209), (178,182,133), (88,159,106), 
+bbox_colors = [(164,120,87), (68,148,228), (93,97,209), (178,182,133), (88,159,106),
               (96,202,231), (159,124,168), (169,162,241), (98,118,150), (172,176,184)]
 
-# Initialize control and status variables
-img_count = 0
-
-# Begin inference loop
-while True:
+# Inference backends, the exported models sit next to the .pt checkpoint, see MahjongExport.py
+backends = ('pytorch', 'onnx', 'onnx-int8', 'openvino', 'openvino-int8')
+# how a frame is brought to the square model input: the training sets were exported resized to
+# 640x640 (stretch, see Datas/1/README.roboflow.txt), letterbox keeps the aspect ratio and pads
+resize_modes = ('stretch', 'letterbox')
+# bumped whenever the model input built from a frame changes, cached detections of an older one are not reused
+preprocess_version = 2
+
+# JPEG decode scales of cv2.imread, a reduced decode skips most of the IDCT work of a large photo
+reduced_decode_flags = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+                        4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+# Detection results of one frame, kept as arrays instead of per box objects
+# xyxy : (N, 4) int bounding boxes in the preprocessed frame
+# conf : (N,) float confidences
+# cls  : (N,) int class ids, names is the class id -> class name array
+class Detections:
+    __slots__ = ('xyxy', 'conf', 'cls', 'names')
+
+    def __init__(self, xyxy, conf, cls, names):
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls = cls
+        self.names = names
+
+    def __len__(self):
+        return len(self.cls)
+
+    def class_names(self):
+        return self.names[self.cls].tolist()
+
+    # the {'bbox', 'class'} dictionaries used by the faan calculator
+    def to_list(self):
+        return [{'bbox': box, 'class': name} for box, name in zip(self.xyxy.tolist(), self.class_names())]
+
+    # rows and groups of the detected tiles, see MahjongLayout
+    def layout(self):
+        return Layout.tile_layout(self.xyxy, self.class_names())
+
+    # count the detected tiles and flowers into a Mahjong.Hand
+    def to_hand(self):
+        slots = np.array([Mahjong.class_slot.get(name, -1) for name in self.names], dtype=np.int16)[self.cls]
+        if (slots < 0).any():
+            raise ValueError(f'Detected unknown tile class {self.names[self.cls[slots < 0][0]]}')
+        return Mahjong.Hand(np.bincount(slots, minlength=Mahjong.hand_size).astype(np.uint8).tobytes())
+
+# Loads the YOLO model once and runs the detection on any number of frames
+class TileDetector:
+
+    def __init__(self, model_path, threshold=0.2, resolution=None, roi=(-1,-1,-1,-1), ignore_areas=(), device=None, backend=None,
+                 imgsz=None, slice_size=None, slice_overlap=0.2, resize_mode='stretch'):
+        model_path = backend_model_path(model_path, backend)
+        if resize_mode not in resize_modes:
+            raise ValueError(f'Unknown resize mode {resize_mode}, use one of {", ".join(resize_modes)}.')
+        self.resize_mode = resize_mode
+        self.backend = backend or 'pytorch'
+        self.ignore_areas = check_ignore_areas(ignore_areas)
+        self.ignore_array = np.array(self.ignore_areas, dtype=np.int32).reshape(-1, 4)
+        self.roi = check_roi(roi)
+
+        # Parse user-specified resolution
+        self.resize = False
+        if resolution:
+            self.resize = True
+            self.resW, self.resH = int(resolution.split('x')[0]), int(resolution.split('x')[1])
+
+        # Sliced mode: overlapping WxH slices of the frame are run next to the whole frame, see prepare_slices
+        self.slice_size = None
+        if slice_size:
+            self.slice_size = (int(slice_size.split('x')[0]), int(slice_size.split('x')[1]))
+            if min(self.slice_size) <= 0 or not 0 <= float(slice_overlap) < 1:
+                raise ValueError('Invalid slice size or overlap specified. Please try again.')
+        self.slice_overlap = float(slice_overlap)
+
+        self.threshold = float(threshold)
+        self.device = device
+
+        # Check if model file exists and is valid
+        if (not os.path.exists(model_path)):
+            raise FileNotFoundError('Model path is invalid or model was not found. Make sure the model filename was entered correctly.')
+
+        # Load the model into memory and get labemap
+        # ultralytics is only needed once a model is loaded, the rest of the module works without it
+        from ultralytics import YOLO
+        t_start = time.perf_counter()
+        self.model_path = model_path
+        self.model = YOLO(model_path, task='detect')
+        self.labels = self.model.names
+        self.label_array = label_array(self.labels)
+        self.load_time = time.perf_counter() - t_start
+        # the frames are resized to the model input size here (resize_mode), the model never resizes them again
+        self.imgsz = int(imgsz or model_imgsz(self.model, model_path))
+        # model input buffers, reused once their frame went through the model
+        self.buffers = deque()
+
+    # The ROI of the frame resized to the model input size, see PreparedFrame
+    # roi overrides the ROI of the detector for this frame
+    # source_size is the full (W, H) of a frame decoded at a reduced scale by load_file / load_bytes
+    # in sliced mode a SlicedFrame, ignore_areas overrides the ignore areas used to skip slices
+    def preprocess(self, frame, roi=None, source_size=None, ignore_areas=None):
+        roi = self.roi if roi is None else check_roi(roi)
+        size = (self.resW, self.resH) if self.resize else None
+        if self.slice_size:
+            return self.prepare_slices(frame, size, roi, source_size, ignore_areas)
+        return prepare_frame(frame, self.imgsz, size, roi, source_size, self.take_buffer(), self.resize_mode)
+
+    def take_buffer(self):
+        try:
+            return self.buffers.pop()
+        except IndexError:
+            return None
+
+    # The whole ROI plus every slice of it that the ignore areas do not cover, all resized to imgsz
+    # the slices map their boxes into the ROI frame like the whole frame does
+    def prepare_slices(self, frame, size, roi, source_size, ignore_areas=None):
+        whole = prepare_frame(frame, self.imgsz, size, roi, source_size, self.take_buffer(), self.resize_mode)
+        crop_h, crop_w = whole.shape
+        slice_w, slice_h = self.slice_size
+        if crop_w <= slice_w and crop_h <= slice_h:
+            return whole
+        if ignore_areas is None:
+            ignore_array = self.ignore_array
+        else:
+            ignore_array = np.array(check_ignore_areas(ignore_areas), dtype=np.int32).reshape(-1, 4)
+
+        frame_w, frame_h = whole.size
+        x1, y1 = roi[:2] if roi is not None else (0, 0)
+        slices = [whole]
+        skipped = 0
+        for sy in slice_starts(crop_h, slice_h, self.slice_overlap):
+            for sx in slice_starts(crop_w, slice_w, self.slice_overlap):
+                rect = (sx, sy, min(sx + slice_w, crop_w), min(sy + slice_h, crop_h))
+                if covered(rect, ignore_array):
+                    skipped += 1
+                    continue
+                part = prepare_frame(frame, self.imgsz, (frame_w, frame_h),
+                                     (x1 + rect[0], y1 + rect[1], x1 + rect[2], y1 + rect[3]), None, self.take_buffer(),
+                                     self.resize_mode)
+                part.offset += np.array([sx, sy, sx, sy], dtype=np.float32)
+                part.shape = whole.shape
+                slices.append(part)
+        return SlicedFrame(slices, skipped)
+
+    # The resized and ROI cropped frame the detections are reported in, used to draw and track them
+    def view(self, frame, roi=None):
+        roi = self.roi if roi is None else check_roi(roi)
+        return preprocess_frame(frame, (self.resW, self.resH) if self.resize else None, roi)
+
+    # Largest JPEG decode reduction (1, 2, 4 or 8) that still leaves the ROI at least the model input size,
+    # size is the (W, H) of the encoded image, checked in both orientations since the EXIF rotation is unknown
+    def reduction(self, size, roi=None):
+        roi = self.roi if roi is None else check_roi(roi)
+        limit = None
+        for width, height in (size, size[::-1]):
+            frame_w, frame_h = (self.resW, self.resH) if self.resize else (width, height)
+            x1, y1, x2, y2 = roi if roi is not None else (0, 0, frame_w, frame_h)
+            crop_w, crop_h = min(x2, frame_w) - x1, min(y2, frame_h) - y1
+            if self.slice_size:
+                # every slice has to keep its detail, not only the whole ROI
+                crop_w, crop_h = min(crop_w, self.slice_size[0]), min(crop_h, self.slice_size[1])
+            crop_w, crop_h = crop_w * width / frame_w, crop_h * height / frame_h
+            # stretch scales each side to imgsz, so the short one limits; letterbox scales the long one to imgsz
+            side = min(crop_w, crop_h) if self.resize_mode == 'stretch' else max(crop_w, crop_h)
+            limit = side if limit is None else min(limit, side)
+        for factor in (8, 4, 2):
+            if limit >= self.imgsz * factor:
+                return factor
+        return 1
+
+    # Decode an image, a JPEG at the smallest scale the detection allows
+    # returns the frame and the (W, H) of the full image when it was decoded at a reduced scale, else None
+    def load_bytes(self, data, roi=None):
+        size = jpeg_size(data)
+        factor = self.reduction(size, roi) if size else 1
+        frame = decode_image(data, factor)
+        if factor == 1:
+            return frame, None
+        width, height = size
+        # EXIF rotated photos are decoded upright
+        if (frame.shape[1] > frame.shape[0]) != (width > height):
+            width, height = height, width
+        return frame, (width, height)
+
+    def load_file(self, img_filename, roi=None):
+        try:
+            with open(img_filename, 'rb') as f:
+                data = f.read()
+        except OSError:
+            raise ValueError(f'Image {img_filename} could not be read.')
+        try:
+            return self.load_bytes(data, roi)
+        except ValueError:
+            raise ValueError(f'Image {img_filename} could not be read.')
+
+    # Run the model on a preprocessed frame
+    # keep_all keeps the detections below the threshold, used to display them
+    # ignore_areas overrides the ignore areas of the detector for this frame
+    def infer(self, frame, keep_all=False, ignore_areas=None, trace=Metrics.null_trace):
+        return self.infer_batch([frame], keep_all, [ignore_areas], [trace])[0]
+
+    # Run the model once on a list of preprocessed frames, the slices of all frames in the same batch
+    # traces get a share of the batch inference time by number of slices and their own post-processing time
+    def infer_batch(self, frames, keep_all=False, ignore_areas_list=None, traces=None):
+        if not frames:
+            return []
+        if ignore_areas_list is None:
+            ignore_areas_list = [None] * len(frames)
+        if traces is None:
+            traces = [Metrics.null_trace] * len(frames)
+        inputs = [part.input for frame in frames for part in frame.slices]
+        t_start = time.perf_counter()
+        if self.device is None:
+            results = self.model(inputs, verbose=False, imgsz=self.imgsz)
+        else:
+            results = self.model(inputs, verbose=False, imgsz=self.imgsz, device=self.device)
+        inference_share = (time.perf_counter() - t_start) / len(inputs)
+        for frame in frames:
+            frame.release(self.buffers)
+
+        detections_list = []
+        results = iter(results)
+        for frame, ignore_areas, trace in zip(frames, ignore_areas_list, traces):
+            trace.add('inference', inference_share * len(frame.slices))
+            boxes_list = [result.boxes for result in itertools.islice(results, len(frame.slices))]
+            detections = self.to_detections(boxes_list, frame.slices, keep_all, ignore_areas)
+            trace.mark('postprocess')
+            trace.set('detections', len(detections))
+            if len(frame.slices) > 1:
+                trace.set('slices', len(frame.slices) - 1)
+            detections_list.append(detections)
+        return detections_list
+
+    # Map the boxes of the slices of one frame back to the frame, merge the boxes of overlapping slices
+    # and filter them by threshold and ignore areas
+    def to_detections(self, boxes_list, slices, keep_all=False, ignore_areas=None):
+        if ignore_areas is None:
+            ignore_array = self.ignore_array
+        else:
+            ignore_array = np.array(check_ignore_areas(ignore_areas), dtype=np.int32).reshape(-1, 4)
+        threshold = 0.0 if keep_all else self.threshold
+        # one device to host copy per slice for all its boxes: x1, y1, x2, y2, conf, cls
+        data = [boxes.data.cpu().numpy() for boxes in boxes_list]
+        xyxy = np.concatenate([part.map_boxes(d[:, :4]) for part, d in zip(slices, data)])
+        conf = np.concatenate([d[:, 4] for d in data])
+        cls = np.concatenate([d[:, 5] for d in data])
+        if len(slices) > 1:
+            xyxy, conf, cls = merge_boxes(xyxy, conf, cls, threshold)
+        return filter_boxes(xyxy, conf, cls, self.label_array, threshold, ignore_array)
+
+    def detect(self, frame, keep_all=False, roi=None, ignore_areas=None, trace=Metrics.null_trace, source_size=None):
+        frame = self.preprocess(frame, roi, source_size, ignore_areas)
+        trace.mark('preprocess')
+        return self.infer(frame, keep_all, ignore_areas, trace)
+
+    def detect_file(self, img_filename, keep_all=False, roi=None, ignore_areas=None, trace=Metrics.null_trace):
+        frame, source_size = self.load_file(img_filename, roi)
+        trace.mark('load')
+        return self.detect(frame, keep_all, roi, ignore_areas, trace, source_size)
+
+    # Throughput mode for many images: background threads read and preprocess the
+    # next images while the model runs on mini-batches of batch_size frames
+    # yields (img_filename, frame, detections) in input order, frame is the PreparedFrame
+    def detect_files(self, img_files, batch_size=8, workers=2, keep_all=False):
+        batch_size = max(1, int(batch_size))
+        files = iter(img_files)
+
+        def load(img_filename):
+            trace = Metrics.start(img_filename)
+            frame, source_size = self.load_file(img_filename)
+            trace.mark('load')
+            frame = self.preprocess(frame, source_size=source_size)
+            trace.mark('preprocess')
+            return frame, trace
+
+        with ThreadPoolExecutor(max_workers=max(1, int(workers))) as pool:
+            # keep two batches decoding ahead of the model
+            pending = deque((img_filename, pool.submit(load, img_filename))
+                            for img_filename in itertools.islice(files, batch_size * 2))
+            while pending:
+                batch = [pending.popleft() for _ in range(min(batch_size, len(pending)))]
+                for img_filename in itertools.islice(files, len(batch)):
+                    pending.append((img_filename, pool.submit(load, img_filename)))
+
+                frames, traces = zip(*(future.result() for _, future in batch))
+                detections_list = self.infer_batch(list(frames), keep_all, traces=list(traces))
+                for (img_filename, _), frame, detections, trace in zip(batch, frames, detections_list, traces):
+                    Metrics.finish(trace)
+                    yield img_filename, frame, detections
+
+# A frame ready for the model
+# input       : the ROI resized to imgsz x imgsz, the only resampling of the frame
+# map_boxes() : model input boxes -> boxes in the detector frame, the frame resized to the
+#               detector resolution and cropped to the ROI, as the ROI and the ignore areas are given
+# display()   : the detector frame itself, only built when the detections are drawn or tracked
+class PreparedFrame:
+    __slots__ = ('input', 'gain', 'offset', 'shape', 'source', 'size', 'roi', 'pooled')
+
+    def __init__(self, input, gain, offset, shape, source, size, roi):
+        self.input = input
+        self.gain = gain
+        self.offset = offset
+        self.shape = shape
+        self.source = source
+        self.size = size
+        self.roi = roi
+        self.pooled = False
+
+    def map_boxes(self, xyxy):
+        xyxy = xyxy * self.gain + self.offset
+        height, width = self.shape
+        return np.clip(xyxy, 0, [width, height, width, height])
+
+    def display(self):
+        height, width = self.source.shape[:2]
+        return preprocess_frame(self.source, None if self.size == (width, height) else self.size, self.roi)
+
+    # the model inputs of the frame, one
+    @property
+    def slices(self):
+        return (self,)
+
+    # hand the input buffer back to the detector, the frame can not be run again after the next preprocess
+    def release(self, buffers):
+        if not self.pooled:
+            self.pooled = True
+            buffers.append(self.input)
+
+# A frame prepared for sliced inference: the whole ROI first, then its slices
+# skipped counts the slices left out because the ignore areas cover them
+class SlicedFrame:
+    __slots__ = ('slices', 'skipped')
+
+    def __init__(self, slices, skipped=0):
+        self.slices = slices
+        self.skipped = skipped
+
+    @property
+    def shape(self):
+        return self.slices[0].shape
+
+    def display(self):
+        return self.slices[0].display()
+
+    def release(self, buffers):
+        for part in self.slices:
+            part.release(buffers)
+
+# start offsets of slices of size with the given overlap fraction along a side of length,
+# the last slice ends on the edge
+def slice_starts(length, size, overlap):
+    if length <= size:
+        return [0]
+    step = max(1, int(size * (1 - overlap)))
+    starts = list(range(0, length - size, step))
+    starts.append(length - size)
+    return starts
+
+# True when the ignore areas cover the whole rect, no detection in it could be kept
+def covered(rect, ignore_array):
+    if not len(ignore_array):
+        return False
+    x1, y1, x2, y2 = rect
+    mask = np.zeros((y2 - y1, x2 - x1), dtype=bool)
+    for ax1, ay1, ax2, ay2 in ignore_array:
+        mask[max(ay1 - y1, 0):max(ay2 - y1, 0), max(ax1 - x1, 0):max(ax2 - x1, 0)] = True
+    return bool(mask.all())
+
+# Merge the boxes of overlapping slices (greedy non-maximum merging)
+# a tile seen by several slices, or cut by a slice edge, gives boxes that cover most of the smaller one;
+# in confidence order each box absorbs the remaining boxes whose intersection over the smaller
+# area reaches ios_threshold, it keeps its confidence and class and grows to their union
+# boxes below threshold are dropped first
+def merge_boxes(xyxy, conf, cls, threshold=0.0, ios_threshold=0.5):
+    order = np.flatnonzero(conf >= threshold)
+    order = order[np.argsort(-conf[order], kind='stable')]
+    xyxy, conf, cls = xyxy[order], conf[order], cls[order]
+    ios = ios_matrix(xyxy, xyxy)
+    merged = np.zeros(len(xyxy), dtype=bool)
+    leaders = []
+    boxes = []
+    for i in range(len(xyxy)):
+        if merged[i]:
+            continue
+        group = np.flatnonzero(~merged & (ios[i] >= ios_threshold))
+        merged[group] = True
+        merged[i] = True
+        leaders.append(i)
+        group = xyxy[np.append(group, i)]
+        boxes.append((group[:, 0].min(), group[:, 1].min(), group[:, 2].max(), group[:, 3].max()))
+    return np.array(boxes, dtype=np.float32).reshape(-1, 4), conf[leaders], cls[leaders]
+
+# crop the ROI out of the source frame and resize it straight to imgsz, see resize_modes
+# size is the detector resolution (W, H), the ROI is given in the frame resized to it;
+# source_size is the full (W, H) a reduced decode of the frame stands for
+# out is an optional (imgsz, imgsz, 3) buffer to resize into
+def prepare_frame(frame, imgsz, size=None, roi=None, source_size=None, out=None, resize_mode='stretch'):
+    height, width = frame.shape[:2]
+    if height <= 0 or width <= 0:
+        raise ValueError('Invalid image size. Please check the input image.')
+    frame_w, frame_h = size or source_size or (width, height)
+    x1, y1, x2, y2 = roi if roi is not None else (0, 0, frame_w, frame_h)
+    x2, y2 = min(x2, frame_w), min(y2, frame_h)
+    if x1 >= x2 or y1 >= y2:
+        raise ValueError('Invalid ROI coordinates specified. Please try again.')
+
+    # the ROI in source pixels, a view of the frame, nothing is copied
+    fx, fy = width / frame_w, height / frame_h
+    sx1, sy1 = int(round(x1 * fx)), int(round(y1 * fy))
+    sx2, sy2 = max(sx1 + 1, int(round(x2 * fx))), max(sy1 + 1, int(round(y2 * fy)))
+    if out is not None and out.shape != (imgsz, imgsz, 3):
+        out = None
+    image, (scale_x, scale_y), (pad_x, pad_y) = resize_input(frame[sy1:sy2, sx1:sx2], imgsz, out, resize_mode)
+
+    # model input -> source -> detector frame
+    gain = np.array([1 / (scale_x * fx), 1 / (scale_y * fy)] * 2, dtype=np.float32)
+    offset = np.array([(sx1 - pad_x / scale_x) / fx - x1, (sy1 - pad_y / scale_y) / fy - y1] * 2, dtype=np.float32)
+    return PreparedFrame(image, gain, offset, (y2 - y1, x2 - x1), frame, (frame_w, frame_h), roi)
+
+# Post-process the raw boxes of one frame with array masks
+# xyxy (N, 4), conf (N,), cls (N,) as returned by the model, ignore_array (M, 4)
+# a box is dropped when it is below the threshold or touches any ignore area
+def filter_boxes(xyxy, conf, cls, labels, threshold, ignore_array):
+    xyxy = xyxy.astype(np.int32)
+    keep = conf >= threshold
+    if len(ignore_array):
+        xmin, ymin, xmax, ymax = (xyxy[:, k, None] for k in range(4))
+        overlap = ~((xmax < ignore_array[:, 0]) | (xmin > ignore_array[:, 2]) |
+                    (ymax < ignore_array[:, 1]) | (ymin > ignore_array[:, 3]))
+        keep &= ~overlap.any(axis=1)
+    return Detections(xyxy[keep], conf[keep].astype(np.float32), cls[keep].astype(np.int32), labels)
+
+# Intersection of every box in a (N, 4) with every box in b (M, 4), and the box areas
+def intersections(a, b):
+    a = a.astype(np.float32)
+    b = b.astype(np.float32)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter, area_a, area_b
+
+# Intersection over the smaller area of every box in a (N, 4) against every box in b (M, 4)
+def ios_matrix(a, b):
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), dtype=np.float32)
+    inter, area_a, area_b = intersections(a, b)
+    return inter / np.maximum(np.minimum(area_a[:, None], area_b[None, :]), 1e-6)
+
+# Intersection over union of every box in a (N, 4) against every box in b (M, 4)
+def iou_matrix(a, b):
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), dtype=np.float32)
+    inter, area_a, area_b = intersections(a, b)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+# class id -> class name lookup array built from the model label map
+def label_array(names):
+    labels = np.empty(max(names) + 1 if names else 0, dtype=object)
+    for idx, name in names.items():
+        labels[idx] = name
+    return labels
+
+# validate the ignore area values, returns the valid areas sorted by x1, y1
+def check_ignore_areas(ignore_areas):
+    areas = []
+    for area in ignore_areas:
+        if len(area) != 4:
+            # skip the area if it is not a valid ignore area
+            continue
+        if area[0] >= area[2] or area[1] >= area[3]:
+            raise ValueError('Invalid ignore area coordinates specified. Please try again.')
+        areas.append([int(v) for v in area])
+    areas.sort(key=lambda x: (x[0], x[1]))
+    return areas
+
+# validate the ROI, returns None when the whole image is used
+def check_roi(roi):
+    if roi is None or not all(v >= 0 for v in roi):
+        return None
+    roi = tuple(int(v) for v in roi)
+    if roi[0] >= roi[2] or roi[1] >= roi[3]:
+        raise ValueError('Invalid ROI coordinates specified. Please try again.')
+    return roi
+
+# the exported file of a backend for a .pt checkpoint, e.g. Model/5/my_model_int8.onnx
+# a quantized model is only used after MahjongExport.py accepted its accuracy
+def backend_model_path(model_path, backend=None):
+    if not backend or backend == 'pytorch':
+        return model_path
+    stem = os.path.splitext(model_path)[0]
+    paths = {
+        'onnx': stem + '.onnx',
+        'onnx-int8': stem + '_int8.onnx',
+        'openvino': stem + '_openvino_model',
+        'openvino-int8': stem + '_int8_openvino_model',
+    }
+    if backend not in paths:
+        raise ValueError(f'Unknown backend {backend}, use one of {", ".join(backends)}.')
+    path = paths[backend]
+    if backend.endswith('-int8'):
+        report_path = accuracy_report_path(path)
+        accepted = False
+        if os.path.exists(report_path):
+            with open(report_path) as f:
+                accepted = json.load(f).get('accepted', False)
+        if not accepted:
+            raise ValueError(f'{path} has not passed the accuracy check, run MahjongExport.py --int8 first.')
+    return path
+
+# accuracy check result written next to an exported model
+def accuracy_report_path(exported_path):
+    return exported_path.rstrip('/\\') + '.accuracy.json'
+
+# resize the frame to size (W, H) when given, then crop it to the ROI
+def preprocess_frame(frame, size=None, roi=None):
+    if size is not None:
+        frame = cv2.resize(frame, size)
+
+    if roi is not None:
+        if frame.shape[0] <= 0 or frame.shape[1] <= 0:
+            raise ValueError('Invalid image size. Please check the input image.')
+        roi_x1, roi_y1, roi_x2, roi_y2 = roi
+        frame = frame[roi_y1:roi_y2, roi_x1:roi_x2]
+    return frame
+
+# scale the frame to fit a size x size square keeping its aspect ratio and pad it with grey (114)
+# like ultralytics, out is an optional (size, size, 3) buffer reused between frames
+# returns the padded frame, the scale and the (x, y) padding
+def letterbox(frame, size, out=None):
+    height, width = frame.shape[:2]
+    scale = min(size / width, size / height)
+    new_w, new_h = max(1, round(width * scale)), max(1, round(height * scale))
+    pad_x, pad_y = (size - new_w) // 2, (size - new_h) // 2
+    if out is None:
+        out = np.empty((size, size, 3), dtype=np.uint8)
+    out[:] = 114
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+    out[pad_y:pad_y + new_h, pad_x:pad_x + new_w] = cv2.resize(frame, (new_w, new_h), interpolation=interpolation)
+    return out, scale, (pad_x, pad_y)
+
+# scale the frame to fill a size x size square, like the 640x640 stretch export of the training images
+# returns the frame, the (x, y) scales and no padding, like letterbox
+def stretch(frame, size, out=None):
+    height, width = frame.shape[:2]
+    if out is None:
+        out = np.empty((size, size, 3), dtype=np.uint8)
+    interpolation = cv2.INTER_AREA if size < width or size < height else cv2.INTER_LINEAR
+    out[:] = cv2.resize(frame, (size, size), interpolation=interpolation)
+    return out, (size / width, size / height), (0, 0)
+
+# the model input of a frame in one of resize_modes, returns the frame, the (x, y) scales and the (x, y) padding
+def resize_input(frame, size, out=None, resize_mode='stretch'):
+    if resize_mode == 'stretch':
+        return stretch(frame, size, out)
+    if resize_mode == 'letterbox':
+        out, scale, pad = letterbox(frame, size, out)
+        return out, (scale, scale), pad
+    raise ValueError(f'Unknown resize mode {resize_mode}, use one of {", ".join(resize_modes)}.')
+
+# class id -> name map of a labelImg classes.txt, names use the model spelling ('f1-s' -> 'f1_s')
+def read_class_names(classes_file):
+    with open(classes_file) as f:
+        return {idx: line.strip().replace('-', '_') for idx, line in enumerate(f) if line.strip()}
+
+# ground truth boxes of a YOLO label file for an image of width x height
+# returns (xyxy, cls) arrays in pixels
+def read_labels(label_file, width, height):
+    rows = np.loadtxt(label_file, ndmin=2).reshape(-1, 5)
+    cls = rows[:, 0].astype(np.int32)
+    x_center, y_center = rows[:, 1] * width, rows[:, 2] * height
+    half_w, half_h = rows[:, 3] * width / 2, rows[:, 4] * height / 2
+    xyxy = np.stack([x_center - half_w, y_center - half_h, x_center + half_w, y_center + half_h], axis=1)
+    return xyxy.round().astype(np.int32), cls
+
+def read_image(img_filename):
+    frame = cv2.imread(img_filename)
+    if frame is None:
+        raise ValueError(f'Image {img_filename} could not be read.')
+    return frame
+
+# decode an encoded image (jpg, png, ...) from memory, a JPEG at 1 / reduce of its size (1, 2, 4 or 8)
+def decode_image(data, reduce=1):
+    frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), reduced_decode_flags[reduce])
+    if frame is None:
+        raise ValueError('Image data could not be decoded.')
+    return frame
+
+# (W, H) of a JPEG from its frame header, None for any other format
+def jpeg_size(data):
+    if data[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        # start of frame markers, except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(data[i + 5:i + 7], 'big')
+            width = int.from_bytes(data[i + 7:i + 9], 'big')
+            return (width, height) if width and height else None
+        if marker == 0xFF or marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2 if marker != 0xFF else 1
+            continue
+        i += 2 + int.from_bytes(data[i + 2:i + 4], 'big')
+    return None
+
+# input size of a loaded model: the imgsz it was trained or exported with, else the training run's
+def model_imgsz(model, model_path):
+    imgsz = getattr(model, 'overrides', {}).get('imgsz') or training_imgsz(model_path)
+    return max(imgsz) if isinstance(imgsz, (list, tuple)) else int(imgsz)
+
+# imgsz of the training run next to a model (train*/args.yaml), default when there is none
+def training_imgsz(model_path, default=640):
+    for args_file in sorted(glob.glob(os.path.join(os.path.dirname(model_path), 'train*', 'args.yaml'))):
+        with open(args_file) as f:
+            match = re.search(r'^imgsz:\s*(\d+)', f.read(), re.MULTILINE)
+        if match:
+            return int(match.group(1))
+    return default
+
+# Draw the detections and the ignore areas on the preprocessed frame
+def draw_detections(frame, detections, threshold, ignore_areas=()):
+    for (xmin, ymin, xmax, ymax), conf, classidx in zip(detections.xyxy, detections.conf, detections.cls):
+        classname = detections.names[int(classidx)]
+        # draw label with class name and confidence in 3 decimal places
+        color = bbox_colors[classidx % 10]
+        text_color = (0, 0, 0)
+        if conf < threshold:
+            # Draw bounding box for objects below the threshold
+            color = (0, 0, 0)
+            text_color = (255, 255, 255)
+        cv2.rectangle(frame, (xmin,ymin), (xmax,ymax), color, 2)
+        s_conf = f'{conf:.3f}' # Format confidence to 3 decimal places
+        label = f'{classname} : {s_conf}'
+        labelSize, baseLine = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1) # Get font size
+        label_ymin = max(ymin, labelSize[1] + 10) # Make sure not to draw label too close to top of window
+        cv2.rectangle(frame, (xmin, label_ymin-labelSize[1]-10), (xmin+labelSize[0], label_ymin+baseLine-10), color, cv2.FILLED) # Draw white box to put label text in
+        cv2.putText(frame, label, (xmin, label_ymin-7), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1) # Draw label text
+
+    # draw ignore areas if specified
+    for area in ignore_areas:
+        cv2.rectangle(frame, (area[0], area[1]), (area[2], area[3]), (0,0,255), 2)
+        cv2.putText(frame, 'Ignore Area', (area[0], area[1]-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,0,255), 1)
+
+    # Draw total number of detected objects
+    cv2.putText(frame, f'Number of objects: {len(detections)}', (10, frame.shape[0] - 10), cv2.FONT_HERSHEY_SIMPLEX, .7, (0,255,255), 2)
+    return frame
+
+# Draws, encodes and writes annotated frames on a thread pool so inference does not wait for it
+# at most workers * 2 frames are queued, submit blocks when the writers fall behind
+class AnnotationWriter:
+
+    def __init__(self, output_dir, threshold, ignore_areas=(), workers=2, ext='.jpg'):
+        os.makedirs(output_dir, exist_ok=True)
+        self.output_dir = output_dir
+        self.threshold = threshold
+        self.ignore_areas = ignore_areas
+        self.ext = ext if ext.startswith('.') else '.' + ext
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        self.slots = threading.BoundedSemaphore(max(1, workers) * 2)
+        self.written = 0
+        self.errors = []
+
+    def submit(self, img_filename, frame, detections):
+        self.slots.acquire()
+        future = self.pool.submit(self.write, img_filename, frame, detections)
+        future.add_done_callback(self.done)
+
+    def write(self, img_filename, frame, detections):
+        if isinstance(frame, PreparedFrame):
+            frame = frame.display()
+        draw_detections(frame, detections, self.threshold, self.ignore_areas)
+        ok, data = cv2.imencode(self.ext, frame)
+        if not ok:
+            raise ValueError(f'Image {img_filename} could not be encoded.')
+        name = os.path.splitext(os.path.basename(img_filename))[0] + self.ext
+        data.tofile(os.path.join(self.output_dir, name))
+
+    def done(self, future):
+        if future.exception() is not None:
+            self.errors.append(str(future.exception()))
+        else:
+            self.written += 1
+        self.slots.release()
+
+    # wait for the queued frames to be written
+    def close(self):
+        self.pool.shutdown(wait=True)
 
+# Parse input to determine if image source is a file, folder
+def list_images(img_source):
+    if os.path.isdir(img_source):
+        imgs_list = []
+        filelist = glob.glob(img_source + '/*')
+        for file in filelist:
+            _, file_ext = os.path.splitext(file)
+            if file_ext in img_ext_list:
+                imgs_list.append(file)
+        return imgs_list
+    elif os.path.isfile(img_source):
+        _, ext = os.path.splitext(img_source)
+        if ext in img_ext_list:
+            return [img_source]
+        raise ValueError(f'File extension {ext} is not supported.')
+    raise ValueError(f'Input {img_source} is invalid. Please try again.')
+
+# print the detections of every image and the overall images/sec
+# writer is an optional AnnotationWriter, without it nothing is drawn
+def run_throughput(detector, imgs_list, batch_size, workers, keep_all=False, writer=None):
     t_start = time.perf_counter()
+    img_count = 0
+    try:
+        for img_filename, frame, detections in detector.detect_files(imgs_list, batch_size, workers, keep_all):
+            img_count += 1
+            print(f'Image: {img_filename}')
+            for (xmin, ymin, xmax, ymax), classname in zip(detections.xyxy, detections.class_names()):
+                print(f'BBox: ({xmin}, {ymin}), ({xmax}, {ymax}), Class: {classname}')
+            if writer is not None:
+                writer.submit(img_filename, frame, detections)
+    except ValueError as e:
+        print(f'ERROR: {e}')
+        sys.exit(1)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is not None:
+        for error in writer.errors:
+            print(f'ERROR: {error}')
+        print(f'{writer.written} annotated images written to {writer.output_dir}')
+    elapsed = time.perf_counter() - t_start
+    print(f'All images have been processed: {img_count} images in {elapsed:.2f}s ({img_count / max(elapsed, 1e-9):.2f} images/sec)')
+
+def main():
+    # Define and parse user input arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', help='Path to YOLO model file (example: "runs/detect/train/weights/best.pt")',
+                        required=True)
+    parser.add_argument('--source', help='Image source, can be image file ("test.jpg"), image folder ("test_dir")',
+                        required=True)
+    parser.add_argument('--threshold', help='Minimum confidence threshold for displaying detected objects (example: "0.4")',
+                        default=0.2)
+    parser.add_argument('--resolution', help='Resolution in WxH to display inference results at (example: "640x480"), \
+                        otherwise, match source resolution',
+                        default=None)
+    parser.add_argument('--showRes', help='show the result of the dectection in a new window',
+                        default=False)
+    parser.add_argument('--showAll', help='show the result below the threshold with black bounding box',
+                        default=False)
+    parser.add_argument('--ROI', help='Adjust the ROI (example: top-left (100,100), bottom-right (500,400)), \
+                        otherwise, detect on the whole image',
+                        nargs=4, type=int, metavar=('x1', 'y1', 'x2', 'y2'),
+                        default=(-1,-1,-1,-1)) # Default ROI is the whole image
+    parser.add_argument('--ignore', help='Ignore area: specify as x1 y1 x2 y2. Can be used multiple times.',
+                        nargs=4, type=int, metavar=('x1', 'y1', 'x2', 'y2'),
+                        action='append',
+                        default=[])
+    parser.add_argument('--batch', help='Throughput mode: run the images without waiting for a key, in mini-batches of this size',
+                        type=int, default=0)
+    parser.add_argument('--workers', help='Number of background threads reading and writing the images in throughput mode',
+                        type=int, default=2)
+    parser.add_argument('--headless', help='Never open a window, run all the images like the throughput mode',
+                        default=False)
+    parser.add_argument('--output', help='Directory to write the annotated images to in throughput or headless mode, \
+                        nothing is drawn when not set',
+                        default=None)
+    parser.add_argument('--format', help='Image format of the annotated images: "jpg" or "png"',
+                        choices=['jpg', 'png'], default='jpg')
+    parser.add_argument('--backend', help='Inference backend, the exported model next to --model is used (see MahjongExport.py)',
+                        choices=backends, default=None)
+    parser.add_argument('--slice', help='Sliced inference for large table photos: also run overlapping WxH slices of the frame \
+                        (example: "640x640"), in the coordinates of --resolution',
+                        default=None)
+    parser.add_argument('--overlap', help='Overlap of neighbouring slices as a fraction of the slice size',
+                        type=float, default=0.2)
+    parser.add_argument('--resize', help='How a frame becomes the square model input: "stretch" like the training images or \
+                        "letterbox" keeping the aspect ratio',
+                        choices=resize_modes, default='stretch')
+    parser.add_argument('--metrics_jsonl', help='Append the stage timings of every image to this JSON lines file',
+                        default=None)
+    parser.add_argument('--metrics_prom', help='Write stage timing histograms to this Prometheus text file',
+                        default=None)
+    args = parser.parse_args()
+
+    # Parse user inputs
+    show_res = args.showRes
+    show_all = args.showAll
+
+    try:
+        imgs_list = list_images(args.source)
+        detector = TileDetector(args.model, args.threshold, args.resolution, args.ROI, args.ignore, backend=args.backend,
+                                slice_size=args.slice, slice_overlap=args.overlap, resize_mode=args.resize)
+    except (ValueError, FileNotFoundError) as e:
+        print(f'ERROR: {e}')
+        sys.exit(1)
 
-    # Load frame from image source
-    if img_count >= len(imgs_list):
-        print('All images have been processed. Exiting program.')
+    if args.metrics_jsonl or args.metrics_prom:
+        Metrics.enable(args.metrics_jsonl, args.metrics_prom)
+
+    if args.batch > 0 or args.headless:
+        writer = None
+        if args.output:
+            writer = AnnotationWriter(args.output, detector.threshold, detector.ignore_areas, args.workers, args.format)
+        run_throughput(detector, imgs_list, max(args.batch, 1), args.workers, bool(show_all), writer)
+        Metrics.disable()
         sys.exit(0)
-    img_filename = imgs_list[img_count]
-    frame = cv2.imread(img_filename)
-    img_count = img_count + 1
 
-    # Resize frame to desired display resolution
-    if resize == True:
-        frame = cv2.resize(frame,(resW,resH))
-    else:
-        resW, resH = frame.shape[1], frame.shape[0]
+    # Begin inference loop
+    for img_filename in imgs_list:
 
-    # Check if ROI is specified, if so, crop the frame to the ROI
-    if roi_x1 >= 0 and roi_y1 >= 0 and roi_x2 >= 0 and roi_y2 >= 0:
-        # return error if ROI coordinates are invalid
-        if roi_x1 >= roi_x2 or roi_y1 >= roi_y2:
-            print('ERROR: Invalid ROI coordinates specified. Please try again.')
-            sys.exit(1)
+        trace = Metrics.start(img_filename)
 
-        if resW <= 0 or resH <= 0:
-            print('ERROR: Invalid image size. Please check the input image.')
+        # Load frame from image source
+        try:
+            frame, source_size = detector.load_file(img_filename)
+            trace.mark('load')
+            prepared = detector.preprocess(frame, source_size=source_size)
+            trace.mark('preprocess')
+        except ValueError as e:
+            print(f'ERROR: {e}')
+            Metrics.disable()
             sys.exit(1)
 
-        # Crop the frame to the specified ROI
-        frame = frame[roi_y1:roi_y2, roi_x1:roi_x2]
-
-    # Run inference on frame
-    results = model(frame, verbose=False)
-
-    # Extract results
-    detections = results[0].boxes
-
-    # Initialize variable for basic object counting example
-    object_count = 0
-
-    # Go through each detection and get bbox coords, confidence, and class
-    for i in range(len(detections)):
-
-        # count the number of objects in the image
-        object_count +=  1
-
-        # Get bounding box coordinates
-        # Ultralytics returns results in Tensor format, Converte to a regular Python array
-        xyxy_tensor = detections[i].xyxy.cpu() # Detections in Tensor format in CPU memory
-        xyxy = xyxy_tensor.numpy().squeeze() # Convert tensors to Numpy array
-        xmin, ymin, xmax, ymax = xyxy.astype(int) # Extract individual coordinates and convert to int
-
-        if not user_res:
-            resW, resH = frame.shape[1], frame.shape[0] # Default to source resolution
-
-        # Get bounding box confidence
-        conf = detections[i].conf.item()
-        if conf < float(min_threshold) and not show_all:
-            # Skip detections below the confidence threshold
-            continue
-
-        # check if the bounding box area is within the ignore areas
-        ignore = False
-        for area in ignore_areas:
-            if not (xmax < area[0] or xmin > area[2] or ymax < area[1] or ymin > area[3]):
-                # Bounding box is within the ignore area
-                ignore = True
-                break
-        if ignore:
-            continue
-
-        # Get bounding box class ID and name
-        classidx = int(detections[i].cls.item())
-        classname = labels[classidx]
+        # Run inference on frame
+        detections = detector.infer(prepared, keep_all=bool(show_all), trace=trace)
+        Metrics.finish(trace)
+        # the interactive loop waits for a key anyway, the frame to draw on is built here
+        frame = prepared.display()
 
         # print all detections
-        # print(f'Detection {i}: Class: {classname}, Confidence: {conf:.2f}, BBox: ({xmin}, {ymin}), ({xmax}, {ymax})')
-        print(f'BBox: ({xmin}, {ymin}), ({xmax}, {ymax}), Class: {classname}')
+        for (xmin, ymin, xmax, ymax), classname in zip(detections.xyxy, detections.class_names()):
+            print(f'BBox: ({xmin}, {ymin}), ({xmax}, {ymax}), Class: {classname}')
 
         if show_res:
-            # draw label with class name and confidence in 3 decimal places
-            color = bbox_colors[classidx % 10]
-            text_color = (0, 0, 0)
-            if show_all and conf < float(min_threshold):
-                # Draw bounding box for objects below the threshold
-                color = (0, 0, 0)
-                text_color = (255, 255, 255)
-            cv2.rectangle(frame, (xmin,ymin), (xmax,ymax), color, 2)
-            s_conf = f'{conf:.3f}' # Format confidence to 3 decimal places
-            label = f'{classname} : {s_conf}'
-            labelSize, baseLine = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1) # Get font size
-            label_ymin = max(ymin, labelSize[1] + 10) # Make sure not to draw label too close to top of window
-            cv2.rectangle(frame, (xmin, label_ymin-labelSize[1]-10), (xmin+labelSize[0], label_ymin+baseLine-10), color, cv2.FILLED) # Draw white box to put label text in
-            cv2.putText(frame, label, (xmin, label_ymin-7), cv2.FONT_HERSHEY_SIMPLEX, 0.5, text_color, 1) # Draw label text
-            # draw ignore areas if specified
-            for area in ignore_areas:
-                cv2.rectangle(frame, (area[0], area[1]), (area[2], area[3]), (0,0,255), 2)
-                cv2.putText(frame, 'Ignore Area', (area[0], area[1]-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,0,255), 1)
-
-    if show_res:
-        # Display detection results
-        cv2.putText(frame, f'Number of objects: {object_count}', (10,resH - 10), cv2.FONT_HERSHEY_SIMPLEX, .7, (0,255,255), 2) # Draw total number of detected objects
-        cv2.imshow('YOLO detection results',frame) # Display image
-
-    # Get user input
-    key = cv2.waitKey()
-    if key == ord('q') or key == ord('Q'): # Press 'q' to quit
-        break
-    elif key == ord('s') or key == ord('S'): # Press 's' to pause inference
-        cv2.waitKey()
-    elif key == ord('p') or key == ord('P'): # Press 'p' to save a picture of results on this frame
-        cv2.imwrite('capture.png',frame)
-
-# Clean up
-cv2.destroyAllWindows()
-sys.exit(0)
\ No newline at end of file
+            # Display detection results
+            draw_detections(frame, detections, detector.threshold, detector.ignore_areas)
+            cv2.imshow('YOLO detection results',frame) # Display image
+
+        # Get user input
+        key = cv2.waitKey()
+        if key == ord('q') or key == ord('Q'): # Press 'q' to quit
+            break
+        elif key == ord('s') or key == ord('S'): # Press 's' to pause inference
+            cv2.waitKey()
+        elif key == ord('p') or key == ord('P'): # Press 'p' to save a picture of results on this frame
+            cv2.imwrite('capture.png',frame)
+    else:
+        print('All images have been processed. Exiting program.')
+
+    # Clean up
+    cv2.destroyAllWindows()
+    Metrics.disable()
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
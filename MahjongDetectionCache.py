@@ -0,0 +1,293 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+
+import numpy as np
+
+import MahjongMetrics as Metrics
+from MahjongDetect import (TileDetector, Detections, check_roi, check_ignore_areas, backend_model_path,
+                           training_imgsz, preprocess_version, resize_modes)
+
+# Content addressed on-disk cache of post-processed detections
+#
+# An entry is keyed by the hash of the image bytes, the hash of the model file and every
+# parameter that changes the detections (threshold, resolution, ROI, ignore areas, keep_all,
+# the model input size and resize mode, the backend model file and MahjongDetect.preprocess_version),
+# so a changed image, model, setting or preprocessing never reads a stale result. Scoring
+# changes can replay a folder of images without running the model.
+#
+# The cache is one SQLite file in WAL mode, any number of processes can read and write it.
+# Entries are evicted least recently used first once the stored boxes exceed max_bytes.
+
+default_cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'MahjongDetectionCache.sqlite')
+default_max_bytes = 256 * 1024 * 1024
+
+schema = '''
+CREATE TABLE IF NOT EXISTS detections (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    xyxy BLOB NOT NULL,
+    conf BLOB NOT NULL,
+    cls BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS detections_last_used ON detections (last_used);
+CREATE TABLE IF NOT EXISTS models (
+    model TEXT PRIMARY KEY,
+    names TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+'''
+
+model_hashes = {}
+
+def model_files(model_path):
+    if not os.path.isdir(model_path):
+        return [model_path]
+    return sorted(os.path.join(root, name) for root, _, names in os.walk(model_path) for name in names)
+
+# sha256 of the model file, or of every file of an exported model folder (OpenVINO),
+# kept per (path, size, mtime) of the files so it is read once
+def model_hash(model_path):
+    files = model_files(model_path)
+    stats = [os.stat(path) for path in files]
+    cache_key = (os.path.abspath(model_path),) + tuple((stat.st_size, stat.st_mtime_ns) for stat in stats)
+    digest = model_hashes.get(cache_key)
+    if digest is None:
+        sha = hashlib.sha256()
+        for path in files:
+            sha.update(os.path.relpath(path, model_path).encode('utf-8'))
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    sha.update(block)
+        digest = model_hashes[cache_key] = sha.hexdigest()
+    return digest
+
+def entry_key(image_hash, model, params):
+    return hashlib.sha256(json.dumps([image_hash, model, params], sort_keys=True).encode('utf-8')).hexdigest()
+
+class DetectionCache:
+
+    def __init__(self, path=default_cache_path, max_bytes=default_max_bytes, timeout=30.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        # one connection per cache object, shared by threads under the lock
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(schema)
+        self.names = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def count(self, name, value=1):
+        self.db.execute('INSERT INTO stats (name, value) VALUES (?, ?) '
+                        'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value', (name, value))
+
+    def label_names(self, model):
+        names = self.names.get(model)
+        if names is None:
+            row = self.db.execute('SELECT names FROM models WHERE model = ?', (model,)).fetchone()
+            if row is None:
+                return None
+            label_map = {int(idx): name for idx, name in json.loads(row[0]).items()}
+            names = np.empty(max(label_map) + 1 if label_map else 0, dtype=object)
+            for idx, name in label_map.items():
+                names[idx] = name
+            self.names[model] = names
+        return names
+
+    # the cached Detections of a key, None on a miss
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute('SELECT model, xyxy, conf, cls FROM detections WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                self.count('misses')
+                return None
+            model, xyxy, conf, cls = row
+            names = self.label_names(model)
+            self.db.execute('UPDATE detections SET last_used = ? WHERE key = ?', (time.time(), key))
+            self.hits += 1
+            self.count('hits')
+        return Detections(np.frombuffer(xyxy, dtype=np.int32).reshape(-1, 4),
+                          np.frombuffer(conf, dtype=np.float32),
+                          np.frombuffer(cls, dtype=np.int32),
+                          names)
+
+    def put(self, key, model, detections):
+        xyxy = np.ascontiguousarray(detections.xyxy, dtype=np.int32).tobytes()
+        conf = np.ascontiguousarray(detections.conf, dtype=np.float32).tobytes()
+        cls = np.ascontiguousarray(detections.cls, dtype=np.int32).tobytes()
+        size = len(xyxy) + len(conf) + len(cls)
+        now = time.time()
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                if model not in self.names:
+                    label_map = {idx: name for idx, name in enumerate(detections.names) if name is not None}
+                    self.db.execute('INSERT OR IGNORE INTO models (model, names) VALUES (?, ?)',
+                                    (model, json.dumps(label_map)))
+                    self.names[model] = detections.names
+                self.db.execute('INSERT OR REPLACE INTO detections VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                (key, model, xyxy, conf, cls, size, now, now))
+                self.evict()
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+
+    # drop the least recently used entries until the cache fits in max_bytes, inside a write transaction
+    def evict(self):
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM detections').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # free a bit more than needed so a full cache does not evict on every insert
+        target = self.max_bytes * 0.9
+        evicted = []
+        for key, size in self.db.execute('SELECT key, size FROM detections ORDER BY last_used'):
+            if total <= target:
+                break
+            evicted.append((key,))
+            total -= size
+        self.db.executemany('DELETE FROM detections WHERE key = ?', evicted)
+        self.evictions += len(evicted)
+        self.count('evictions', len(evicted))
+
+    def stats(self):
+        with self.lock:
+            entries, size = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM detections').fetchone()
+            totals = dict(self.db.execute('SELECT name, value FROM stats').fetchall())
+        lookups = self.hits + self.misses
+        total_lookups = totals.get('hits', 0) + totals.get('misses', 0)
+        return {
+            'path': self.path,
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'total_hits': totals.get('hits', 0),
+            'total_misses': totals.get('misses', 0),
+            'total_evictions': totals.get('evictions', 0),
+            'total_hit_rate': totals.get('hits', 0) / total_lookups if total_lookups else 0.0,
+        }
+
+    def clear(self):
+        with self.lock:
+            self.db.execute('DELETE FROM detections')
+            self.db.execute('DELETE FROM stats')
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+# Detector with the TileDetector settings that answers from the cache when the same image
+# was already detected with the same model and settings. The model is only loaded on the
+# first miss, so replaying cached images never pays for the model load.
+class CachedDetector:
+
+    def __init__(self, cache, model_path, threshold=0.2, resolution=None, roi=(-1,-1,-1,-1), ignore_areas=(), device=None,
+                 backend=None, imgsz=None, slice_size=None, slice_overlap=0.2, resize_mode='stretch'):
+        # every backend has its own exported model file and so its own cache entries
+        model_path = backend_model_path(model_path, backend)
+        self.backend = backend
+        if not os.path.exists(model_path):
+            raise FileNotFoundError('Model path is invalid or model was not found. Make sure the model filename was entered correctly.')
+        self.cache = cache
+        self.model_path = model_path
+        self.model = model_hash(model_path)
+        # imgsz of the key without loading the model: the one asked for, else the training run's;
+        # an imgsz stored in the model file itself is covered by the model hash
+        self.imgsz = imgsz
+        self.key_imgsz = int(imgsz or training_imgsz(model_path))
+        self.threshold = float(threshold)
+        self.resolution = resolution
+        self.roi = check_roi(roi)
+        self.ignore_areas = check_ignore_areas(ignore_areas)
+        self.device = device
+        self.slice_size = slice_size
+        self.slice_overlap = float(slice_overlap)
+        if resize_mode not in resize_modes:
+            raise ValueError(f'Unknown resize mode {resize_mode}, use one of {", ".join(resize_modes)}.')
+        self.resize_mode = resize_mode
+        self.detector = None
+
+    def get_detector(self):
+        if self.detector is None:
+            self.detector = TileDetector(self.model_path, self.threshold, self.resolution,
+                                         self.roi if self.roi is not None else (-1,-1,-1,-1), self.ignore_areas, self.device,
+                                         imgsz=self.imgsz, slice_size=self.slice_size, slice_overlap=self.slice_overlap,
+                                         resize_mode=self.resize_mode)
+        return self.detector
+
+    def params(self, keep_all, roi, ignore_areas):
+        roi = self.roi if roi is None else check_roi(roi)
+        return {
+            'threshold': self.threshold,
+            'resolution': self.resolution,
+            'roi': list(roi) if roi is not None else None,
+            'ignore': self.ignore_areas if ignore_areas is None else check_ignore_areas(ignore_areas),
+            'keep_all': bool(keep_all),
+            'slice': [self.slice_size, self.slice_overlap] if self.slice_size else None,
+            'imgsz': self.key_imgsz,
+            'resize': self.resize_mode,
+            'backend': self.backend or 'pytorch',
+            'model_file': os.path.basename(os.path.normpath(self.model_path)),
+            'preprocess': preprocess_version,
+        }
+
+    def detect_bytes(self, data, keep_all=False, roi=None, ignore_areas=None, trace=Metrics.null_trace):
+        key = entry_key(hashlib.sha256(data).hexdigest(), self.model, self.params(keep_all, roi, ignore_areas))
+        detections = self.cache.get(key)
+        if detections is not None:
+            trace.set('cache', 'hit')
+            trace.set('detections', len(detections))
+            return detections
+        trace.set('cache', 'miss')
+        detector = self.get_detector()
+        frame, source_size = detector.load_bytes(data, roi)
+        trace.mark('load')
+        detections = detector.detect(frame, keep_all, roi, ignore_areas, trace, source_size)
+        self.cache.put(key, self.model, detections)
+        return detections
+
+    def detect_file(self, img_filename, keep_all=False, roi=None, ignore_areas=None, trace=Metrics.null_trace):
+        try:
+            with open(img_filename, 'rb') as f:
+                data = f.read()
+        except OSError:
+            raise ValueError(f'Image {img_filename} could not be read.')
+        trace.mark('load')
+        return self.detect_bytes(data, keep_all, roi, ignore_areas, trace)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cache', help='Path of the detection cache', default=default_cache_path)
+    parser.add_argument('--clear', help='Remove every cached detection', action='store_true')
+    args = parser.parse_args()
+
+    cache = DetectionCache(args.cache)
+    if args.clear:
+        cache.clear()
+    for name, value in cache.stats().items():
+        print(f'{name}: {value}')
+    cache.close()
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
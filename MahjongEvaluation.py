@@ -0,0 +1,290 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from collections import Counter
+
+import numpy as np
+
+import MahjongDetect as Detect
+import MahjongModelRegistry as Registry
+
+# Detection accuracy and speed against YOLO labels
+#
+# Predictions and ground truth are compared by class name, so a model whose class ids are in
+# another order than classes.txt is still scored correctly. mAP uses the COCO 101 point
+# interpolated average precision, averaged over the classes that have ground truth boxes.
+# Next to the box metrics every model gets a confusion table of the classes, the rate of images
+# whose whole hand (the multiset of tiles) is read exactly, and its latency per image.
+#
+#   python MahjongEvaluation.py                      every Model/*/my_model.pt
+#   python MahjongEvaluation.py --models a.pt b.pt --backend onnx --report eval.json
+
+path_prefix = os.path.dirname(os.path.abspath(__file__))
+default_image_dir = os.path.join(path_prefix, 'TestData', 'images')
+default_label_dir = os.path.join(path_prefix, 'TestData', 'labels')
+default_classes_file = os.path.join(path_prefix, 'TestData', 'classes.txt')
+iou_thresholds = np.round(np.arange(0.5, 0.96, 0.05), 2)
+background = 'background'
+
+# [(img_file, xyxy, class names)] of every image that has a label file
+def load_ground_truth(image_dir=default_image_dir, label_dir=default_label_dir, classes_file=default_classes_file):
+    class_names = Detect.read_class_names(classes_file)
+    ground_truth = []
+    for img_file in sorted(glob.glob(os.path.join(image_dir, '*'))):
+        if os.path.splitext(img_file)[1] not in Detect.img_ext_list:
+            continue
+        label_file = os.path.join(label_dir, os.path.splitext(os.path.basename(img_file))[0] + '.txt')
+        if not os.path.exists(label_file):
+            continue
+        height, width = Detect.read_image(img_file).shape[:2]
+        xyxy, cls = Detect.read_labels(label_file, width, height)
+        ground_truth.append((img_file, xyxy, [class_names[c] for c in cls.tolist()]))
+    return ground_truth
+
+# run a detector over the ground truth images
+# returns [(xyxy, conf, class names)] and the per image preprocess and inference times in ms
+def predict(detector, ground_truth):
+    frames = [detector.preprocess(Detect.read_image(img_file)) for img_file, _, _ in ground_truth[:1]]
+    # one untimed run, the first call of a model pays for its setup
+    if frames:
+        detector.infer(frames[0])
+
+    predictions = []
+    timings = {'preprocess_ms': [], 'inference_ms': []}
+    for img_file, _, _ in ground_truth:
+        frame = Detect.read_image(img_file)
+        t_start = time.perf_counter()
+        frame = detector.preprocess(frame)
+        t_preprocess = time.perf_counter()
+        detections = detector.infer(frame)
+        t_end = time.perf_counter()
+        timings['preprocess_ms'].append((t_preprocess - t_start) * 1000)
+        timings['inference_ms'].append((t_end - t_preprocess) * 1000)
+        predictions.append((detections.xyxy, detections.conf, [name.replace('-', '_') for name in detections.class_names()]))
+    return predictions, timings
+
+# COCO style area under the precision / recall curve, sampled at 101 recall points, recall is increasing
+def average_precision(recall, precision):
+    # precision envelope, the best precision at this or a higher recall
+    precision = np.flip(np.maximum.accumulate(np.flip(precision)))
+    index = np.searchsorted(recall, np.linspace(0, 1, 101), side='left')
+    sampled = np.where(index < len(precision), precision[np.minimum(index, len(precision) - 1)], 0.0)
+    return float(sampled.mean())
+
+# one to one matches of the (prediction, ground truth) pairs with iou >= threshold, highest IoU first
+# returns the matched prediction and ground truth indices
+def match_pairs(iou, threshold):
+    pred_idx, gt_idx = np.nonzero(iou >= threshold)
+    if not len(pred_idx):
+        return pred_idx, gt_idx
+    order = np.argsort(-iou[pred_idx, gt_idx], kind='stable')
+    pred_idx, gt_idx = pred_idx[order], gt_idx[order]
+    # np.unique keeps the first, i.e. best, pair of every prediction, then of every ground truth box
+    _, first = np.unique(pred_idx, return_index=True)
+    first.sort()
+    pred_idx, gt_idx = pred_idx[first], gt_idx[first]
+    _, first = np.unique(gt_idx, return_index=True)
+    return pred_idx[first], gt_idx[first]
+
+# true positive flags of every prediction of one image at every IoU threshold
+# a prediction matches a ground truth box of its class, each box at most once
+def match_image(pred_xyxy, pred_names, gt_xyxy, gt_names, thresholds=iou_thresholds):
+    pred_names = np.asarray(pred_names, dtype=object)
+    gt_names = np.asarray(gt_names, dtype=object)
+    iou = Detect.iou_matrix(np.asarray(pred_xyxy).reshape(-1, 4), np.asarray(gt_xyxy).reshape(-1, 4))
+    if len(pred_names) and len(gt_names):
+        iou = np.where(pred_names[:, None] == gt_names[None, :], iou, 0.0)
+
+    tp = np.zeros((len(pred_names), len(thresholds)), dtype=bool)
+    for t, threshold in enumerate(thresholds):
+        pred_idx, _ = match_pairs(iou, threshold)
+        tp[pred_idx, t] = True
+    return tp
+
+# (ground truth class, predicted class) of every box of one image at IoU 0.5, whatever the classes
+# a missed box is (class, background), a prediction on nothing is (background, class)
+def confusion_pairs(pred_xyxy, pred_names, gt_xyxy, gt_names, iou_threshold=0.5):
+    iou = Detect.iou_matrix(np.asarray(pred_xyxy).reshape(-1, 4), np.asarray(gt_xyxy).reshape(-1, 4))
+    pred_idx, gt_idx = match_pairs(iou, iou_threshold)
+    pairs = [(gt_names[g], pred_names[p]) for p, g in zip(pred_idx.tolist(), gt_idx.tolist())]
+    missed = np.ones(len(gt_names), dtype=bool)
+    missed[gt_idx] = False
+    extra = np.ones(len(pred_names), dtype=bool)
+    extra[pred_idx] = False
+    pairs += [(gt_names[g], background) for g in np.flatnonzero(missed).tolist()]
+    pairs += [(background, pred_names[p]) for p in np.flatnonzero(extra).tolist()]
+    return pairs
+
+# confusion counts -> per class summary and the most frequent mix-ups
+def confusion_summary(confusion, top=10):
+    classes = sorted(({gt for gt, _ in confusion} | {pred for _, pred in confusion}) - {background})
+    per_class = {}
+    for name in classes:
+        row = {pred: count for (gt, pred), count in confusion.items() if gt == name}
+        per_class[name] = {
+            'correct': row.get(name, 0),
+            'missed': row.get(background, 0),
+            'confused': sum(count for pred, count in row.items() if pred not in (name, background)),
+            'false_positives': sum(count for (gt, pred), count in confusion.items() if pred == name and gt != name),
+        }
+    mixups = sorted(((count, gt, pred) for (gt, pred), count in confusion.items()
+                     if gt != pred and background not in (gt, pred)), reverse=True)[:top]
+    return per_class, [{'truth': gt, 'predicted': pred, 'count': count} for count, gt, pred in mixups]
+
+# accuracy of per image predictions [(xyxy, conf, names)] against ground truth [(img_file, xyxy, names)]
+# precision, recall, the confusion table and the hand exact match are taken at IoU 0.5
+# for the predictions with conf >= conf_threshold
+def evaluate(predictions, ground_truth, conf_threshold=0.25):
+    all_tp, all_conf, all_names = [], [], []
+    gt_count = Counter()
+    confusion = Counter()
+    exact = 0
+    for (pred_xyxy, pred_conf, pred_names), (_, gt_xyxy, gt_names) in zip(predictions, ground_truth):
+        pred_conf = np.asarray(pred_conf, dtype=np.float32)
+        all_tp.append(match_image(pred_xyxy, pred_names, gt_xyxy, gt_names))
+        all_conf.append(pred_conf)
+        all_names += list(pred_names)
+        gt_count.update(gt_names)
+
+        kept = np.flatnonzero(pred_conf >= conf_threshold)
+        kept_names = [pred_names[i] for i in kept.tolist()]
+        confusion.update(confusion_pairs(np.asarray(pred_xyxy).reshape(-1, 4)[kept], kept_names, gt_xyxy, gt_names))
+        exact += Counter(kept_names) == Counter(gt_names)
+    tp = np.concatenate(all_tp) if all_tp else np.zeros((0, len(iou_thresholds)), bool)
+    conf = np.concatenate(all_conf) if all_conf else np.zeros(0, np.float32)
+    names = np.asarray(all_names, dtype=object)
+
+    per_class = {}
+    for name, count in sorted(gt_count.items()):
+        mask = names == name
+        order = np.argsort(-conf[mask], kind='stable')
+        class_tp = tp[mask][order]
+        if not len(class_tp):
+            per_class[name] = {'ground_truth': count, 'ap50': 0.0, 'ap50_95': 0.0}
+            continue
+        tp_sum = np.cumsum(class_tp, axis=0)
+        fp_sum = np.cumsum(~class_tp, axis=0)
+        # every IoU threshold at once: (predictions, thresholds) recall and precision curves
+        recall = tp_sum / count
+        precision = tp_sum / (tp_sum + fp_sum)
+        ap = [average_precision(recall[:, t], precision[:, t]) for t in range(len(iou_thresholds))]
+        per_class[name] = {'ground_truth': count, 'ap50': ap[0], 'ap50_95': float(np.mean(ap))}
+
+    class_confusion, mixups = confusion_summary(confusion)
+    for name, counts in class_confusion.items():
+        per_class.setdefault(name, {'ground_truth': 0, 'ap50': 0.0, 'ap50_95': 0.0}).update(counts)
+
+    kept = conf >= conf_threshold
+    true_positives = int(tp[kept, 0].sum())
+    total_gt = sum(gt_count.values())
+    scored = [c for c in per_class.values() if c['ground_truth']]
+    return {
+        'mAP50': float(np.mean([c['ap50'] for c in scored])) if scored else 0.0,
+        'mAP50-95': float(np.mean([c['ap50_95'] for c in scored])) if scored else 0.0,
+        'precision': true_positives / int(kept.sum()) if kept.any() else 0.0,
+        'recall': true_positives / total_gt if total_gt else 0.0,
+        'hand_exact_match': exact / len(ground_truth) if ground_truth else 0.0,
+        'images': len(ground_truth),
+        'ground_truth_boxes': total_gt,
+        'per_class': per_class,
+        'mixups': mixups,
+    }
+
+def latency_summary(samples):
+    samples = np.asarray(samples, dtype=np.float64)
+    if not len(samples):
+        return {'mean': 0.0, 'p50': 0.0, 'p95': 0.0}
+    return {'mean': float(samples.mean()), 'p50': float(np.percentile(samples, 50)), 'p95': float(np.percentile(samples, 95))}
+
+# accuracy and latency of one model, the detector keeps every box down to conf 0.001 for the mAP
+def evaluate_model(model_path, ground_truth, backend=None, conf_threshold=0.25, device='cpu', slice_size=None,
+                   resize_mode='stretch'):
+    detector = Detect.TileDetector(model_path, 0.001, device=device, backend=backend, slice_size=slice_size,
+                                   resize_mode=resize_mode)
+    predictions, timings = predict(detector, ground_truth)
+    report = evaluate(predictions, ground_truth, conf_threshold)
+    report.update(model=detector.model_path, backend=detector.backend, imgsz=detector.imgsz, resize=detector.resize_mode,
+                  load_ms=detector.load_time * 1000,
+                  preprocess_ms=latency_summary(timings['preprocess_ms']),
+                  inference_ms=latency_summary(timings['inference_ms']))
+    return report
+
+# the models that are not both slower and less accurate (mAP50-95) than another one
+def pareto_front(reports):
+    front = []
+    for name, report in reports.items():
+        dominated = any(other['mAP50-95'] >= report['mAP50-95'] and other['inference_ms']['p50'] <= report['inference_ms']['p50']
+                        and (other['mAP50-95'], -other['inference_ms']['p50']) != (report['mAP50-95'], -report['inference_ms']['p50'])
+                        for other_name, other in reports.items() if other_name != name)
+        if not dominated:
+            front.append(name)
+    return front
+
+def default_models():
+    return [info.model_path for info in Registry.discover_models().values() if info.available]
+
+def print_report(reports, skipped, out=sys.stdout):
+    front = pareto_front(reports)
+    print(f"{'model':<28}{'mAP50':>8}{'mAP50-95':>10}{'P':>7}{'R':>7}{'hands':>7}{'p50 ms':>9}{'p95 ms':>9}", file=out)
+    for name, report in sorted(reports.items(), key=lambda item: -item[1]['mAP50-95']):
+        mark = '  *' if name in front else ''
+        print(f"{name:<28}{report['mAP50']:>8.4f}{report['mAP50-95']:>10.4f}{report['precision']:>7.3f}{report['recall']:>7.3f}"
+              f"{report['hand_exact_match']:>7.2f}{report['inference_ms']['p50']:>9.1f}{report['inference_ms']['p95']:>9.1f}{mark}",
+              file=out)
+    for name, reason in skipped.items():
+        print(f'{name:<28}skipped, {reason}', file=out)
+    if front:
+        print('* no other model is both faster and more accurate', file=out)
+    for name, report in reports.items():
+        if report['mixups']:
+            print(f'{name} most confused: ' + ', '.join(f"{m['truth']}->{m['predicted']} x{m['count']}" for m in report['mixups'][:5]),
+                  file=out)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--models', help='Model files or generations ("3") to compare, defaults to every Model/*/my_model.pt', nargs='+', default=None)
+    parser.add_argument('--backend', help='Inference backend, the exported model next to each model is used',
+                        choices=Detect.backends, default=None)
+    parser.add_argument('--images', help='Labelled images', default=default_image_dir)
+    parser.add_argument('--labels', help='YOLO labels of the images', default=default_label_dir)
+    parser.add_argument('--classes', help='classes.txt of the labels', default=default_classes_file)
+    parser.add_argument('--conf', help='Confidence threshold for precision, recall, confusion and hand match', type=float, default=0.25)
+    parser.add_argument('--slice', help='Evaluate with sliced inference of WxH slices (example: "640x640")', default=None)
+    parser.add_argument('--resize', help='Model input of a frame, "stretch" like the training images or "letterbox", '
+                        'run both to compare them', choices=Detect.resize_modes, default='stretch')
+    parser.add_argument('--device', help='Inference device', default='cpu')
+    parser.add_argument('--report', help='Write the JSON report to this file', default=None)
+    args = parser.parse_args()
+
+    ground_truth = load_ground_truth(args.images, args.labels, args.classes)
+    if not ground_truth:
+        print(f'ERROR: no labelled images in {args.images}')
+        sys.exit(1)
+    models = [Registry.resolve_model(model) for model in args.models] if args.models else default_models()
+    if not models:
+        print(f"ERROR: no models found in {os.path.join(path_prefix, 'Model')}")
+        sys.exit(1)
+
+    reports, skipped = {}, {}
+    for model_path in models:
+        name = os.path.relpath(model_path, path_prefix) if model_path.startswith(path_prefix) else model_path
+        try:
+            reports[name] = evaluate_model(model_path, ground_truth, args.backend, args.conf, args.device, args.slice,
+                                           args.resize)
+        except (ImportError, FileNotFoundError, ValueError) as e:
+            skipped[name] = str(e)
+    print(f"{len(ground_truth)} images, {sum(len(names) for _, _, names in ground_truth)} tiles, conf {args.conf}")
+    print_report(reports, skipped)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'models': reports, 'skipped': skipped, 'pareto_front': pareto_front(reports),
+                       'images': len(ground_truth), 'conf': args.conf, 'backend': args.backend,
+                       'resize': args.resize}, f, indent=2)
+    sys.exit(0 if reports else 1)
+
+if __name__ == '__main__':
+    main()
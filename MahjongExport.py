@@ -0,0 +1,169 @@
+import os
+import re
+import sys
+import json
+import glob
+import argparse
+
+import numpy as np
+
+import MahjongDetect as Detect
+import MahjongEvaluation as Evaluation
+import MahjongModelRegistry as Registry
+
+# Export a .pt checkpoint to a CPU backend and optionally quantize it to INT8
+#
+#   onnx          : my_model.onnx, run by ONNX Runtime
+#   onnx-int8     : my_model_int8.onnx, static QDQ quantization calibrated on the TestData images
+#   openvino      : my_model_openvino_model/, OpenVINO IR
+#   openvino-int8 : my_model_int8_openvino_model/, NNCF quantization calibrated on the TestData images
+#
+# Every exported model is scored against TestData/labels next to the PyTorch model and the result
+# is written to <exported model>.accuracy.json. A quantized model is accepted only when its mAP50
+# and mAP50-95 are within --max_map_drop of the PyTorch model, TileDetector refuses it otherwise.
+
+default_model_path = Registry.default_model_path()
+
+# dataset yaml for the ultralytics OpenVINO INT8 export, only the images are used for calibration
+def calibration_yaml(image_dir, names, path):
+    lines = [f'path: {os.path.dirname(os.path.abspath(image_dir))}',
+             f'train: {os.path.basename(image_dir)}',
+             f'val: {os.path.basename(image_dir)}',
+             'names:']
+    lines += [f'  {idx}: {name}' for idx, name in sorted(names.items())]
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+# model input tensors of the calibration images, resized like TileDetector does by default
+def calibration_tensors(image_files, imgsz):
+    buffer = np.empty((imgsz, imgsz, 3), dtype=np.uint8)
+    for img_file in image_files:
+        frame, _, _ = Detect.resize_input(Detect.read_image(img_file), imgsz, buffer)
+        yield np.ascontiguousarray(frame[:, :, ::-1].transpose(2, 0, 1))[None].astype(np.float32) / 255.0
+
+# static INT8 quantization of an exported ONNX model
+# the detection head (the last model.N block) stays in float, its box outputs do not survive INT8
+def quantize_onnx(fp32_path, int8_path, image_files, imgsz):
+    import onnx
+    from onnxruntime.quantization import (quantize_static, CalibrationDataReader, CalibrationMethod,
+                                          QuantFormat, QuantType)
+
+    model = onnx.load(fp32_path)
+    input_name = model.graph.input[0].name
+    blocks = [int(m.group(1)) for node in model.graph.node for m in [re.search(r'model\.(\d+)', node.name)] if m]
+    head = f'model.{max(blocks)}' if blocks else None
+    head_nodes = [node.name for node in model.graph.node if head and re.search(rf'{re.escape(head)}\b', node.name)]
+
+    class ImageReader(CalibrationDataReader):
+        def __init__(self):
+            self.tensors = calibration_tensors(image_files, imgsz)
+
+        def get_next(self):
+            tensor = next(self.tensors, None)
+            return None if tensor is None else {input_name: tensor}
+
+    quantize_static(fp32_path, int8_path, ImageReader(),
+                    quant_format=QuantFormat.QDQ, per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                    calibrate_method=CalibrationMethod.MinMax, nodes_to_exclude=head_nodes)
+
+    # ultralytics reads the class names, stride and imgsz from the model metadata
+    quantized = onnx.load(int8_path)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(model.metadata_props)
+    onnx.save(quantized, int8_path)
+    return int8_path
+
+def export(model_path, backend, imgsz, image_dir, names):
+    from ultralytics import YOLO
+    model = YOLO(model_path, task='detect')
+    target = Detect.backend_model_path(model_path, backend.replace('-int8', ''))
+    if backend == 'onnx':
+        return model.export(format='onnx', imgsz=imgsz, dynamic=False)
+    if backend == 'onnx-int8':
+        fp32_path = target if os.path.exists(target) else model.export(format='onnx', imgsz=imgsz, dynamic=False)
+        return quantize_onnx(fp32_path, os.path.splitext(model_path)[0] + '_int8.onnx', sorted(
+            path for path in glob.glob(os.path.join(image_dir, '*')) if os.path.splitext(path)[1] in Detect.img_ext_list), imgsz)
+    if backend == 'openvino':
+        return model.export(format='openvino', imgsz=imgsz)
+    if backend == 'openvino-int8':
+        data = calibration_yaml(image_dir, names, os.path.splitext(model_path)[0] + '_calibration.yaml')
+        return model.export(format='openvino', imgsz=imgsz, int8=True, data=data)
+    raise ValueError(f'Unknown backend {backend}, use one of {", ".join(Detect.backends[1:])}.')
+
+# mAP and latency of a model on the labelled images
+def score_model(model_path, ground_truth, conf_threshold):
+    metrics = Evaluation.evaluate_model(model_path, ground_truth, conf_threshold=conf_threshold)
+    for key in ('per_class', 'mixups'):
+        metrics.pop(key)
+    metrics['latency_ms'] = metrics['inference_ms']['mean']
+    return metrics
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', help='Path to the .pt checkpoint or model generation ("5"), defaults to the best model in Model/',
+                        default=default_model_path)
+    parser.add_argument('--backend', help='Backend to export to', choices=Detect.backends[1:], default='onnx')
+    parser.add_argument('--int8', help='Quantize to INT8 (same as --backend onnx-int8 / openvino-int8)', action='store_true')
+    parser.add_argument('--imgsz', help='Model input size, defaults to the imgsz of the training run', type=int, default=None)
+    parser.add_argument('--calibration', help='Images for the INT8 calibration and the accuracy check',
+                        default=Evaluation.default_image_dir)
+    parser.add_argument('--labels', help='YOLO labels of the calibration images', default=Evaluation.default_label_dir)
+    parser.add_argument('--classes', help='classes.txt of the labels', default=Evaluation.default_classes_file)
+    parser.add_argument('--max_map_drop', help='Largest mAP50 / mAP50-95 loss accepted for a quantized model',
+                        type=float, default=0.01)
+    parser.add_argument('--conf', help='Confidence threshold for the reported precision and recall', type=float, default=0.25)
+    args = parser.parse_args()
+
+    args.model = Registry.resolve_model(args.model)
+    backend = args.backend
+    if args.int8 and not backend.endswith('-int8'):
+        backend += '-int8'
+    imgsz = args.imgsz or Detect.training_imgsz(args.model)
+
+    try:
+        from ultralytics import YOLO
+        names = YOLO(args.model, task='detect').names
+        exported_path = str(export(args.model, backend, imgsz, args.calibration, names))
+    except (ImportError, FileNotFoundError, ValueError) as e:
+        print(f'ERROR: {e}')
+        sys.exit(1)
+    print(f'Exported {backend} model to {exported_path}')
+
+    ground_truth = Evaluation.load_ground_truth(args.calibration, args.labels, args.classes)
+    if not ground_truth:
+        print(f'ERROR: no labelled images in {args.calibration}')
+        sys.exit(1)
+    reference = score_model(args.model, ground_truth, args.conf)
+    candidate = score_model(exported_path, ground_truth, args.conf)
+
+    map_drop = max(reference['mAP50'] - candidate['mAP50'], reference['mAP50-95'] - candidate['mAP50-95'])
+    accepted = not backend.endswith('-int8') or map_drop <= args.max_map_drop
+    report = {
+        'backend': backend,
+        'model': exported_path,
+        'source': args.model,
+        'imgsz': imgsz,
+        'accepted': accepted,
+        'max_map_drop': args.max_map_drop,
+        'map_drop': map_drop,
+        'speedup': reference['latency_ms'] / max(candidate['latency_ms'], 1e-9),
+        'reference': reference,
+        'candidate': candidate,
+    }
+    with open(Detect.accuracy_report_path(exported_path), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for name, metrics in (('pytorch', reference), (backend, candidate)):
+        print(f"{name:<15} mAP50 {metrics['mAP50']:.4f}  mAP50-95 {metrics['mAP50-95']:.4f}  "
+              f"P {metrics['precision']:.3f}  R {metrics['recall']:.3f}  {metrics['latency_ms']:.1f} ms/image")
+    print(f"Speedup {report['speedup']:.2f}x, mAP drop {map_drop:+.4f}")
+    if not accepted:
+        print(f'REJECTED: the mAP drop is above {args.max_map_drop}, the quantized model will not be used')
+        sys.exit(1)
+    print(f'Accepted, use it with --backend {backend}')
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
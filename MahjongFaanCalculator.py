@@ -1,16 +1,15 @@
-import subprocess
 import argparse
 import sys
-import re
 import os
 import MahjongTile as Mahjong
+import MahjongHandSolver as HandSolver
+import MahjongHandTable as HandTable
+import MahjongFaanRules as FaanRules
+import MahjongMetrics as Metrics
 
-# calculation functions
-def is_dragon(tile):
-    return tile > 30 and tile < 34
-
-def is_wind(tile):
-    return tile > 40 and tile < 45
+# Raised when the detected tiles can not be turned into a hand
+class FaanError(Exception):
+    pass
 
 def end_program(code, showMsg = False, msg = "", Faan = 0, name = ""):
     if showMsg:
@@ -20,458 +19,268 @@ def end_program(code, showMsg = False, msg = "", Faan = 0, name = ""):
         print("Faan:", Faan)
     sys.exit(code)
 
-debug_msg = False
-debug_str = "\nDebug:\n"
-
-# Define and parse user input arguments
-parser = argparse.ArgumentParser()
-parser.add_argument('--source', help='The image source for mahjong detection, can be image file ("test.jpg"), image folder ("test_dir")', 
-                    required=True)
-parser.add_argument('--threshold', help='Minimum confidence threshold for displaying detected objects (example: "0.4")',
-                    default=0.2)
-parser.add_argument('--ROI', help='Adjust the ROI (example: top-left (100,100), bottom-right (500,400)), \
-                    otherwise, detect on the whole image',
-                    nargs=4, type=int, metavar=('x1', 'y1', 'x2', 'y2'),
-                    default=(-1,-1,-1,-1)) # Default ROI is the whole image
-parser.add_argument('--ignore', help='Ignore area: specify as x1 y1 x2 y2. Can be used multiple times.',
-                    nargs=4, type=int, metavar=('x1', 'y1', 'x2', 'y2'),
-                    action='append',
-                    default=[])
-parser.add_argument('--game_wind', help='Wind for this game, can be 1, 2, 3, or 4 (1: east, 2: south, 3: west, 4: north)',
-                    default=-1)
-parser.add_argument('--seat_wind', help='Wind for this seat, can be 1, 2, 3, or 4 (1: east, 2: south, 3: west, 4: north)',
-                    default=-1)
-parser.add_argument('--seat', help='Seat : 0 1 2 3 seat off to the dealer, in clockwise direction',
-                    default=-1)
-parser.add_argument('--nondebug', help='Forcing the program to run without all debug settings',
-                    default=False)
-args = parser.parse_args()
-
-# Parse user inputs
-img_source = args.source
-min_threshold = args.threshold
-roi_x1, roi_y1, roi_x2, roi_y2 = args.ROI
-ignore_areas = args.ignore
-game_wind = args.game_wind
-seat_wind = args.seat_wind
-seat = args.seat
-nondebug = args.nondebug
-
-ROI_args = []
-if roi_x1 != -1 and roi_y1 != -1 and roi_x2 != -1 and roi_y2 != -1:
-    ROI_args = ["--ROI", str(roi_x1), str(roi_y1), str(roi_x2), str(roi_y2)]
-
-ignore_args = []
-if args.ignore:
-    ignore_args = ["--ignore"] + [str(coord) for area in ignore_areas for coord in area]
-
-debug_detect = True
-debug_detect_args = []
-if debug_detect:
-    debug_detect_args = ["--showRes", "True", "--resolution", "1280x1280"]
-
-if nondebug:
-    debug_msg = False
-    debug_detect = False
-
-# Call mahjong detect script
-cur_dir = os.getcwd()
-path_prefix = os.path.dirname(cur_dir) + "\\MahjongClassifier"
-# print("calling " + path_prefix + "\\MahjongDetect.py with args:")
-result = subprocess.run(
-    ["python", path_prefix + "\\MahjongDetect.py", "--model", path_prefix + "\\Model/5/my_model.pt", "--source", path_prefix + img_source, "--threshold", min_threshold] + ROI_args + debug_detect_args + ignore_args,
-    capture_output=True,
-    text=True
-)
-
-# Print output
-#print("Return code:", result.returncode)
-#print("Output:", result.stdout)
-#print("Error:", result.stderr)
-
-# Check if the return output contains ERROR prefix
-if result.returncode != 0 or "ERROR" in result.stdout:
-    print("Error occurred during detection:")
-    print(result.stdout)
-    end_program(1, debug_msg, debug_str)
-
-# Parse the output to pair array
-pattern = r'BBox: \((\d+), (\d+)\), \((\d+), (\d+)\), Class: (\w+)'
-matches = re.findall(pattern, result.stdout)
-
-# Create a list of dictionaries to hold the detection results
-detections = []
-for match in matches:
-    xmin, ymin, xmax, ymax, classname = match
-    detection = {
-        'bbox': [int(xmin), int(ymin), int(xmax), int(ymax)],
-        'class': classname
-    }
-    detections.append(detection)
-
-if not detections:
-    print("Error: No tiles detected.")
-    end_program(1, debug_msg, debug_str)
-
-# Sort the detections by x position 
-if detections:
-    detections.sort(key=lambda x: (x['bbox'][0]))
-
-# check if there is any weird y position difference
-tile_height = detections[0]['bbox'][3] - detections[0]['bbox'][1]
-for i in range(0, len(detections) - 1):
-    y_curr = detections[i]['bbox'][1]
-    y_next = detections[i + 1]['bbox'][1]
-    if abs(y_curr - y_next) > tile_height * 0.75:
-        # skip flower and season
-        if detections[i]['class'][0] == 'f' or detections[i]['class'][0] == 's' or \
-            detections[i + 1]['class'][0] == 'f' or detections[i + 1]['class'][0] == 's':
-            continue
-        # check if there is a tile at right instead
-        for j in range(2, min(4, len(detections) - i - 1 - 2)):
-            if abs(detections[i + j]['bbox'][1] - y_curr) < tile_height * 0.75 and \
-                detections[i + j]['class'][0] == detections[i]['class'][0]:
-                number_to_swap = j - 1
-                # put j tiles after i to i + j
-                # if i = 2, j = 2, 3th and 4th -> 5th and 6th | ori 5th and 6th -> 3th and 4th
-                if debug_msg:
-                    for k in range(0 , j + number_to_swap):
-                        print(f"Tile {i + k}: {detections[i + k]['class']} at {detections[i + k]['bbox']}")
-
-                # swap the tiles
-                detections[i + 1:i + j], detections[i + j:i + j + number_to_swap] = detections[i + j:i + j + number_to_swap], detections[i + 1:i + j]
-
-                if debug_msg:
-                    for k in range(0 , j + number_to_swap):
-                        print(f"Tile {i + k}: {detections[i + k]['class']} at {detections[i + k ]['bbox']}")
-                    print("\n")
-                i = i + j + number_to_swap
-                break
-
 #################################################################################################################
 # prepare for data extraction
 #################################################################################################################
 
-detected_tiles = [0] * 45   # non-flower tiles
-detected_flowers = [0] * (8 + 1)
-detected_dragon = False
-detected_dragon_set = [0] * 2   # pong / kong 
-detected_wind = False
-detected_winds_set = [0] * 2    # pong / kong 
-words_only = True
-melds = [0] * (len(Mahjong.Meld) + 1)
-eye_type = -1  # -1: not detected, 0: common eye, 1: orphan eye, 2: dragon eye, 3: wind eye
-orphan = True
-one_suit = True
-last_suit = -1
-odd_flowers = 0
-even_flowers = 0
-nice_flowers = 0
-cool_wind = 0   
-door_free = False # in test
-result_name = ""
-
-# extract the melds from the detected tiles
-# dont consider the flowers in this step
-saved_tiles = []
-for i in range(detections.__len__()):
-    # get the detection
-    detection = detections[i]
-    class_name = detection['class']
-    if class_name in Mahjong.Flower.__members__:
-        flower_index = Mahjong.Flower[class_name].value
-        detected_flowers[flower_index] += 1
-        # flower are seperated into odd and even
-        if flower_index % 2 == 1:
-            odd_flowers += 1
-        else:
-            even_flowers += 1
-        # flower or season
+# the facts score_hand needs, for one (melds, eye) decomposition of a Mahjong.Hand
+# a decomposition of ((), None) describes a hand without melds, e.g. Thirteen Orphans
+# flags are the hand level flags of HandTable.hand_flags
+def hand_features(tile_hand, decomposition, flags, game_wind = -1, seat_wind = -1, seat = -1):
+    hand_melds, eye = decomposition
+    present = tile_hand.present()
+
+    # flower are seperated into odd and even
+    flower_counts = tile_hand.flower_counts
+    odd_flowers = sum(flower_counts[0::2])
+    even_flowers = sum(flower_counts[1::2])
+    # flower or season
+    nice_flowers = 0
+    for flower_index in tile_hand.flowers():
         if flower_index == seat or flower_index / 2 == seat:
             nice_flowers += 1
-        continue
-
-    if class_name in Mahjong.Tile.__members__:
-        tile = Mahjong.Tile[class_name].value
-        detected_tiles[tile] += 1
-    else:
-        print(f"Error: Detected unknown tile class '{class_name}'")
-        end_program(1, debug_msg, debug_str)
-    saved_tiles.append(tile)
-
-    # check if its one suit
-    if one_suit and tile < 30:
-        if last_suit == -1:
-            last_suit = tile / 10
-        else:
-            if last_suit != tile / 10:
-                one_suit = False
 
-    # check if its word
-    if tile < 30:
-        words_only = False
-        # check if its orphan tile
-        if orphan and tile % 10 != 1 and tile % 10 != 9:
-            orphan = False
-
-    if is_wind(tile):
-        detected_wind = True
-        if game_wind != -1 and tile == 40 + game_wind:
-            cool_wind += 1
-        if seat_wind != -1 and tile == 40 + seat_wind:
-            cool_wind += 1
-
-    # check for melds when the len of saved_tiles is 3 or more
-    if saved_tiles.__len__() == 3:
-
-        # check for chow melds
-        if saved_tiles[0] < 30 and \
-           saved_tiles[-1] - saved_tiles[-2] == 1 and saved_tiles[-2] - saved_tiles[-3] == 1:
-            melds[Mahjong.Meld.CHOW.value] += 1
-            saved_tiles = []
-            orphan = False
+    suits = flags['suits']
+    one_suit = len(suits) <= 1
+    words_only = not suits
+
+    melds = [0] * (len(Mahjong.Meld) + 1)
+    detected_dragon_set = [0] * 2   # pong / kong
+    detected_winds_set = [0] * 2    # pong / kong
+    cool_wind = 0
+    for meld, index in hand_melds:
+        melds[meld.value] += 1
+        if meld == Mahjong.Meld.CHOW:
             continue
-        # check for eye
-        if saved_tiles[0] == saved_tiles[1] and saved_tiles[1] != saved_tiles[2]:
-            # cant have 2 eyes
-            if eye_type != -1:
-                print("Error: eye already detected, but saved_tiles has 3 tiles left:", saved_tiles)
-                end_program(1, debug_msg, debug_str)
-
-            # if its dragon or wind, it is not common eye
-            if is_dragon(saved_tiles[0]) :
-                eye_type = 2
-            elif is_wind(saved_tiles[0]):
-                eye_type = 3
-            elif saved_tiles[0] % 10 == 1 or saved_tiles[0] % 10 == 9:
-                eye_type = 1
-            else:
-                eye_type = 0
-
-            saved_tiles = saved_tiles[2:]
-            continue
-    
-    if saved_tiles.__len__() > 3:
-
-        # check for kong melds
-        if saved_tiles[0] == saved_tiles[1] == saved_tiles[2] == saved_tiles[3]:
-            melds[Mahjong.Meld.KONG.value] += 1
-            if is_dragon(saved_tiles[0]):
-                detected_dragon_set[1] += 1
-                detected_dragon = True
-            elif is_wind(saved_tiles[0]):
-                detected_winds_set[1] += 1
-                detected_wind = True
-            saved_tiles = []
-        # check for pong melds
-        elif saved_tiles[0] == saved_tiles[1] == saved_tiles[2]:
-            melds[Mahjong.Meld.PONG.value] += 1
-            if is_dragon(saved_tiles[0]):
-                detected_dragon_set[0] += 1
-                detected_dragon = True
-            elif is_wind(saved_tiles[0]):
-                detected_winds_set[0] += 1
-                detected_wind = True
-            saved_tiles = saved_tiles[3:]
-        elif not orphan:
-            print("Error: saved_tiles didn't match any melds, but has", saved_tiles.__len__(), "tiles left:", saved_tiles)
-            end_program(1, debug_msg, debug_str)
-
-# check if there is saved tiles left
-if saved_tiles.__len__() > 0:
-    if saved_tiles.__len__() == 2 and saved_tiles[0] == saved_tiles[1]:
-            # cant have 2 eyes
-            if eye_type != -1:
-                print("Error: eye already detected, but saved_tiles has 2 tiles left:", saved_tiles)
-                end_program(1, debug_msg, debug_str)
-
-            # if its dragon or wind, it is not common eye
-            if is_dragon(saved_tiles[0]) :
-                eye_type = 2
-            elif is_wind(saved_tiles[0]):
-                eye_type = 3
-            elif saved_tiles[0] % 10 == 1 or saved_tiles[0] % 10 == 9:
-                eye_type = 1
-            else:
-                eye_type = 0
-    elif saved_tiles.__len__() == 3:
-        # check for pong melds
-        if saved_tiles[0] == saved_tiles[1] == saved_tiles[2]:
-            melds[Mahjong.Meld.PONG.value] += 1
-            if is_dragon(saved_tiles[0]):
-                detected_dragon_set[0] += 1
-                detected_dragon = True
-            elif is_wind(saved_tiles[0]):
-                detected_winds_set[0] += 1
-                detected_wind = True
-            saved_tiles = saved_tiles[3:]
-    elif not orphan:
-        print("Error: ", saved_tiles.__len__(), "tiles left:", saved_tiles)
-        end_program(1, debug_msg, debug_str)
+        kong = 1 if meld == Mahjong.Meld.KONG else 0
+        if Mahjong.tile_is_dragon[index]:
+            detected_dragon_set[kong] += 1
+        elif Mahjong.tile_is_wind[index]:
+            detected_winds_set[kong] += 1
+            # wind index 30 is east, game_wind and seat_wind 1 is east
+            if game_wind != -1 and index == 29 + game_wind:
+                cool_wind += 1
+            if seat_wind != -1 and index == 29 + seat_wind:
+                cool_wind += 1
+
+    # -1: not detected, 0: common eye, 1: orphan eye, 2: dragon eye, 3: wind eye
+    eye_type = -1
+    if eye is not None:
+        if Mahjong.tile_is_dragon[eye]:
+            eye_type = 2
+        elif Mahjong.tile_is_wind[eye]:
+            eye_type = 3
+        elif Mahjong.tile_is_terminal[eye]:
+            eye_type = 1
+        else:
+            eye_type = 0
+
+    return {
+        'flowers': odd_flowers + even_flowers,
+        'odd_flowers': odd_flowers,
+        'even_flowers': even_flowers,
+        'nice_flowers': nice_flowers,
+        'detected_dragon': detected_dragon_set[0] + detected_dragon_set[1] > 0,
+        'detected_dragon_set': detected_dragon_set,
+        'dragon_sets': detected_dragon_set[0] + detected_dragon_set[1],
+        'detected_wind': bool(present & Mahjong.wind_mask),
+        'detected_winds_set': detected_winds_set,
+        'wind_sets': detected_winds_set[0] + detected_winds_set[1],
+        'cool_wind': cool_wind,
+        'words_only': words_only,
+        'melds': melds,
+        'chows': melds[Mahjong.Meld.CHOW.value],
+        'pongs': melds[Mahjong.Meld.PONG.value],
+        'kongs': melds[Mahjong.Meld.KONG.value],
+        'eye_type': eye_type,
+        'orphan': melds[Mahjong.Meld.CHOW.value] == 0 and not present & Mahjong.simple_mask,
+        'one_suit': one_suit,
+        'thirteen_orphans': flags['thirteen_orphans'],
+        'nine_gates': flags['nine_gates'],
+        'door_free': False, # in test
+    }
 
 #################################################################################################################
 # Main calculation
 #################################################################################################################
-Faan = 0
-
-if debug_msg:
-    print("odd_flowers : ", odd_flowers)
-    print("even_flowers : ", even_flowers)
-# flower first
-if odd_flowers + even_flowers == 0:
-    Faan += 1
-    debug_str += "No flowers, 1 Faan added.\n"
-elif odd_flowers + even_flowers == 7:
-    Faan = 3
-    debug_str += "Seven Flowers, = 3 Faan.\n"
-    result_name = "Seven Flowers"
-    end_program(0, debug_msg, debug_str, Faan, result_name)
-elif odd_flowers + even_flowers == 8:
-    Faan = 8
-    debug_str += "All Flowers, = 8 Faan.\n"
-    result_name = "All Flowers"
-    end_program(0, debug_msg, debug_str, Faan, result_name)
-elif odd_flowers == 4 or even_flowers == 4:
-    Faan += 2
-    debug_str += "one suit Flowers, 2 Faan added.\n"
-
-# special case
-if orphan:
-    # Thirteen Orphans Pog champ
-    total_orphans = 0
-    have_all_orphans = True
-    # total_orphans += detected_tiles[1] + detected_tiles[9] + \
-    #                 detected_tiles[11] + detected_tiles[19] + \
-    #                 detected_tiles[21] + detected_tiles[29] + \
-    #                 detected_tiles[31] + detected_tiles[32] + detected_tiles[33] + \
-    #                 detected_tiles[41] + detected_tiles[42] + detected_tiles[43] + detected_tiles[44]
 
-    for i in range(0, 3):
-        if(detected_tiles[10 * i + 1] < 1):
-            have_all_orphans = False
-            break
-        if(detected_tiles[10 * i + 9] < 1):
-            have_all_orphans = False
-            break
-        if(detected_tiles[30 + i + 1] < 1):
-            have_all_orphans = False
-            break
-        if(detected_tiles[40 + i + 1] < 1):
-            have_all_orphans = False
-            break
-
-        total_orphans += detected_tiles[10 * i + 1]
-        total_orphans += detected_tiles[10 * i + 9]
-        total_orphans += detected_tiles[30 + i + 1]
-        total_orphans += detected_tiles[40 + i + 1]
-
-    total_orphans += detected_tiles[44]
-    if(detected_tiles[44] < 1):
-        have_all_orphans = False
-    
-    if total_orphans == 14 and have_all_orphans:
-        Faan = 13
-        debug_str += "Thirteen Orphans, = 13 Faan.\n"
-        result_name = "Thirteen Orphans"
-        end_program(0, debug_msg, debug_str, Faan, result_name)
-
-    if eye_type == 1 and melds[Mahjong.Meld.CHOW.value] == 0 and not detected_dragon and not detected_wind:
-        Faan = 10
-        debug_str += "all orphan, = 10 Faan.\n"
-        result_name = "All Orphans"
-        end_program(0, debug_msg, debug_str, Faan, result_name)
-    if one_suit and door_free and detected_tiles[last_suit * 10 + 1] >= 3 and detected_tiles[last_suit * 10 + 9] >= 3:
-        owned_tile = True
-        for i in range(2 , 9):
-            if detected_tiles[last_suit * 10 + i] == 0:
-                owned_tile = False
-                break
-        if owned_tile:
-            Faan = 10
-            debug_str += "Nine Gates, = 10 Faan.\n"
-            result_name = "Nine Gates"
-            end_program(0, debug_msg, debug_str, Faan, result_name)
-
-if words_only:
-    Faan = 10
-    debug_str += "words only, = 10 Faan.\n"
-    result_name = "Words Only"
-    end_program(0, debug_msg, debug_str, Faan, result_name)
-
-if melds[Mahjong.Meld.KONG.value] == 4:
-    Faan = 13
-    debug_str += "All Kongs, = 13 Faan.\n"
-    result_name = "All Kongs"
-    end_program(0, debug_msg, debug_str, Faan, result_name)
-# end special case
-
-# orphan
-if orphan and eye_type == 1 and (detected_dragon or detected_wind):
-    Faan += 1
-    debug_str += "orphans, 1 Faan Added.\n"
-
-# suit
-if one_suit:
-    if detected_dragon or detected_wind or eye_type == 2 or eye_type == 3:
-        Faan += 3
-        debug_str += "mixed suit, 3 Faan Added.\n"
-        result_name = "mixed suit"
-    else:
-        Faan += 7
-        debug_str += "one suit, 7 Faan Added.\n"
-        result_name = "one suit"
-
-# dragon
-if debug_msg:
-    print("detected_dragon_set[0] : ", detected_dragon_set[0])
-    print("detected_dragon_set[1] : ", detected_dragon_set[1])
-    print("eye_type : ", eye_type)
-if detected_dragon_set[0] + detected_dragon_set[1] == 3:
-        Faan += 5
-        debug_str += "big dragon, 5 Faan Added.\n"
-        result_name = "big dragon"
-elif detected_dragon_set[0] + detected_dragon_set[1] == 2 and eye_type == 2:
-        Faan += 3
-        debug_str += "small dragon, 3 Faan Added.\n"
-        result_name = "small dragon"
-# wind set
-if detected_winds_set[0] + detected_winds_set[1] == 4:
-        Faan = 13
-        debug_str += "Great Winds, = 13 Faan.\n"
-        result_name = "Great Winds"
-        end_program(0, debug_msg, debug_str, Faan, result_name)
-if detected_winds_set[0] + detected_winds_set[1] == 3 and eye_type == 3:
-        Faan += 6
-        debug_str += "small wind, 6 Faan Added.\n"
-        result_name = "small wind"
-# wind & dragon
-Faan += cool_wind
-debug_str += "winds, " + str(cool_wind) + " Faan Added.\n"
-Faan += detected_dragon_set[0] + detected_dragon_set[1]
-debug_str += "dragons, " + str(detected_dragon_set[0] + detected_dragon_set[1]) + " Faan Added.\n"
+# calculate the Faan from the hand features with the rule table of MahjongFaanRules
+# returns {'faan', 'name', 'debug', 'rules'}, rules are the names of the rules that fired
+def score_hand(hand, debug_msg = False):
+    result = FaanRules.faan_engine.evaluate(hand)
+    if debug_msg:
+        print("Rules fired : ", result['rules'])
+    if result['faan'] < 1:
+        raise FaanError(f"Invaild Faan calculated, Faan: {result['faan']}")
+    return result
+
+# hands that win without 4 melds and an eye
+no_meld_hands = ("Thirteen Orphans", "Seven Flowers", "All Flowers")
+
+# calculate the Faan of a Mahjong.Hand
+# every decomposition into melds, read from the hand table, is scored and the highest Faan is kept
+# trace gets the meld_parse and scoring times, see MahjongMetrics
+def best_faan(tile_hand, game_wind = -1, seat_wind = -1, seat = -1, debug_msg = False, trace = Metrics.null_trace):
+    table = HandTable.get_table()
+    counts = tile_hand.counts
+    if max(counts) > 4:
+        raise FaanError(f"a tile is counted more than 4 times: {tile_hand.names()}")
+    rows = table.rows(counts)
+    flags = table.hand_flags(counts, rows)
+    decompositions = table.decompose(counts, rows)
+    trace.mark('meld_parse')
+
+    best = None
+    for decomposition in decompositions:
+        hand = hand_features(tile_hand, decomposition, flags, game_wind, seat_wind, seat)
+        try:
+            result = score_hand(hand, debug_msg)
+        except FaanError:
+            continue
+        if best is None or result['faan'] > best['faan']:
+            best = result
+            best['melds'], best['eye'] = HandSolver.describe(decomposition)
+
+    if best is None:
+        hand = hand_features(tile_hand, ((), None), flags, game_wind, seat_wind, seat)
+        result = score_hand(hand, debug_msg)
+        if result['name'] not in no_meld_hands:
+            raise FaanError(f"tiles didn't match any melds: {tile_hand.names()}")
+        best = result
+        best['melds'], best['eye'] = [], None
+    trace.mark('scoring')
+    trace.set('faan', best['faan'])
+    trace.set('result', best['name'].strip())
+    return best
+
+def main():
+    # detection is only needed by the command line, scoring can be imported without the model
+    import cv2
+    from MahjongDetect import TileDetector, draw_detections, read_image, preprocess_frame
+    from MahjongDetectionCache import CachedDetector, DetectionCache
+    from MahjongModelRegistry import default_model_path, resolve_model
 
-# door free
-if door_free:
-    Faan += 1
-    debug_str += "door free, 1 Faan Added.\n"
+    debug_msg = False
+    debug_str = "\nDebug:\n"
+
+    # Define and parse user input arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source', help='The image source for mahjong detection, can be image file ("test.jpg"), image folder ("test_dir")',
+                        required=True)
+    parser.add_argument('--threshold', help='Minimum confidence threshold for displaying detected objects (example: "0.4")',
+                        default=0.2)
+    parser.add_argument('--ROI', help='Adjust the ROI (example: top-left (100,100), bottom-right (500,400)), \
+                        otherwise, detect on the whole image',
+                        nargs=4, type=int, metavar=('x1', 'y1', 'x2', 'y2'),
+                        default=(-1,-1,-1,-1)) # Default ROI is the whole image
+    parser.add_argument('--ignore', help='Ignore area: specify as x1 y1 x2 y2. Can be used multiple times.',
+                        nargs=4, type=int, metavar=('x1', 'y1', 'x2', 'y2'),
+                        action='append',
+                        default=[])
+    parser.add_argument('--game_wind', help='Wind for this game, can be 1, 2, 3, or 4 (1: east, 2: south, 3: west, 4: north)',
+                        type=int, default=-1)
+    parser.add_argument('--seat_wind', help='Wind for this seat, can be 1, 2, 3, or 4 (1: east, 2: south, 3: west, 4: north)',
+                        type=int, default=-1)
+    parser.add_argument('--seat', help='Seat : 0 1 2 3 seat off to the dealer, in clockwise direction',
+                        type=int, default=-1)
+    parser.add_argument('--nondebug', help='Forcing the program to run without all debug settings',
+                        default=False)
+    parser.add_argument('--cache', help='Detection cache file, an image already detected with the same model and settings \
+                        is not run through the model again (example: "MahjongDetectionCache.sqlite")',
+                        default=None)
+    parser.add_argument('--model', help='Path to YOLO model file or model generation ("5"), \
+                        defaults to the best model in Model/ (see MahjongModelRegistry.py)',
+                        default=None)
+    parser.add_argument('--backend', help='Inference backend: pytorch, onnx, onnx-int8, openvino or openvino-int8, \
+                        the exported model next to the .pt model is used (see MahjongExport.py)',
+                        default=None)
+    parser.add_argument('--slice', help='Sliced inference for whole table photos: also run overlapping WxH slices \
+                        of the 1280x1280 frame (example: "640x640")',
+                        default=None)
+    parser.add_argument('--overlap', help='Overlap of neighbouring slices as a fraction of the slice size',
+                        type=float, default=0.2)
+    parser.add_argument('--metrics_jsonl', help='Append the stage timings of this image to a JSON lines file',
+                        default=None)
+    parser.add_argument('--metrics_prom', help='Write stage timing histograms to a Prometheus text file',
+                        default=None)
+    args = parser.parse_args()
+
+    # Parse user inputs
+    img_source = args.source
+    min_threshold = args.threshold
+    ignore_areas = args.ignore
+    nondebug = args.nondebug
+
+    debug_detect = True
+
+    if nondebug:
+        debug_msg = False
+        debug_detect = False
+
+    # Run the mahjong detection in this process, the model is loaded once
+    path_prefix = os.path.dirname(os.path.abspath(__file__))
+    model_path = resolve_model(args.model) if args.model else default_model_path()
+    img_path = img_source if os.path.isfile(img_source) else path_prefix + img_source
+    if args.metrics_jsonl or args.metrics_prom:
+        Metrics.enable(args.metrics_jsonl, args.metrics_prom)
+    resolution = "1280x1280" if debug_detect else None
+    try:
+        if args.cache:
+            # the model is only loaded when the image is not in the cache
+            detector = CachedDetector(DetectionCache(args.cache), model_path, min_threshold, resolution, args.ROI, ignore_areas,
+                                      backend=args.backend, slice_size=args.slice, slice_overlap=args.overlap)
+            trace = Metrics.start(img_path)
+            tile_detections = detector.detect_file(img_path, trace=trace)
+            if debug_detect:
+                frame = preprocess_frame(read_image(img_path), (1280, 1280), detector.roi)
+        else:
+            detector = TileDetector(model_path, min_threshold, resolution, args.ROI, ignore_areas, backend=args.backend,
+                                    slice_size=args.slice, slice_overlap=args.overlap)
+            trace = Metrics.start(img_path)
+            frame, source_size = detector.load_file(img_path)
+            trace.mark('load')
+            prepared = detector.preprocess(frame, source_size=source_size)
+            trace.mark('preprocess')
+            tile_detections = detector.infer(prepared, trace=trace)
+            if debug_detect:
+                frame = prepared.display()
+    except (ValueError, FileNotFoundError) as e:
+        print("Error occurred during detection:")
+        print(f"ERROR: {e}")
+        Metrics.disable()
+        end_program(1, debug_msg, debug_str)
 
-# melds
-if melds[Mahjong.Meld.PONG.value] == 0 and melds[Mahjong.Meld.KONG.value] == 0: # common
-    Faan += 1
-    debug_str += "common hand, 1 Faan Added.\n"
-    result_name += " common hand"
-elif melds[Mahjong.Meld.CHOW.value] == 0:
-    Faan += 3
-    debug_str += "triplets, 3 Faan Added.\n"
-    result_name += " triplets"
-    if door_free:
-        Faan += 1   # 1 Faan for door free is calculated before
-        debug_str += "door free on triplets, 1 Faan Added.\n"
+    if debug_detect:
+        # show the detection result, press any key to continue
+        draw_detections(frame, tile_detections, detector.threshold, detector.ignore_areas)
+        cv2.imshow('YOLO detection results', frame)
+        cv2.waitKey()
+        cv2.destroyAllWindows()
+
+    try:
+        if not len(tile_detections):
+            raise FaanError("No tiles detected.")
+        trace.restart()
+        tile_hand = tile_detections.to_hand()
+        layout = tile_detections.layout()
+        trace.mark('layout')
+        if debug_detect:
+            names = tile_detections.class_names()
+            for index, row in enumerate(layout.sequences(names)):
+                print(f"Row {index}: {' '.join(row)}")
+            for group, meld in layout.exposed_melds(names):
+                print(f"Exposed {meld.name.lower()}: {' '.join(names[i] for i in group)}")
+        result = best_faan(tile_hand, args.game_wind, args.seat_wind, args.seat, debug_msg, trace)
+    except (FaanError, ValueError) as e:
+        print(f"Error: {e}")
+        trace.set('error', str(e))
+        Metrics.finish(trace)
+        Metrics.disable()
+        end_program(1, debug_msg, debug_str)
 
-if Faan < 1:
-    print("Error: Invaild Faan calculated")
-    print("Faan:", Faan)
-    end_program(1, debug_msg, debug_str)
+    Metrics.finish(trace)
+    Metrics.disable()
+    end_program(0, debug_msg, result['debug'], result['faan'], result['name'])
 
-end_program(0, debug_msg, debug_str, Faan, result_name)
-    
\ No newline at end of file
+if __name__ == '__main__':
+    main()
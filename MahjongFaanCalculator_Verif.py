@@ -1,37 +1,186 @@
-import subprocess
-import glob
+import os
 import sys
+import json
+import glob
+import time
+import argparse
+from multiprocessing import Pool
+
+# Regression run of the faan calculator over a folder of hand images
+#
+# The images are spread over a pool of worker processes, each worker loads the model once
+# and keeps it for all its images. Every result is checked against the expected hand:
+#   - a manifest, JSON {"image file name": {"faan": 13, "name": "Thirteen Orphans", "game_wind": 1, ...}}
+#   - otherwise the file name, see filename_expectations
+# The expected name has to be part of the result name ("triplets" passes "mixed suit triplets"),
+# the expected faan has to match when it is given.
+
+path_prefix = os.path.dirname(os.path.abspath(__file__))
+default_test_dir = os.path.join(path_prefix, 'Test')
+manifest_name = 'expected.json'
+
+# file name (without a leading '_' and the extension) -> expected result
+filename_expectations = {
+    '13orphans': {'name': 'Thirteen Orphans', 'faan': 13},
+    'orphans': {'name': 'All Orphans', 'faan': 10},
+    'words': {'name': 'Words Only', 'faan': 10},
+    'great_wind': {'name': 'Great Winds', 'faan': 13},
+    'great_dra': {'name': 'big dragon'},
+    'triplets': {'name': 'triplets'},
+    'common': {'name': 'common hand'},
+}
 
 # search for all image files name in a specified directory
 def find_image_files(img_source):
     image_files = []
     for ext in ['jpg', 'jpeg', 'png', 'bmp']:
-        image_files.extend(glob.glob(f'{img_source}/*.{ext}'))
-    return image_files
+        image_files.extend(glob.glob(os.path.join(img_source, f'*.{ext}')))
+    return sorted(image_files)
+
+def expectation_from_filename(image):
+    stem = os.path.splitext(os.path.basename(image))[0].lstrip('_')
+    return filename_expectations.get(stem)
+
+def load_expectations(image_files, manifest_path=None):
+    manifest = {}
+    if manifest_path and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    return {image: manifest.get(os.path.basename(image), expectation_from_filename(image)) for image in image_files}
+
+def check(expected, faan, name):
+    if expected is None:
+        return 'unchecked'
+    if 'faan' in expected and expected['faan'] != faan:
+        return 'fail'
+    if 'name' in expected and expected['name'] not in name:
+        return 'fail'
+    return 'pass'
+
+detector = None
+
+# load the model once per worker
+def init_worker(model_path, threshold, resolution, cache_path, threads, backend=None):
+    global detector
+    os.environ.setdefault('YOLO_OFFLINE', '1')
+    # the workers share the cores, keep torch from starting a thread per core in each of them
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    from MahjongDetect import TileDetector
+    from MahjongDetectionCache import CachedDetector, DetectionCache
+    t_start = time.perf_counter()
+    if cache_path:
+        detector = CachedDetector(DetectionCache(cache_path), model_path, threshold, resolution, backend=backend)
+    else:
+        detector = TileDetector(model_path, threshold, resolution, backend=backend)
+    detector.init_time = time.perf_counter() - t_start
+
+def run_image(task):
+    from MahjongFaanCalculator import best_faan, FaanError
+    image, expected = task
+    expected = expected or {}
+    result = {'image': image, 'expected': expected or None, 'worker': os.getpid(),
+              'model_load_ms': detector.init_time * 1000}
+    # the model load is only reported by the first image of each worker
+    detector.init_time = 0.0
+
+    t_start = time.perf_counter()
+    try:
+        detections = detector.detect_file(image)
+    except ValueError as e:
+        result.update(status='error', error=str(e), detect_ms=(time.perf_counter() - t_start) * 1000)
+        return result
+    t_detect = time.perf_counter()
+
+    result['tiles'] = detections.class_names()
+    try:
+        if not len(detections):
+            raise FaanError("No tiles detected.")
+        faan = best_faan(detections.to_hand(), expected.get('game_wind', -1), expected.get('seat_wind', -1), expected.get('seat', -1))
+    except (FaanError, ValueError) as e:
+        result.update(status='error', error=str(e))
+    else:
+        result.update(faan=faan['faan'], name=faan['name'].strip(), melds=faan['melds'], eye=faan['eye'])
+        result['status'] = check(expected or None, result['faan'], result['name'])
+    t_end = time.perf_counter()
+    result.update(detect_ms=(t_detect - t_start) * 1000, score_ms=(t_end - t_detect) * 1000)
+    return result
+
+def run_suite(image_files, expectations, model_path, threshold=0.4, resolution='1280x1280', workers=None, cache_path=None,
+              backend=None):
+    workers = max(1, min(workers or os.cpu_count() or 1, len(image_files)))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    tasks = [(image, expectations.get(image)) for image in image_files]
+
+    t_start = time.perf_counter()
+    with Pool(processes=workers, initializer=init_worker,
+              initargs=(model_path, threshold, resolution, cache_path, threads, backend)) as pool:
+        results = pool.map(run_image, tasks, chunksize=1)
+    elapsed = time.perf_counter() - t_start
 
-dir = '.\\Test'
-image_files = find_image_files(dir)
+    summary = {status: sum(1 for result in results if result['status'] == status)
+               for status in ('pass', 'fail', 'error', 'unchecked')}
+    summary.update(total=len(results), workers=workers, wall_time_s=elapsed,
+                   model_load_s=max((result['model_load_ms'] for result in results), default=0.0) / 1000)
+    return {'summary': summary, 'results': results}
 
-quick_test = False
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source', help='Folder of test images', default=default_test_dir)
+    parser.add_argument('--manifest', help=f'JSON file of expected results, defaults to {manifest_name} in the source folder',
+                        default=None)
+    parser.add_argument('--model', help='Path to YOLO model file or model generation ("5"), defaults to the best model in Model/',
+                        default=None)
+    parser.add_argument('--threshold', help='Minimum confidence threshold for detected tiles', type=float, default=0.4)
+    parser.add_argument('--resolution', help='Resize the images to WxH before detection', default='1280x1280')
+    parser.add_argument('--backend', help='Inference backend: pytorch, onnx, onnx-int8, openvino or openvino-int8',
+                        default=None)
+    parser.add_argument('--workers', help='Number of worker processes, each loads the model once', type=int, default=None)
+    parser.add_argument('--cache', help='Detection cache file, cached images skip the model', default=None)
+    parser.add_argument('--report', help='Write the JSON report to this file', default=None)
+    parser.add_argument('--quick', help='Skip the images starting with "_", they passed before', action='store_true')
+    args = parser.parse_args()
 
-for image in image_files:
+    image_files = find_image_files(args.source)
+    if args.quick:
+        image_files = [image for image in image_files if not os.path.basename(image).startswith('_')]
+    if not image_files:
+        print(f'ERROR: no images in {args.source}')
+        sys.exit(1)
+    try:
+        from MahjongDetect import backend_model_path
+        from MahjongModelRegistry import default_model_path, resolve_model
+        args.model = resolve_model(args.model) if args.model else default_model_path()
+        model_file = backend_model_path(args.model, args.backend)
+    except ValueError as e:
+        print(f'ERROR: {e}')
+        sys.exit(1)
+    if not os.path.exists(model_file):
+        print(f'ERROR: model not found: {model_file}')
+        sys.exit(1)
 
-    # for debug, skip the files that pass the test before
-    if quick_test and image.startswith(dir + '\\_'):
-        continue
+    expectations = load_expectations(image_files, args.manifest or os.path.join(args.source, manifest_name))
+    report = run_suite(image_files, expectations, args.model, args.threshold, args.resolution, args.workers, args.cache,
+                       args.backend)
 
-    result = subprocess.run(
-    ["python", "MahjongFaanCalculator.py", "--source", image, "--threshold", str(0.4)],
-    capture_output=True,
-    text=True
-    )
+    for result in report['results']:
+        expected = result['expected'] or {}
+        got = f"{result.get('faan')} Faan {result.get('name')}" if 'faan' in result else result.get('error')
+        want = f"{expected.get('faan', '?')} Faan {expected.get('name', '?')}" if expected else 'nothing'
+        print(f"{result['status'].upper():<10}{os.path.basename(result['image']):<20}{got}  (expected {want}, "
+              f"detect {result['detect_ms']:.0f} ms)")
+    summary = report['summary']
+    print(f"{summary['pass']} passed, {summary['fail']} failed, {summary['error']} errors, {summary['unchecked']} unchecked "
+          f"in {summary['wall_time_s']:.2f}s on {summary['workers']} workers (model load {summary['model_load_s']:.2f}s)")
 
-    print("Image:", image)
-    if result.stdout:
-        print("Output:", result.stdout)
-    if result.stderr:
-        print("Error:", result.stderr)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
 
-print("All files processed")
+    sys.exit(1 if summary['fail'] or summary['error'] else 0)
 
-sys.exit(0)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+import time
+
+# The features a rule can read, produced by MahjongFaanCalculator.hand_features
+feature_names = (
+    'flowers', 'odd_flowers', 'even_flowers', 'nice_flowers',
+    'detected_dragon', 'detected_dragon_set', 'dragon_sets',
+    'detected_wind', 'detected_winds_set', 'wind_sets', 'cool_wind',
+    'words_only', 'melds', 'chows', 'pongs', 'kongs', 'eye_type',
+    'orphan', 'one_suit', 'thirteen_orphans', 'nine_gates', 'door_free',
+)
+
+# One faan pattern
+#   name   : the name shown in the debug output and the fired rule list
+#   faan   : Faan of the rule, or a function of the features for rules like the wind count
+#   test   : function of the features, True when the rule fires
+#   needs  : the features the test reads, checked against feature_names
+#   limit  : limit hands replace every cumulative rule, the first limit hand in the list wins
+#   title  : 'set' makes the rule the result name (the last one that fires wins),
+#            'append' adds the rule name after it
+class Rule:
+    __slots__ = ('name', 'faan', 'test', 'needs', 'limit', 'title', 'evaluations', 'hits', 'seconds')
+
+    def __init__(self, name, faan, test, needs, limit=False, title=None):
+        self.name = name
+        self.faan = faan
+        self.test = test
+        self.needs = tuple(needs)
+        self.limit = limit
+        self.title = title
+        self.evaluations = 0
+        self.hits = 0
+        self.seconds = 0.0
+
+    def value(self, hand):
+        return self.faan(hand) if callable(self.faan) else self.faan
+
+# Evaluates a rule list in one pass over the hand features
+# the rules are compiled once: limit hands first in their declared order, then the cumulative rules
+# with profile on, every rule records its evaluation count, hit count and time spent
+class RuleEngine:
+
+    def __init__(self, rules, profile=False):
+        for rule in rules:
+            unknown = [need for need in rule.needs if need not in feature_names]
+            if unknown:
+                raise ValueError(f'Rule {rule.name} needs unknown features {unknown}')
+        self.rules = list(rules)
+        self.limit_rules = [rule for rule in rules if rule.limit]
+        self.cumulative_rules = [rule for rule in rules if not rule.limit]
+        self.profile = profile
+
+    # returns {'faan', 'name', 'debug', 'rules'}, faan is 0 when no rule gives any Faan
+    def evaluate(self, hand):
+        if self.profile:
+            return self.evaluate_profiled(hand)
+
+        for rule in self.limit_rules:
+            if rule.test(hand):
+                faan = rule.value(hand)
+                return {'faan': faan, 'name': rule.name, 'rules': [rule.name],
+                        'debug': f"\nDebug:\n{rule.name}, = {faan} Faan.\n"}
+
+        fired = []
+        for rule in self.cumulative_rules:
+            if rule.test(hand):
+                fired.append(rule)
+        return self.combine(hand, fired)
+
+    def evaluate_profiled(self, hand):
+        clock = time.perf_counter
+        for rule in self.limit_rules:
+            t_start = clock()
+            hit = rule.test(hand)
+            rule.seconds += clock() - t_start
+            rule.evaluations += 1
+            if hit:
+                rule.hits += 1
+                faan = rule.value(hand)
+                return {'faan': faan, 'name': rule.name, 'rules': [rule.name],
+                        'debug': f"\nDebug:\n{rule.name}, = {faan} Faan.\n"}
+
+        fired = []
+        for rule in self.cumulative_rules:
+            t_start = clock()
+            hit = rule.test(hand)
+            rule.seconds += clock() - t_start
+            rule.evaluations += 1
+            if hit:
+                rule.hits += 1
+                fired.append(rule)
+        return self.combine(hand, fired)
+
+    def combine(self, hand, fired):
+        faan = 0
+        title = ""
+        suffix = ""
+        debug_str = "\nDebug:\n"
+        for rule in fired:
+            value = rule.value(hand)
+            faan += value
+            debug_str += f"{rule.name}, {value} Faan Added.\n"
+            if rule.title == 'set':
+                title = rule.name
+            elif rule.title == 'append':
+                suffix += " " + rule.name
+        return {'faan': faan, 'name': title + suffix, 'rules': [rule.name for rule in fired], 'debug': debug_str}
+
+    # per rule counters, collected while profile is on
+    def stats(self):
+        return [{'rule': rule.name,
+                 'evaluations': rule.evaluations,
+                 'hits': rule.hits,
+                 'hit_rate': rule.hits / rule.evaluations if rule.evaluations else 0.0,
+                 'total_us': rule.seconds * 1e6,
+                 'mean_us': rule.seconds * 1e6 / rule.evaluations if rule.evaluations else 0.0}
+                for rule in self.rules]
+
+    def reset_stats(self):
+        for rule in self.rules:
+            rule.evaluations = 0
+            rule.hits = 0
+            rule.seconds = 0.0
+
+# eye_type: -1 not detected, 0 common eye, 1 orphan eye, 2 dragon eye, 3 wind eye
+faan_rules = [
+    # limit hands, in precedence order
+    Rule("Seven Flowers", 3, lambda h: h['flowers'] == 7, ['flowers'], limit=True),
+    Rule("All Flowers", 8, lambda h: h['flowers'] == 8, ['flowers'], limit=True),
+    Rule("Thirteen Orphans", 13, lambda h: h['orphan'] and h['thirteen_orphans'],
+         ['orphan', 'thirteen_orphans'], limit=True),
+    Rule("All Orphans", 10,
+         lambda h: h['orphan'] and h['eye_type'] == 1 and h['chows'] == 0 and not h['detected_dragon'] and not h['detected_wind'],
+         ['orphan', 'eye_type', 'chows', 'detected_dragon', 'detected_wind'], limit=True),
+    Rule("Nine Gates", 10, lambda h: h['door_free'] and h['nine_gates'], ['door_free', 'nine_gates'], limit=True),
+    Rule("Words Only", 10, lambda h: h['words_only'], ['words_only'], limit=True),
+    Rule("All Kongs", 13, lambda h: h['kongs'] == 4, ['kongs'], limit=True),
+    Rule("Great Winds", 13, lambda h: h['wind_sets'] == 4, ['wind_sets'], limit=True),
+
+    # cumulative rules
+    Rule("No flowers", 1, lambda h: h['flowers'] == 0, ['flowers']),
+    Rule("one suit Flowers", 2, lambda h: h['odd_flowers'] == 4 or h['even_flowers'] == 4, ['odd_flowers', 'even_flowers']),
+    Rule("orphans", 1, lambda h: h['orphan'] and h['eye_type'] == 1 and (h['detected_dragon'] or h['detected_wind']),
+         ['orphan', 'eye_type', 'detected_dragon', 'detected_wind']),
+    Rule("mixed suit", 3,
+         lambda h: h['one_suit'] and (h['detected_dragon'] or h['detected_wind'] or h['eye_type'] in (2, 3)),
+         ['one_suit', 'detected_dragon', 'detected_wind', 'eye_type'], title='set'),
+    Rule("one suit", 7,
+         lambda h: h['one_suit'] and not (h['detected_dragon'] or h['detected_wind'] or h['eye_type'] in (2, 3)),
+         ['one_suit', 'detected_dragon', 'detected_wind', 'eye_type'], title='set'),
+    Rule("big dragon", 5, lambda h: h['dragon_sets'] == 3, ['dragon_sets'], title='set'),
+    Rule("small dragon", 3, lambda h: h['dragon_sets'] == 2 and h['eye_type'] == 2, ['dragon_sets', 'eye_type'], title='set'),
+    Rule("small wind", 6, lambda h: h['wind_sets'] == 3 and h['eye_type'] == 3, ['wind_sets', 'eye_type'], title='set'),
+    Rule("winds", lambda h: h['cool_wind'], lambda h: h['cool_wind'] > 0, ['cool_wind']),
+    Rule("dragons", lambda h: h['dragon_sets'], lambda h: h['dragon_sets'] > 0, ['dragon_sets']),
+    Rule("door free", 1, lambda h: h['door_free'], ['door_free']),
+    Rule("common hand", 1, lambda h: h['pongs'] == 0 and h['kongs'] == 0, ['pongs', 'kongs'], title='append'),
+    Rule("triplets", 3, lambda h: (h['pongs'] or h['kongs']) and h['chows'] == 0, ['pongs', 'kongs', 'chows'], title='append'),
+    Rule("door free on triplets", 1, lambda h: h['door_free'] and (h['pongs'] or h['kongs']) and h['chows'] == 0,
+         ['door_free', 'pongs', 'kongs', 'chows']),
+]
+
+faan_engine = RuleEngine(faan_rules)
@@ -0,0 +1,133 @@
+import time
+from collections import Counter
+
+import numpy as np
+
+import MahjongTile as Mahjong
+import MahjongLayout as Layout
+from MahjongShanten import LiveHand, score_win
+
+# The hand of one player followed over a stream of detections
+#
+# Every frame is counted into a tile count vector. A frame with the counts of the current hand
+# costs one comparison. Different counts become the candidate hand, and they are taken over
+# once the frames that agree on them have summed up confirm_weight of confidence (the mean
+# confidence of the tiles that changed). So a hand moving over the tiles or a misread tile in a
+# few frames does not change the hand. Only a confirmed change reads the hand again, through
+# MahjongShanten.LiveHand, which reads only the changed suits. The faan is only calculated
+# for a complete hand (shanten -1), and the result is cached by hand.
+#
+# The events of a confirmed change:
+#   hand    : the first hand seen
+#   draw    : one tile more
+#   discard : one tile less
+#   meld    : a new exposed meld, see MahjongLayout.exposed_melds, with the tiles it claimed
+#   change  : any other change (tiles added and removed)
+#   win     : the hand is complete, with its faan
+
+default_confirm_weight = 2.0
+# class name of every hand slot, the flowers by their first class name
+slot_names = {}
+for class_name, slot in Mahjong.class_slot.items():
+    slot_names.setdefault(slot, class_name)
+
+class GameState:
+
+    def __init__(self, game_wind=-1, seat_wind=-1, seat=-1, confirm_weight=default_confirm_weight):
+        self.live = LiveHand(None, game_wind, seat_wind, seat)
+        self.confirm_weight = float(confirm_weight)
+        self.counts = None
+        self.exposed = Counter()
+        self.candidate = None
+        self.weight = 0.0
+        self.result = None
+        self.counters = Counter(frames=0, unchanged=0, pending=0, changes=0, scored=0)
+        self.score_time = 0.0
+
+    # count vector of the class names, unknown classes are left out
+    @staticmethod
+    def count(names):
+        slots = [Mahjong.class_slot[name] for name in names if name in Mahjong.class_slot]
+        return np.bincount(slots, minlength=Mahjong.hand_size).astype(np.int16)
+
+    # one frame of the hand: names, conf (N,) and xyxy (N, 4) of its tiles
+    # returns the events of the frame, an empty list while the hand is unchanged or not confirmed yet
+    def update(self, names, conf, xyxy):
+        self.counters['frames'] += 1
+        counts = self.count(names)
+        if self.counts is not None and np.array_equal(counts, self.counts):
+            self.counters['unchanged'] += 1
+            self.candidate = None
+            self.weight = 0.0
+            return []
+
+        # evidence of the change: the confidence of the tiles whose counts changed, of all tiles for a removal
+        conf = np.asarray(conf, dtype=np.float64).reshape(-1)
+        changed = counts != (self.counts if self.counts is not None else 0)
+        in_changed = np.array([changed[Mahjong.class_slot[name]] if name in Mahjong.class_slot else False
+                               for name in names], dtype=bool)
+        weight = float(conf[in_changed].mean()) if in_changed.any() else float(conf.mean()) if len(conf) else 0.0
+        if self.candidate is not None and np.array_equal(counts, self.candidate):
+            self.weight += weight
+        else:
+            self.candidate = counts
+            self.weight = weight
+        if self.weight < self.confirm_weight:
+            self.counters['pending'] += 1
+            return []
+        return self.accept(counts, list(names), xyxy)
+
+    def update_detections(self, detections):
+        return self.update(detections.class_names(), detections.conf, detections.xyxy)
+
+    # take over the confirmed counts and describe the change
+    def accept(self, counts, names, xyxy):
+        self.counters['changes'] += 1
+        old_counts, self.counts = self.counts, counts
+        self.candidate = None
+        self.weight = 0.0
+        exposed = Counter(tuple(sorted(names[i] for i in group))
+                          for group, _ in Layout.tile_layout(xyxy, names).exposed_melds(names))
+        new_melds = exposed - self.exposed
+        self.exposed = exposed
+
+        events = []
+        if old_counts is None:
+            events.append({'event': 'hand', 'tiles': self.names(counts)})
+        else:
+            diff = counts - old_counts
+            added = self.names(np.maximum(diff, 0))
+            removed = self.names(np.maximum(-diff, 0))
+            for meld in new_melds.elements():
+                events.append({'event': 'meld', 'type': Layout.meld_type(list(meld)).name.lower(), 'tiles': list(meld),
+                               'claimed': added})
+            if not new_melds:
+                if len(added) == 1 and not removed:
+                    events.append({'event': 'draw', 'tile': added[0]})
+                elif len(removed) == 1 and not added:
+                    events.append({'event': 'discard', 'tile': removed[0]})
+                else:
+                    events.append({'event': 'change', 'added': added, 'removed': removed})
+
+        self.result = None
+        if counts.min() >= 0 and counts.max() <= 4:
+            t_start = time.perf_counter()
+            self.live.update(Mahjong.Hand(counts.astype(np.uint8).tobytes()))
+            if self.live.shanten() == -1:
+                faan, name = score_win(self.live.hand, *self.live.context)
+                self.counters['scored'] += 1
+                if faan is not None:
+                    self.result = {'faan': faan, 'name': name}
+                    events.append({'event': 'win', 'faan': faan, 'name': name, 'tiles': self.names(counts)})
+            self.score_time += time.perf_counter() - t_start
+        return events
+
+    # class names of a count vector, tiles in index order and the flowers after them
+    @staticmethod
+    def names(counts):
+        return [slot_names[slot] for slot in np.flatnonzero(counts).tolist() for _ in range(int(counts[slot]))]
+
+    # frames that did not read the hand again: unchanged or still waiting for confirmation
+    def summary(self):
+        return dict(self.counters, skipped=self.counters['unchanged'] + self.counters['pending'],
+                    score_ms=self.score_time * 1000, shanten=self.live.shanten() if self.counts is not None else None)
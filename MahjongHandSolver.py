@@ -0,0 +1,66 @@
+import itertools
+from functools import lru_cache
+
+import MahjongTile as Mahjong
+
+# start index of each suit in the 34 tile count vector, honors have no chows
+suit_offsets = (0, 9, 18, 27)
+suit_ends = (9, 18, 27, 34)
+suit_chows = (True, True, True, False)
+
+# All the ways to split the counts of one suit into melds and at most one eye
+# counts is a tuple of tile counts inside the suit, the lowest tile is always
+# taken first so every split is found exactly once
+# returns a tuple of (melds, eye): melds is a tuple of (Meld, position), eye a position or None
+@lru_cache(maxsize=None)
+def split_suit(counts, allow_chow):
+    first = next((i for i, c in enumerate(counts) if c), None)
+    if first is None:
+        return (((), None),)
+
+    splits = []
+
+    def take(removed):
+        rest = list(counts)
+        for pos in removed:
+            rest[pos] -= 1
+        return split_suit(tuple(rest), allow_chow)
+
+    if counts[first] >= 4:
+        for melds, eye in take([first] * 4):
+            splits.append((((Mahjong.Meld.KONG, first),) + melds, eye))
+    if counts[first] >= 3:
+        for melds, eye in take([first] * 3):
+            splits.append((((Mahjong.Meld.PONG, first),) + melds, eye))
+    if counts[first] >= 2:
+        for melds, eye in take([first] * 2):
+            # cant have 2 eyes
+            if eye is None:
+                splits.append((melds, first))
+    if allow_chow and first + 2 < len(counts) and counts[first + 1] and counts[first + 2]:
+        for melds, eye in take([first, first + 1, first + 2]):
+            splits.append((((Mahjong.Meld.CHOW, first),) + melds, eye))
+    return tuple(splits)
+
+# Every way to read a 34 count vector as 4 melds plus 1 eye
+# returns a list of (melds, eye) with melds a tuple of (Meld, tile index) and eye a tile index
+def decompose(counts):
+    suits = [split_suit(tuple(counts[start:end]), allow_chow)
+             for start, end, allow_chow in zip(suit_offsets, suit_ends, suit_chows)]
+    decompositions = []
+    for combo in itertools.product(*suits):
+        eyes = [offset + eye for (_, eye), offset in zip(combo, suit_offsets) if eye is not None]
+        if len(eyes) != 1:
+            continue
+        melds = tuple((meld, offset + pos) for (suit_melds, _), offset in zip(combo, suit_offsets)
+                      for meld, pos in suit_melds)
+        if len(melds) != 4:
+            continue
+        decompositions.append((melds, eyes[0]))
+    return decompositions
+
+# readable form of a decomposition, e.g. (['PONG b1', 'CHOW c4'], 'dr')
+def describe(decomposition):
+    melds, eye = decomposition
+    return ([f'{meld.name} {Mahjong.tile_names[index]}' for meld, index in melds],
+            Mahjong.tile_names[eye] if eye is not None else None)
@@ -0,0 +1,277 @@
+import os
+import sys
+import mmap
+import struct
+import tempfile
+import bisect
+import argparse
+import itertools
+
+import MahjongTile as Mahjong
+import MahjongHandSolver as HandSolver
+
+# Precomputed table of every per-suit count pattern that can be part of a winning hand
+#
+# A suit pattern is the 9 counts of b1-b9, c1-c9 or d1-d9, the honor pattern is the 7 counts
+# of dr dg dw we ws ww wn. Patterns are keyed by their base 5 code, honors have honor_key_bit set.
+# For every pattern the table stores its flags and all its meld / eye splits, so a hand is
+# checked and decomposed with 4 lookups, one per suit and one for the honors.
+#
+# File layout, little endian:
+#   header  : magic, version, pattern count n, blob size
+#   keys    : uint32[n] sorted pattern keys
+#   offsets : uint32[n + 1] start of the splits of each pattern in the blob
+#   flags   : uint8[n]
+#   blob    : splits, each is [meld count, eye, meld bytes...], eye is 0xFF when there is none
+#             a meld byte is Meld value << 4 | position
+
+table_magic = b'MJHT'
+table_version = 2
+header_format = '<4sIII'
+honor_key_bit = 1 << 21
+no_eye = 0xFF
+
+default_table_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'MahjongHandTable.bin')
+
+# pattern flags, the facts of a hand that no meld split shows
+# (triplets, common hand and the like are read from each split by MahjongFaanCalculator.hand_features)
+ORPHAN_PART = 1     # the suit's share of Thirteen Orphans: 1 and 9 (or every honor) once or twice, nothing else
+NINE_GATES = 2      # 1112345678999 plus any tile of the suit
+
+nine_gates_base = (3, 1, 1, 1, 1, 1, 1, 1, 3)
+
+def pattern_key(counts, honor=False):
+    key = 0
+    for count in reversed(counts):
+        key = key * 5 + count
+    return key | honor_key_bit if honor else key
+
+def pattern_flags(counts, honor):
+    flags = 0
+    if honor:
+        if all(1 <= count <= 2 for count in counts):
+            flags |= ORPHAN_PART
+    else:
+        if 1 <= counts[0] <= 2 and 1 <= counts[8] <= 2 and all(count == 0 for count in counts[1:8]):
+            flags |= ORPHAN_PART
+        extra = [count - base for count, base in zip(counts, nine_gates_base)]
+        if min(extra) >= 0 and sum(extra) == 1:
+            flags |= NINE_GATES
+    return flags
+
+# every count pattern reachable with at most 4 melds and 1 eye in one suit
+def suit_patterns(size, allow_chow):
+    groups = [(pos,) * 3 for pos in range(size)] + [(pos,) * 4 for pos in range(size)]
+    if allow_chow:
+        groups += [(pos, pos + 1, pos + 2) for pos in range(size - 2)]
+    eyes = [()] + [(pos, pos) for pos in range(size)]
+    patterns = set()
+    for meld_count in range(5):
+        for combo in itertools.combinations_with_replacement(groups, meld_count):
+            for eye in eyes:
+                counts = [0] * size
+                for pos in itertools.chain(eye, *combo):
+                    counts[pos] += 1
+                if max(counts, default=0) <= 4:
+                    patterns.add(tuple(counts))
+    return patterns
+
+# enumerate every pattern once and write the table, returns the table bytes
+def build_table(path=default_table_path):
+    entries = {}
+    for honor, size in ((False, 9), (True, 7)):
+        patterns = suit_patterns(size, not honor)
+        # the Thirteen Orphans shares have no meld split but are needed for their flag
+        if honor:
+            patterns |= set(itertools.product((1, 2), repeat=7))
+        else:
+            patterns |= {(a,) + (0,) * 7 + (b,) for a in (1, 2) for b in (1, 2)}
+        for counts in patterns:
+            splits = [split for split in HandSolver.split_suit(counts, not honor) if len(split[0]) <= 4]
+            entries[pattern_key(counts, honor)] = (pattern_flags(counts, honor), splits)
+
+    keys = sorted(entries)
+    offsets = []
+    flags = bytearray()
+    blob = bytearray()
+    for key in keys:
+        pattern_flag, splits = entries[key]
+        offsets.append(len(blob))
+        flags.append(pattern_flag)
+        for melds, eye in splits:
+            blob.append(len(melds))
+            blob.append(no_eye if eye is None else eye)
+            blob.extend(meld.value << 4 | pos for meld, pos in melds)
+    offsets.append(len(blob))
+
+    data = b''.join([
+        struct.pack(header_format, table_magic, table_version, len(keys), len(blob)),
+        struct.pack(f'<{len(keys)}I', *keys),
+        struct.pack(f'<{len(offsets)}I', *offsets),
+        bytes(flags),
+        bytes(blob),
+    ])
+    if path:
+        # written next to the table and renamed over it, a reader never maps a partly written file
+        fd, temp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    return data
+
+# Read only view of the table, memory-mapped from disk or over bytes built in memory
+class HandTable:
+
+    def __init__(self, path=default_table_path, data=None):
+        self.mmap = None
+        if data is None:
+            with open(path, 'rb') as f:
+                self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            data = self.mmap
+        view = memoryview(data)
+        magic, version, n, blob_size = struct.unpack_from(header_format, view)
+        if magic != table_magic or version != table_version:
+            raise ValueError(f'{path} is not a version {table_version} hand table.')
+        start = struct.calcsize(header_format)
+        self.keys = view[start:start + 4 * n].cast('I')
+        start += 4 * n
+        self.offsets = view[start:start + 4 * (n + 1)].cast('I')
+        start += 4 * (n + 1)
+        self.flags = view[start:start + n]
+        start += n
+        self.blob = view[start:start + blob_size]
+        self.split_cache = {}
+
+    # table row of a pattern, -1 when the pattern can not be part of a winning hand
+    # a count above 4 would carry into the next base 5 digit and read as another pattern
+    def find(self, counts, honor=False):
+        if max(counts, default=0) > 4:
+            return -1
+        key = pattern_key(counts, honor)
+        row = bisect.bisect_left(self.keys, key)
+        if row < len(self.keys) and self.keys[row] == key:
+            return row
+        return -1
+
+    def pattern_flags(self, row):
+        return self.flags[row] if row >= 0 else 0
+
+    # the (melds, eye) splits stored for a row, positions are inside the suit
+    def splits(self, row):
+        if row < 0:
+            return ()
+        splits = self.split_cache.get(row)
+        if splits is None:
+            blob = self.blob
+            pos = self.offsets[row]
+            end = self.offsets[row + 1]
+            splits = []
+            while pos < end:
+                meld_count, eye = blob[pos], blob[pos + 1]
+                melds = tuple((Mahjong.Meld(byte >> 4), byte & 0xF) for byte in blob[pos + 2:pos + 2 + meld_count])
+                splits.append((melds, None if eye == no_eye else eye))
+                pos += 2 + meld_count
+            splits = tuple(splits)
+            self.split_cache[row] = splits
+        return splits
+
+    # the table rows of the 3 suits and the honors of a 34 count vector
+    def rows(self, counts):
+        return [self.find(counts[start:end], not allow_chow)
+                for start, end, allow_chow in zip(HandSolver.suit_offsets, HandSolver.suit_ends, HandSolver.suit_chows)]
+
+    # same result as HandSolver.decompose, read from the table
+    def decompose(self, counts, rows=None):
+        rows = self.rows(counts) if rows is None else rows
+        if min(rows) < 0:
+            return []
+        decompositions = []
+        for combo in itertools.product(*(self.splits(row) for row in rows)):
+            eyes = [offset + eye for (_, eye), offset in zip(combo, HandSolver.suit_offsets) if eye is not None]
+            if len(eyes) != 1:
+                continue
+            melds = tuple((meld, offset + pos) for (suit_melds, _), offset in zip(combo, HandSolver.suit_offsets)
+                          for meld, pos in suit_melds)
+            if len(melds) != 4:
+                continue
+            decompositions.append((melds, eyes[0]))
+        return decompositions
+
+    # hand level facts read from the per-suit flags
+    def hand_flags(self, counts, rows=None):
+        rows = self.rows(counts) if rows is None else rows
+        flags = [self.pattern_flags(row) for row in rows]
+        suits = [i for i in range(3) if any(counts[HandSolver.suit_offsets[i]:HandSolver.suit_ends[i]])]
+        return {
+            'thirteen_orphans': sum(counts) == 14 and all(flag & ORPHAN_PART for flag in flags),
+            'nine_gates': len(suits) == 1 and not any(counts[27:]) and bool(flags[suits[0]] & NINE_GATES),
+            'suits': suits,
+        }
+
+    def close(self):
+        self.split_cache.clear()
+        for view in (self.keys, self.offsets, self.flags, self.blob):
+            view.release()
+        if self.mmap is not None:
+            self.mmap.close()
+
+# the loaded tables by absolute path
+loaded_tables = {}
+
+# the shared table, built and written on first use when the file is missing or not a complete table
+# processes starting at the same time may all build it, each one replaces the file in one step
+def get_table(path=default_table_path):
+    key = os.path.abspath(path)
+    table = loaded_tables.get(key)
+    if table is None:
+        for attempt in range(2):
+            if attempt or not os.path.exists(path):
+                try:
+                    build_table(path)
+                except OSError:
+                    table = loaded_tables[key] = HandTable(data=build_table(None))
+                    return table
+            try:
+                table = loaded_tables[key] = HandTable(path)
+                break
+            except (ValueError, struct.error):
+                # a table file of an older version or left half written, build it again
+                if attempt:
+                    raise
+    return table
+
+# the error of init_worker, raised by check_worker in the first task of the worker
+# a Pool replaces a worker whose initializer raises without end, imap would never return
+worker_error = None
+
+# Pool initializer of the scoring processes: map the table once per worker
+def init_worker(path=default_table_path):
+    global worker_error
+    try:
+        get_table(path)
+    except Exception as e:
+        worker_error = RuntimeError(f'Hand table could not be loaded: {e}')
+
+# called by every worker task before it scores, stops the run when init_worker failed
+def check_worker():
+    if worker_error is not None:
+        raise worker_error
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', help='Path of the hand table to build', default=default_table_path)
+    args = parser.parse_args()
+
+    data = build_table(args.output)
+    table = HandTable(args.output)
+    print(f'Hand table written to {args.output}: {len(table.keys)} patterns, {len(data)} bytes')
+    table.close()
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
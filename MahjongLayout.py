@@ -0,0 +1,267 @@
+import sys
+import argparse
+
+import numpy as np
+
+import MahjongTile as Mahjong
+
+# Arrangement of the detected tiles on the table: rows, the order along each row and the
+# groups of touching tiles in a row
+#
+# The row direction comes from the tile boxes: an upright tile is taller than wide, so tiles
+# that are mostly wider than tall lie in columns (a photo turned by 90 degrees). Flowers and
+# seasons are labelled lying, their aspect counts the other way round. A skewed photo is
+# straightened by the direction to the nearest following neighbour of each tile, which is the
+# next tile of its row, then by the median slope of the rows found.
+#
+# Rows are found by sorting the box centers across the row direction and cutting where two
+# neighbours are further apart than half a tile, the groups by sorting each row along its
+# direction and cutting at gaps of more than group_gap of a tile. Both are O(n log n) and take any
+# number of rows. A group of 3 or 4 tiles that forms a meld is a meld set apart from the rest of
+# the hand, i.e. an exposed meld.
+
+row_gap = 0.5
+group_gap = 0.6
+# tiles closer than this many tile lengths (center to center) are in the same hand of a table photo
+hand_link = 1.5
+# the sides of a table photo in clockwise order seen from above, the camera is at the bottom seat
+table_sides = ('bottom', 'left', 'top', 'right')
+# skews below this (radians) are not straightened
+min_skew = 0.02
+# tiles of the other rows come in between in the order along the rows
+neighbour_window = 16
+
+class Layout:
+    __slots__ = ('order', 'row', 'group', 'vertical', 'angle')
+
+    # order    : (N,) box indices in reading order, row by row and along each row
+    # row      : (N,) row of every box, rows are numbered across the row direction
+    # group    : (N,) group of every box, numbered in reading order
+    # vertical : the rows run top to bottom (tiles lying on their side)
+    # angle    : skew of the rows in radians
+    def __init__(self, order, row, group, vertical=False, angle=0.0):
+        self.order = order
+        self.row = row
+        self.group = group
+        self.vertical = vertical
+        self.angle = angle
+
+    def __len__(self):
+        return len(self.order)
+
+    # box indices of every row in reading order
+    def rows(self):
+        return split_runs(self.order, self.row[self.order])
+
+    # box indices of every group in reading order
+    def groups(self):
+        return split_runs(self.order, self.group[self.order])
+
+    # tile names of every row in reading order
+    def sequences(self, names):
+        return [[names[i] for i in row] for row in self.rows()]
+
+    # (box indices, Mahjong.Meld) of the groups that form a meld on their own
+    def exposed_melds(self, names):
+        melds = []
+        for group in self.groups():
+            meld = meld_type([names[i] for i in group])
+            if meld is not None:
+                melds.append((group, meld))
+        return melds
+
+# cut the sorted indices where the key changes
+def split_runs(indices, keys):
+    if not len(indices):
+        return []
+    cuts = np.flatnonzero(np.diff(keys)) + 1
+    return [part.tolist() for part in np.split(indices, cuts)]
+
+def is_flower(name):
+    return Mahjong.class_slot.get(name, -1) >= Mahjong.flower_offset
+
+# Mahjong.Meld of 3 or 4 tile names, None when they are not a meld
+def meld_type(names):
+    if len(names) not in (3, 4):
+        return None
+    slots = sorted(Mahjong.class_slot.get(name, -1) for name in names)
+    if slots[0] < 0 or slots[-1] >= Mahjong.flower_offset:
+        return None
+    if slots[0] == slots[-1]:
+        return Mahjong.Meld.PONG if len(slots) == 3 else Mahjong.Meld.KONG
+    if len(slots) == 3 and slots[0] < 27 and slots[0] // 9 == slots[2] // 9 and slots == list(range(slots[0], slots[0] + 3)):
+        return Mahjong.Meld.CHOW
+    return None
+
+# 1D single linkage: labels of the sorted values, a new cluster starts at every gap above gap
+def cluster_sorted(values, gap):
+    return np.concatenate(([0], np.cumsum(np.diff(values) > gap))) if len(values) else np.zeros(0, dtype=np.int64)
+
+# rows of the centers projected on the row direction (along) and across it, returns row labels
+def find_rows(along, across, extent):
+    order = np.argsort(across, kind='stable')
+    labels = np.empty(len(across), dtype=np.int64)
+    labels[order] = cluster_sorted(across[order], extent * row_gap)
+    return labels
+
+# skew of the rows from the direction to the nearest following neighbour of every tile,
+# searched among the next neighbour_window tiles in the order along the rows
+def neighbour_skew(along, across, extent, labels=None):
+    order = np.argsort(along, kind='stable')
+    along, across = along[order], across[order]
+    count = len(along)
+    window = min(neighbour_window, count - 1)
+    if window < 1:
+        return 0.0
+    d_along = np.full((window, count), np.inf)
+    d_across = np.zeros((window, count))
+    for offset in range(1, window + 1):
+        d_along[offset - 1, :-offset] = along[offset:] - along[:-offset]
+        d_across[offset - 1, :-offset] = across[offset:] - across[:-offset]
+    nearest = (d_along ** 2 + d_across ** 2).argmin(axis=0)
+    d_along = d_along[nearest, np.arange(count)]
+    d_across = d_across[nearest, np.arange(count)]
+    found = np.isfinite(d_along)
+    angles = np.arctan2(d_across[found], d_along[found])
+    # a neighbour in the next row is not along the row
+    angles = angles[np.abs(angles) < np.pi / 4]
+    return float(np.median(angles)) if len(angles) else 0.0
+
+# skew of the rows from the median slope of the rows with at least 3 tiles
+def row_slope_skew(along, across, extent, labels):
+    slopes = []
+    for label in np.unique(labels):
+        members = labels == label
+        if members.sum() < 3:
+            continue
+        x = along[members] - along[members].mean()
+        denom = (x * x).sum()
+        if denom > 0:
+            slopes.append((x * (across[members] - across[members].mean())).sum() / denom)
+    return float(np.arctan(np.median(slopes))) if slopes else 0.0
+
+# Layout of the boxes xyxy (N, 4) of the tiles names
+def tile_layout(xyxy, names):
+    xyxy = np.asarray(xyxy, dtype=np.float64).reshape(-1, 4)
+    count = len(xyxy)
+    if not count:
+        empty = np.zeros(0, dtype=np.int64)
+        return Layout(empty, empty, empty)
+    centers = (xyxy[:, :2] + xyxy[:, 2:]) / 2
+    size = np.maximum(xyxy[:, 2:] - xyxy[:, :2], 1.0)
+
+    # an upright tile and a lying flower both have rows along x
+    flowers = np.array([is_flower(name) for name in names], dtype=bool)
+    aspect = np.where(flowers, size[:, 0] / size[:, 1], size[:, 1] / size[:, 0])
+    tiles = ~flowers if (~flowers).any() else flowers
+    vertical = bool(np.median(aspect[tiles]) < 1.0)
+    axis = 1 if vertical else 0
+    along, across = centers[:, axis], centers[:, 1 - axis]
+    # the tile size along and across the rows, lying flowers have it the other way round
+    along_size = np.where(flowers, size[:, 1 - axis], size[:, axis])
+    across_size = np.where(flowers, size[:, axis], size[:, 1 - axis])
+    along_extent = float(np.median(along_size[tiles]))
+    across_extent = float(np.median(across_size[tiles]))
+
+    # straighten the rows: a first guess from the nearest neighbours, refined by the rows it gives
+    angle = 0.0
+    labels = None
+    for estimate in (neighbour_skew, row_slope_skew):
+        step = estimate(along, across, along_extent, labels)
+        if abs(step) >= min_skew:
+            cos, sin = np.cos(step), np.sin(step)
+            along, across = along * cos + across * sin, across * cos - along * sin
+            angle += step
+        if labels is None or abs(step) >= min_skew:
+            labels = find_rows(along, across, across_extent)
+
+    # rows numbered across the row direction, tiles in a row along it
+    row_position = np.zeros(labels.max() + 1)
+    np.add.at(row_position, labels, across)
+    row_position /= np.bincount(labels)
+    row = np.argsort(np.argsort(row_position))[labels]
+    order = np.lexsort((along, row))
+
+    # groups: a new one at every row change or gap of more than group_gap of a tile
+    along_sorted = along[order]
+    new_group = np.ones(count, dtype=bool)
+    new_group[1:] = (row[order][1:] != row[order][:-1]) | (np.diff(along_sorted) > along_extent * (1 + group_gap))
+    group = np.empty(count, dtype=np.int64)
+    group[order] = np.cumsum(new_group) - 1
+    return Layout(order, row, group, vertical, angle)
+
+# rows of the tile run along x: upright tiles are taller than wide, lying flowers wider than tall
+def horizontal_rows(xyxy, names):
+    size = xyxy[:, 2:] - xyxy[:, :2]
+    flowers = np.array([is_flower(name) for name in names], dtype=bool)
+    return np.where(flowers, size[:, 0] > size[:, 1], size[:, 1] >= size[:, 0])
+
+# 2D single linkage of points closer than link, returns cluster labels 0..k-1
+def cluster_points(points, link):
+    if not len(points):
+        return np.zeros(0, dtype=np.int64)
+    near = ((points[:, None, :] - points[None, :, :]) ** 2).sum(axis=2) <= link * link
+    labels = np.arange(len(points))
+    # every point takes the smallest label of its neighbours until nothing changes
+    while True:
+        spread = np.where(near, labels[None, :], len(points)).min(axis=1)
+        if np.array_equal(spread, labels):
+            break
+        labels = spread[spread]
+    return np.unique(labels, return_inverse=True)[1]
+
+# Hands of a whole table photo: [(side, box indices)] of up to 4 sides, see table_sides
+# The tiles are clustered by distance, every cluster goes to a side by the direction of its rows and
+# where it lies on the table: rows along x are the bottom or top hand, rows along y the left or right
+# one. The clusters of a side (the concealed tiles and the exposed melds) form its hand.
+def table_hands(xyxy, names):
+    xyxy = np.asarray(xyxy, dtype=np.float64).reshape(-1, 4)
+    if not len(xyxy):
+        return []
+    centers = (xyxy[:, :2] + xyxy[:, 2:]) / 2
+    length = float(np.median((xyxy[:, 2:] - xyxy[:, :2]).max(axis=1)))
+    labels = cluster_points(centers, length * hand_link)
+    horizontal = horizontal_rows(xyxy, names)
+    table_center = (centers.min(axis=0) + centers.max(axis=0)) / 2
+
+    sides = {}
+    for label in range(labels.max() + 1):
+        members = np.flatnonzero(labels == label)
+        cx, cy = centers[members].mean(axis=0)
+        # a hand is only top or left when it is clearly on that side of the table, a single hand is the bottom one
+        if horizontal[members].mean() >= 0.5:
+            side = 'top' if cy < table_center[1] - length else 'bottom'
+        else:
+            side = 'left' if cx < table_center[0] - length else 'right'
+        sides.setdefault(side, []).append(members)
+    return [(side, np.sort(np.concatenate(sides[side])).tolist()) for side in table_sides if side in sides]
+
+def main():
+    import MahjongDetect as Detect
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--image', help='Image of the labels, for its size', required=True)
+    parser.add_argument('--labels', help='YOLO label file of the image', required=True)
+    parser.add_argument('--classes', help='classes.txt of the label file', required=True)
+    args = parser.parse_args()
+
+    try:
+        height, width = Detect.read_image(args.image).shape[:2]
+        xyxy, cls = Detect.read_labels(args.labels, width, height)
+        class_names = Detect.read_class_names(args.classes)
+    except (ValueError, OSError) as e:
+        print(f'ERROR: {e}')
+        sys.exit(1)
+    names = [class_names[c] for c in cls.tolist()]
+
+    layout = tile_layout(xyxy, names)
+    print(f"{len(layout)} tiles, {'columns' if layout.vertical else 'rows'}, skew {np.degrees(layout.angle):.1f} degrees")
+    groups = layout.groups()
+    for index, row in enumerate(layout.rows()):
+        row_groups = [group for group in groups if layout.row[group[0]] == index]
+        print(f'{index}: ' + ' | '.join(' '.join(names[i] for i in group) for group in row_groups))
+    for group, meld in layout.exposed_melds(names):
+        print(f"exposed {meld.name.lower()}: {' '.join(names[i] for i in group)}")
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
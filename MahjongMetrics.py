@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import threading
+
+# Optional per-image timing of the detect and score pipeline
+#
+# Instrumented code asks for a trace per image with start(), marks the end of every stage
+# and hands the trace back to finish(). Without enable() start() returns null_trace, whose
+# methods do nothing, so the cost of the instrumentation is a few empty calls per image.
+#
+# Enabled, finish() appends one JSON line per image and keeps histograms of every stage,
+# written as a Prometheus text file (e.g. for the node exporter textfile collector).
+
+stage_names = ('load', 'preprocess', 'inference', 'postprocess', 'layout', 'meld_parse', 'scoring')
+stage_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+detection_buckets = (0, 5, 10, 14, 16, 18, 20, 25, 30, 50)
+faan_buckets = tuple(range(1, 14))
+
+# timings of one image
+#   mark(stage)         : the time since the last mark goes to stage
+#   add(stage, seconds) : a share of a batched stage, e.g. one image of a batched inference
+#   set(key, value)     : a value reported with the image, e.g. 'detections' or 'faan'
+class Trace:
+    __slots__ = ('image', 'start', 'last', 'stages', 'values')
+
+    def __init__(self, image=None):
+        self.image = image
+        self.start = self.last = time.perf_counter()
+        self.stages = {}
+        self.values = {}
+
+    def restart(self):
+        self.last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        self.last = time.perf_counter()
+
+    def set(self, key, value):
+        self.values[key] = value
+
+class NullTrace:
+    __slots__ = ()
+
+    def restart(self):
+        pass
+
+    def mark(self, stage):
+        pass
+
+    def add(self, stage, seconds):
+        pass
+
+    def set(self, key, value):
+        pass
+
+null_trace = NullTrace()
+
+# cumulative histogram with Prometheus bucket semantics (value <= bound)
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+    def lines(self, name, labels=''):
+        sep = ',' if labels else ''
+        lines = [f'{name}_bucket{{{labels}{sep}le="{bound}"}} {count}' for bound, count in zip(self.buckets, self.counts)]
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.total}' if labels else f'{name}_sum {self.total}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}' if labels else f'{name}_count {self.count}')
+        return lines
+
+class MetricsRecorder:
+
+    def __init__(self, jsonl_path=None, prom_path=None, prom_interval=5.0):
+        self.lock = threading.Lock()
+        self.jsonl = open(jsonl_path, 'a', buffering=1) if jsonl_path else None
+        self.prom_path = prom_path
+        self.prom_interval = prom_interval
+        self.last_prom_write = 0.0
+        self.stage_histograms = {stage: Histogram(stage_buckets) for stage in stage_names}
+        self.total_histogram = Histogram(stage_buckets)
+        self.detection_histogram = Histogram(detection_buckets)
+        self.faan_histogram = Histogram(faan_buckets)
+        self.images = 0
+        self.errors = 0
+
+    def finish(self, trace):
+        total = time.perf_counter() - trace.start
+        record = {
+            'time': time.time(),
+            'image': trace.image,
+            'stages_ms': {stage: seconds * 1000 for stage, seconds in trace.stages.items()},
+            'total_ms': total * 1000,
+        }
+        record.update(trace.values)
+        line = json.dumps(record)
+
+        with self.lock:
+            self.images += 1
+            for stage, seconds in trace.stages.items():
+                histogram = self.stage_histograms.get(stage)
+                if histogram is None:
+                    histogram = self.stage_histograms[stage] = Histogram(stage_buckets)
+                histogram.observe(seconds)
+            self.total_histogram.observe(total)
+            if 'detections' in trace.values:
+                self.detection_histogram.observe(trace.values['detections'])
+            if trace.values.get('faan') is not None:
+                self.faan_histogram.observe(trace.values['faan'])
+            if 'error' in trace.values:
+                self.errors += 1
+            if self.jsonl is not None:
+                self.jsonl.write(line + '\n')
+            if self.prom_path and record['time'] - self.last_prom_write >= self.prom_interval:
+                self.write_prometheus()
+
+    def prometheus_text(self):
+        lines = ['# HELP mahjong_stage_seconds Time spent in each pipeline stage per image.',
+                 '# TYPE mahjong_stage_seconds histogram']
+        for stage, histogram in self.stage_histograms.items():
+            lines += histogram.lines('mahjong_stage_seconds', f'stage="{stage}"')
+        lines += ['# HELP mahjong_image_seconds Total time per image.',
+                  '# TYPE mahjong_image_seconds histogram']
+        lines += self.total_histogram.lines('mahjong_image_seconds')
+        lines += ['# HELP mahjong_detections Number of tiles detected per image.',
+                  '# TYPE mahjong_detections histogram']
+        lines += self.detection_histogram.lines('mahjong_detections')
+        lines += ['# HELP mahjong_faan Faan of the scored hands.',
+                  '# TYPE mahjong_faan histogram']
+        lines += self.faan_histogram.lines('mahjong_faan')
+        lines += ['# HELP mahjong_images_total Images processed.',
+                  '# TYPE mahjong_images_total counter',
+                  f'mahjong_images_total {self.images}',
+                  '# HELP mahjong_errors_total Images that ended with an error.',
+                  '# TYPE mahjong_errors_total counter',
+                  f'mahjong_errors_total {self.errors}']
+        return '\n'.join(lines) + '\n'
+
+    # write to a temporary file and rename it, a scraper never reads half a file
+    def write_prometheus(self):
+        tmp_path = self.prom_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, self.prom_path)
+        self.last_prom_write = time.time()
+
+    def close(self):
+        with self.lock:
+            if self.prom_path:
+                self.write_prometheus()
+            if self.jsonl is not None:
+                self.jsonl.close()
+                self.jsonl = None
+
+recorder = None
+
+def enable(jsonl_path=None, prom_path=None, prom_interval=5.0):
+    global recorder
+    if recorder is not None:
+        recorder.close()
+    recorder = MetricsRecorder(jsonl_path, prom_path, prom_interval)
+    return recorder
+
+def disable():
+    global recorder
+    if recorder is not None:
+        recorder.close()
+        recorder = None
+
+def enabled():
+    return recorder is not None
+
+def start(image=None):
+    return Trace(image) if recorder is not None else null_trace
+
+def finish(trace):
+    if recorder is not None and trace is not null_trace:
+        recorder.finish(trace)
@@ -0,0 +1,344 @@
+import os
+import gc
+import re
+import csv
+import sys
+import glob
+import time
+import argparse
+import threading
+from collections import OrderedDict
+
+import MahjongDetect as Detect
+
+# The trained models in Model/<generation>/ and the detectors loaded from them
+#
+# Every generation folder holds my_model.pt and the train*/ folder of its training run. The
+# metrics of a model are those of the epoch ultralytics kept as best.pt (highest fitness,
+# 0.1 mAP50 + 0.9 mAP50-95 in results.csv), imgsz and the base model come from args.yaml.
+# The speed of a model is estimated from the GFLOPs of its base model at its imgsz.
+#
+# Default model policies:
+#   best    : highest mAP50-95
+#   fastest : lowest estimated cost among the models with mAP50-95 >= min_map
+# Models whose my_model.pt is present win over those that only have their training run.
+#
+# ModelRegistry loads detectors on first use and keeps the capacity most recently used ones.
+#
+#   python MahjongModelRegistry.py                  list the models and the default
+#   python MahjongModelRegistry.py --policy fastest --min_map 0.84 --load
+
+path_prefix = os.path.dirname(os.path.abspath(__file__))
+default_model_dir = os.path.join(path_prefix, 'Model')
+model_file_name = 'my_model.pt'
+policies = ('best', 'fastest')
+default_policy = 'best'
+# GFLOPs of the YOLO base models at 640, by size letter
+base_gflops = {'n': 6.5, 's': 21.5, 'm': 68.0, 'l': 86.9, 'x': 194.9}
+
+class ModelInfo:
+    __slots__ = ('name', 'directory', 'model_path', 'base_model', 'imgsz', 'epochs', 'best_epoch',
+                 'precision', 'recall', 'mAP50', 'mAP50_95', 'train_time')
+
+    def __init__(self, name, directory, model_path, base_model=None, imgsz=640, epochs=0, best_epoch=0,
+                 precision=0.0, recall=0.0, mAP50=0.0, mAP50_95=0.0, train_time=0.0):
+        self.name = name
+        self.directory = directory
+        self.model_path = model_path
+        self.base_model = base_model
+        self.imgsz = imgsz
+        self.epochs = epochs
+        self.best_epoch = best_epoch
+        self.precision = precision
+        self.recall = recall
+        self.mAP50 = mAP50
+        self.mAP50_95 = mAP50_95
+        self.train_time = train_time
+
+    @property
+    def available(self):
+        return os.path.exists(self.model_path)
+
+    # relative inference cost, GFLOPs of the base model scaled to the input size
+    @property
+    def cost(self):
+        match = re.search(r'yolo\w*?\d+([nsmlx])', self.base_model or '')
+        gflops = base_gflops[match.group(1)] if match else base_gflops['s']
+        return gflops * (self.imgsz / 640) ** 2
+
+# top level "key: value" entries of a training args.yaml
+def read_args_yaml(path):
+    args = {}
+    with open(path) as f:
+        for line in f:
+            match = re.match(r'^(\w+):\s*(.*?)\s*$', line)
+            if match:
+                args[match.group(1)] = match.group(2)
+    return args
+
+# the row of results.csv with the best fitness, ultralytics saves that epoch as best.pt
+def best_epoch(path):
+    with open(path, newline='') as f:
+        rows = [{key.strip(): value for key, value in row.items()} for row in csv.DictReader(f)]
+    if not rows:
+        return None
+    fitness = lambda row: 0.1 * float(row['metrics/mAP50(B)']) + 0.9 * float(row['metrics/mAP50-95(B)'])
+    return max(rows, key=fitness), float(rows[-1].get('time') or 0.0)
+
+# ModelInfo of one generation folder, None when it holds neither a model nor a training run
+def read_model_info(directory):
+    name = os.path.basename(os.path.normpath(directory))
+    info = ModelInfo(name, directory, os.path.join(directory, model_file_name))
+    train_dirs = sorted(path for path in glob.glob(os.path.join(directory, 'train*')) if os.path.isdir(path))
+    for train_dir in train_dirs:
+        args_file = os.path.join(train_dir, 'args.yaml')
+        results_file = os.path.join(train_dir, 'results.csv')
+        if os.path.exists(args_file):
+            args = read_args_yaml(args_file)
+            info.base_model = args.get('model', info.base_model)
+            info.imgsz = int(args['imgsz']) if args.get('imgsz', '').isdigit() else info.imgsz
+            info.epochs = int(args['epochs']) if args.get('epochs', '').isdigit() else info.epochs
+        if os.path.exists(results_file):
+            result = best_epoch(results_file)
+            if result is not None:
+                row, info.train_time = result
+                info.best_epoch = int(float(row['epoch']))
+                info.precision = float(row['metrics/precision(B)'])
+                info.recall = float(row['metrics/recall(B)'])
+                info.mAP50 = float(row['metrics/mAP50(B)'])
+                info.mAP50_95 = float(row['metrics/mAP50-95(B)'])
+    if not train_dirs and not info.available:
+        return None
+    return info
+
+# {name: ModelInfo} of the generation folders of model_dir, in generation order
+def discover_models(model_dir=default_model_dir):
+    directories = [path for path in glob.glob(os.path.join(model_dir, '*')) if os.path.isdir(path)]
+    # numbered generations in numeric order, named folders after them
+    names = [os.path.basename(path) for path in directories]
+    directories = [path for _, path in sorted(zip([(0, int(name), '') if name.isdigit() else (1, 0, name) for name in names], directories))]
+    models = OrderedDict()
+    for directory in directories:
+        info = read_model_info(directory)
+        if info is not None:
+            models[info.name] = info
+    return models
+
+# the ModelInfo chosen by the policy
+def select_model(models, policy=default_policy, min_map=0.0):
+    if policy not in policies:
+        raise ValueError(f'Unknown model policy {policy}, use one of {", ".join(policies)}.')
+    candidates = [info for info in models.values() if info.available] or list(models.values())
+    if not candidates:
+        raise FileNotFoundError('No models found. Make sure the Model folder holds the trained models.')
+    if policy == 'best':
+        return max(candidates, key=lambda info: (info.mAP50_95, info.mAP50))
+    accurate = [info for info in candidates if info.mAP50_95 >= min_map]
+    if not accurate:
+        raise ValueError(f'No model reaches mAP50-95 {min_map}, the best one has {max(info.mAP50_95 for info in candidates):.4f}.')
+    return min(accurate, key=lambda info: (info.cost, -info.mAP50_95))
+
+# path of the default model, used as the --model default of the command line tools
+def default_model_path(model_dir=default_model_dir, policy=default_policy, min_map=0.0):
+    try:
+        return select_model(discover_models(model_dir), policy, min_map).model_path
+    except (ValueError, FileNotFoundError):
+        return os.path.join(model_dir, model_file_name)
+
+# a model file path, or the name of a generation folder ("5")
+def resolve_model(model, model_dir=default_model_dir):
+    if model and not os.path.exists(model) and os.path.isdir(os.path.join(model_dir, model)):
+        return os.path.join(model_dir, model, model_file_name)
+    return model
+
+# resident set size of this process in bytes, None where /proc is not available
+def process_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+# bytes of the weights of a loaded detector: the torch parameters, or the size of the exported model files
+def weights_bytes(detector):
+    network = getattr(detector.model, 'model', None)
+    if hasattr(network, 'parameters'):
+        return sum(t.numel() * t.element_size() for t in list(network.parameters()) + list(network.buffers()))
+    path = detector.model_path
+    files = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names] if os.path.isdir(path) else [path]
+    return sum(os.path.getsize(file) for file in files)
+
+# One loaded detector and its bookkeeping
+class ResidentModel:
+    __slots__ = ('detector', 'load_time', 'weights_bytes', 'rss_bytes', 'uses', 'last_used')
+
+    def __init__(self, detector, load_time, rss_bytes):
+        self.detector = detector
+        self.load_time = load_time
+        self.weights_bytes = weights_bytes(detector)
+        self.rss_bytes = rss_bytes
+        self.uses = 0
+        self.last_used = time.time()
+
+# a model being loaded by one thread, the others asking for it wait for done
+class PendingLoad:
+    __slots__ = ('done', 'entry', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+        self.error = None
+
+# Lazily loaded detectors, at most capacity of them stay in memory, the least recently used goes first
+# detector_args are the TileDetector arguments shared by all models (threshold, resolution, device, ...)
+class ModelRegistry:
+
+    def __init__(self, model_dir=default_model_dir, capacity=2, policy=default_policy, min_map=0.0, **detector_args):
+        if capacity < 1:
+            raise ValueError('The registry needs room for at least one model.')
+        self.model_dir = model_dir
+        self.capacity = capacity
+        self.policy = policy
+        self.min_map = min_map
+        self.detector_args = detector_args
+        self.models = discover_models(model_dir)
+        self.resident = OrderedDict()
+        # key -> PendingLoad of the models being loaded
+        self.loading = {}
+        self.loads = 0
+        self.evictions = 0
+        # the handler threads share the registry, the lock only guards the bookkeeping: a model is loaded
+        # outside of it, once even when asked for twice at the same time, and never blocks the resident ones
+        self.lock = threading.Lock()
+
+    def default_model(self):
+        return select_model(self.models, self.policy, self.min_map).model_path
+
+    # the detector of model (a path, a generation name or None for the default) on backend
+    def get(self, model=None, backend=None):
+        model_path = resolve_model(model, self.model_dir) if model else self.default_model()
+        backend = backend if backend is not None else self.detector_args.get('backend')
+        key = (os.path.abspath(model_path), backend or 'pytorch')
+        with self.lock:
+            entry = self.resident.get(key)
+            if entry is not None:
+                return self.use(key, entry)
+            pending = self.loading.get(key)
+            loader = pending is None
+            if loader:
+                pending = self.loading[key] = PendingLoad()
+
+        if not loader:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            with self.lock:
+                return self.use(key, pending.entry)
+
+        try:
+            entry = self.load(model_path, backend)
+        except BaseException as e:
+            with self.lock:
+                del self.loading[key]
+            pending.error = e
+            pending.done.set()
+            raise
+        evicted = 0
+        with self.lock:
+            del self.loading[key]
+            self.loads += 1
+            self.resident[key] = entry
+            while len(self.resident) > self.capacity:
+                self.resident.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+            detector = self.use(key, entry)
+        pending.entry = entry
+        pending.done.set()
+        if evicted:
+            # free the evicted weights now, not at some later collection
+            gc.collect()
+        return detector
+
+    # count a use of a resident entry, under the lock
+    def use(self, key, entry):
+        if key in self.resident:
+            self.resident.move_to_end(key)
+        entry.uses += 1
+        entry.last_used = time.time()
+        return entry.detector
+
+    def load(self, model_path, backend):
+        detector_args = dict(self.detector_args, backend=backend)
+        rss_before = process_rss()
+        t_start = time.perf_counter()
+        detector = Detect.TileDetector(model_path, **detector_args)
+        load_time = time.perf_counter() - t_start
+        rss_after = process_rss()
+        return ResidentModel(detector, load_time, rss_after - rss_before if rss_before is not None and rss_after is not None else None)
+
+    def evict(self, model=None, backend=None):
+        model_path = resolve_model(model, self.model_dir) if model else self.default_model()
+        with self.lock:
+            evicted = self.resident.pop((os.path.abspath(model_path), backend or 'pytorch'), None) is not None
+            if evicted:
+                self.evictions += 1
+        if evicted:
+            gc.collect()
+
+    # load time and memory of every resident model, most recently used first
+    def stats(self):
+        with self.lock:
+            resident = [{'model': entry.detector.model_path,
+                         'backend': backend,
+                         'load_time_ms': entry.load_time * 1000,
+                         'weights_bytes': entry.weights_bytes,
+                         'rss_bytes': entry.rss_bytes,
+                         'uses': entry.uses,
+                         'last_used': entry.last_used}
+                        for (_, backend), entry in reversed(self.resident.items())]
+            return {'capacity': self.capacity, 'loads': self.loads, 'evictions': self.evictions, 'loading': len(self.loading),
+                    'resident': resident}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_dir', help='Folder of the model generations', default=default_model_dir)
+    parser.add_argument('--policy', help='Default model policy: best mAP50-95, or the fastest model above --min_map',
+                        choices=policies, default=default_policy)
+    parser.add_argument('--min_map', help='Lowest mAP50-95 accepted by the fastest policy', type=float, default=0.0)
+    parser.add_argument('--load', help='Load the default model and report its load time and memory', action='store_true')
+    parser.add_argument('--backend', help='Inference backend of --load', choices=Detect.backends, default=None)
+    args = parser.parse_args()
+
+    models = discover_models(args.model_dir)
+    if not models:
+        print(f'ERROR: no models found in {args.model_dir}')
+        sys.exit(1)
+    try:
+        default = select_model(models, args.policy, args.min_map)
+    except (ValueError, FileNotFoundError) as e:
+        print(f'ERROR: {e}')
+        sys.exit(1)
+
+    print(f"{'model':<8}{'base':<14}{'imgsz':>6}{'epoch':>8}{'P':>7}{'R':>7}{'mAP50':>8}{'mAP50-95':>10}{'cost':>7}  file")
+    for info in models.values():
+        mark = '  <- default' if info is default else ''
+        print(f"{info.name:<8}{info.base_model or '?':<14}{info.imgsz:>6}{f'{info.best_epoch}/{info.epochs}':>8}"
+              f"{info.precision:>7.3f}{info.recall:>7.3f}{info.mAP50:>8.4f}{info.mAP50_95:>10.4f}{info.cost:>7.1f}  "
+              f"{'present' if info.available else 'missing'}{mark}")
+
+    if args.load:
+        registry = ModelRegistry(args.model_dir, 1, args.policy, args.min_map, backend=args.backend, device='cpu')
+        try:
+            registry.get()
+        except (ImportError, ValueError, FileNotFoundError) as e:
+            print(f'ERROR: {e}')
+            sys.exit(1)
+        for entry in registry.stats()['resident']:
+            rss = f"{entry['rss_bytes'] / 2**20:.1f} MB" if entry['rss_bytes'] is not None else 'unknown'
+            print(f"Loaded {entry['model']} ({entry['backend']}) in {entry['load_time_ms']:.0f} ms, "
+                  f"weights {entry['weights_bytes'] / 2**20:.1f} MB, process memory +{rss}")
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,9 @@ import sys
 import re
 from enum import Enum
 
+from MahjongLayout import tile_layout
+from MahjongModelRegistry import default_model_path
+
 class Tile(Enum):
     b1 = 1
     b2 = 2
@@ -118,7 +121,7 @@ if debug:
 
 # Call mahjong detect script
 result = subprocess.run(
-    ["python", "MahjongDetect.py", "--model", "Model/5/my_model.pt", "--source", img_source, "--threshold", min_threshold] + ROI_args + debug_args + ignore_args,
+    ["python", "MahjongDetect.py", "--model", default_model_path(), "--source", img_source, "--threshold", min_threshold] + ROI_args + debug_args + ignore_args,
     capture_output=True,
     text=True
 )
@@ -148,8 +151,10 @@ for match in matches:
     }
     detections.append(detection)
 
-# Sort the detections by x position
-detections.sort(key=lambda x: x['bbox'][0])
+# Sort the detections row by row and along each row
+if detections:
+    layout = tile_layout([detection['bbox'] for detection in detections], [detection['class'] for detection in detections])
+    detections = [detections[i] for i in layout.order]
 
 detected_tiles = [0] * 34   # non-flower tiles
 detected_flowers = [0] * 8
@@ -0,0 +1,346 @@
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# never reach out to the network, the service runs on an offline table-side box
+os.environ.setdefault('YOLO_OFFLINE', '1')
+
+from MahjongDetect import backends, check_roi, check_ignore_areas
+from MahjongModelRegistry import ModelRegistry, default_model_path
+from MahjongFaanCalculator import best_faan, FaanError
+from MahjongTable import score_table
+import MahjongMetrics as Metrics
+import MahjongLayout as Layout
+
+# a list of 4 numbers
+def is_box(value):
+    return (isinstance(value, list) and len(value) == 4 and
+            all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value))
+
+# the fields of one request, raises ValueError naming the first malformed one
+# so the handler answers 400 before anything is loaded or detected
+def check_request(request):
+    if not isinstance(request, dict):
+        raise ValueError('A request must be a JSON object.')
+    for field in ('image', 'image_path', 'model', 'dealer'):
+        if request.get(field) is not None and not isinstance(request[field], str):
+            raise ValueError(f'"{field}" must be a string.')
+    # a null image would otherwise stand for a missing one only in some places
+    for field in ('image', 'image_path'):
+        if field in request and request[field] is None:
+            raise ValueError(f'"{field}" must not be null.')
+    roi = request.get('ROI')
+    if roi is not None:
+        if not is_box(roi):
+            raise ValueError('"ROI" must be [x1, y1, x2, y2].')
+        check_roi(roi)
+    ignore = request.get('ignore')
+    if ignore is not None:
+        if not isinstance(ignore, list) or not all(is_box(area) for area in ignore):
+            raise ValueError('"ignore" must be a list of [x1, y1, x2, y2].')
+        check_ignore_areas(ignore)
+    for field in ('game_wind', 'seat_wind', 'seat'):
+        value = request.get(field, -1)
+        if isinstance(value, str) and value.lstrip('-').isdigit():
+            continue
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError(f'"{field}" must be an integer.')
+
+# Keeps the detectors resident and scores hands for the HTTP handler
+#
+# A request is a JSON object:
+#   image_path or image (base64 encoded jpg / png)
+#   ROI [x1, y1, x2, y2], ignore [[x1, y1, x2, y2], ...]
+#   game_wind, seat_wind, seat
+#   model (optional): model file or generation ("4") for this request, see MahjongModelRegistry
+# /score_table scores every hand of a whole table photo, with dealer (bottom, left, top or right)
+# in place of seat_wind and seat, see MahjongTable
+class ScoringService:
+
+    def __init__(self, registry, model=None):
+        self.registry = registry
+        self.model = model
+        # the models and the request counters are shared by all handler threads
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    # the detector of the default model
+    @property
+    def detector(self):
+        return self.registry.get(self.model)
+
+    # load and preprocess the image of one request
+    def prepare(self, request, detector, trace=Metrics.null_trace):
+        roi = request.get('ROI')
+        if request.get('image') is not None:
+            frame, source_size = detector.load_bytes(base64.b64decode(request['image']), roi)
+        elif request.get('image_path') is not None:
+            frame, source_size = detector.load_file(request['image_path'], roi)
+        else:
+            raise ValueError('Request needs "image" or "image_path".')
+        trace.mark('load')
+        frame = detector.preprocess(frame, roi, source_size, request.get('ignore'))
+        trace.mark('preprocess')
+        return frame
+
+    def score(self, request, detections, trace=Metrics.null_trace):
+        try:
+            if not len(detections):
+                raise FaanError("No tiles detected.")
+            trace.restart()
+            tile_hand = detections.to_hand()
+            layout = detections.layout()
+            trace.mark('layout')
+            result = best_faan(tile_hand,
+                               int(request.get('game_wind', -1)),
+                               int(request.get('seat_wind', -1)),
+                               int(request.get('seat', -1)),
+                               trace=trace)
+        except (FaanError, ValueError) as e:
+            trace.set('error', str(e))
+            return {'ok': False, 'error': str(e), 'tiles': detections.class_names()}
+        names = detections.class_names()
+        return {'ok': True, 'faan': result['faan'], 'name': result['name'].strip(), 'tiles': names,
+                'rows': layout.sequences(names),
+                'exposed': [[names[i] for i in group] for group, _ in layout.exposed_melds(names)]}
+
+    # score a list of requests with one batched inference per model
+    def score_batch(self, requests):
+        t_start = time.perf_counter()
+        results = [None] * len(requests)
+        traces = [Metrics.start(request.get('image_path', 'upload')) for request in requests]
+        batches = {}
+        for i, request in enumerate(requests):
+            batches.setdefault(request.get('model') or self.model, []).append(i)
+
+        prepare_time = infer_time = 0.0
+        scored = []
+        for model, indices in batches.items():
+            t_batch = time.perf_counter()
+            try:
+                detector = self.registry.get(model)
+            except (ImportError, ValueError, FileNotFoundError) as e:
+                for i in indices:
+                    results[i] = {'ok': False, 'error': str(e)}
+                    traces[i].set('error', str(e))
+                continue
+            frames = []
+            frame_index = []
+            ignore_areas_list = []
+            for i in indices:
+                try:
+                    frames.append(self.prepare(requests[i], detector, traces[i]))
+                    ignore_areas_list.append(requests[i].get('ignore'))
+                    frame_index.append(i)
+                except (ValueError, OSError) as e:
+                    results[i] = {'ok': False, 'error': str(e)}
+                    traces[i].set('error', str(e))
+            t_prepare = time.perf_counter()
+
+            with self.lock:
+                detections_list = detector.infer_batch(frames, ignore_areas_list=ignore_areas_list,
+                                                       traces=[traces[i] for i in frame_index])
+            t_infer = time.perf_counter()
+            prepare_time += t_prepare - t_batch
+            infer_time += t_infer - t_prepare
+            scored += zip(frame_index, detections_list)
+
+        t_scoring = time.perf_counter()
+        for i, detections in scored:
+            results[i] = self.score(requests[i], detections, traces[i])
+        t_end = time.perf_counter()
+        for trace in traces:
+            Metrics.finish(trace)
+
+        with self.lock:
+            self.requests += len(requests)
+            self.errors += sum(1 for result in results if not result['ok'])
+        latency = {
+            'prepare_ms': prepare_time * 1000,
+            'inference_ms': infer_time * 1000,
+            'scoring_ms': (t_end - t_scoring) * 1000,
+            'total_ms': (t_end - t_start) * 1000,
+        }
+        return results, latency
+
+    # all hands of one table photo, one inference for the whole table
+    def score_table(self, request):
+        t_start = time.perf_counter()
+        trace = Metrics.start(request.get('image_path', 'upload'))
+        try:
+            detector = self.registry.get(request.get('model') or self.model)
+            frame = self.prepare(request, detector, trace)
+        except (ImportError, ValueError, OSError) as e:
+            trace.set('error', str(e))
+            Metrics.finish(trace)
+            with self.lock:
+                self.errors += 1
+            return {'ok': False, 'error': str(e)}
+        t_prepare = time.perf_counter()
+        with self.lock:
+            detections = detector.infer(frame, ignore_areas=request.get('ignore'), trace=trace)
+        t_infer = time.perf_counter()
+        trace.restart()
+        seats = score_table(detections, int(request.get('game_wind', -1)), request.get('dealer'), trace=trace)
+        t_end = time.perf_counter()
+        Metrics.finish(trace)
+
+        ok = bool(seats) and all(seat['ok'] for seat in seats)
+        with self.lock:
+            self.requests += 1
+            self.errors += not ok
+        latency = {
+            'prepare_ms': (t_prepare - t_start) * 1000,
+            'inference_ms': (t_infer - t_prepare) * 1000,
+            'scoring_ms': (t_end - t_infer) * 1000,
+            'total_ms': (t_end - t_start) * 1000,
+        }
+        return {'ok': ok, 'seats': seats, 'latency': latency}
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def send_json(self, code, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        if self.path == '/health':
+            # only what is resident, a health check never loads a model
+            self.send_json(200, {'ok': True,
+                                 'model': self.service.model,
+                                 'models': self.service.registry.stats(),
+                                 'requests': self.service.requests,
+                                 'errors': self.service.errors})
+        else:
+            self.send_json(404, {'ok': False, 'error': f'Unknown path {self.path}'})
+
+    def do_POST(self):
+        try:
+            body = self.read_json()
+        except ValueError as e:
+            self.send_json(400, {'ok': False, 'error': f'Invalid JSON: {e}'})
+            return
+
+        if self.path not in ('/score', '/score_batch', '/score_table'):
+            self.send_json(404, {'ok': False, 'error': f'Unknown path {self.path}'})
+            return
+        try:
+            if self.path == '/score_batch':
+                if not isinstance(body, dict) or not isinstance(body.get('hands', []), list):
+                    raise ValueError('"hands" must be a list')
+                for i, request in enumerate(body.get('hands', [])):
+                    try:
+                        check_request(request)
+                    except ValueError as e:
+                        raise ValueError(f'hands[{i}]: {e}')
+            else:
+                check_request(body)
+                if self.path == '/score_table' and body.get('dealer') not in (None,) + Layout.table_sides:
+                    raise ValueError(f'"dealer" must be one of {", ".join(Layout.table_sides)}')
+        except ValueError as e:
+            self.send_json(400, {'ok': False, 'error': str(e)})
+            return
+
+        if self.path == '/score':
+            results, latency = self.service.score_batch([body])
+            self.send_json(200, dict(results[0], latency=latency))
+        elif self.path == '/score_batch':
+            results, latency = self.service.score_batch(body.get('hands', []))
+            self.send_json(200, {'ok': True, 'results': results, 'latency': latency})
+        else:
+            self.send_json(200, self.service.score_table(body))
+
+    # unix socket clients have no (host, port) address
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    # HTTPServer.server_bind expects a (host, port) address
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = self.server_address
+        self.server_port = 0
+
+def main():
+    # Define and parse user input arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', help='Path to YOLO model file or model generation ("5"), defaults to the best model in Model/',
+                        default=default_model_path())
+    parser.add_argument('--resident', help='Most models kept loaded for the "model" of the requests, the least recently used is unloaded',
+                        type=int, default=2)
+    parser.add_argument('--threshold', help='Minimum confidence threshold for detected tiles (example: "0.4")',
+                        default=0.2)
+    parser.add_argument('--resolution', help='Resize the images to WxH before detection (example: "1280x1280")',
+                        default=None)
+    parser.add_argument('--device', help='Inference device, "cpu" unless a GPU is wanted',
+                        default='cpu')
+    parser.add_argument('--backend', help='Inference backend, the exported model next to --model is used (see MahjongExport.py)',
+                        choices=backends, default=None)
+    parser.add_argument('--slice', help='Sliced inference: also run overlapping WxH slices of every image (example: "640x640")',
+                        default=None)
+    parser.add_argument('--overlap', help='Overlap of neighbouring slices as a fraction of the slice size',
+                        type=float, default=0.2)
+    parser.add_argument('--host', help='Address to listen on', default='127.0.0.1')
+    parser.add_argument('--port', help='Port to listen on', type=int, default=8765)
+    parser.add_argument('--unix', help='Listen on this unix socket path instead of host:port', default=None)
+    parser.add_argument('--metrics_jsonl', help='Append the stage timings of every request to this JSON lines file',
+                        default=None)
+    parser.add_argument('--metrics_prom', help='Write stage timing histograms to this Prometheus text file',
+                        default=None)
+    args = parser.parse_args()
+
+    try:
+        registry = ModelRegistry(capacity=args.resident, threshold=args.threshold, resolution=args.resolution,
+                                 device=args.device, backend=args.backend, slice_size=args.slice, slice_overlap=args.overlap)
+        service = ScoringService(registry, args.model)
+        # the default model is loaded before the first request
+        detector = service.detector
+    except (ValueError, FileNotFoundError) as e:
+        print(f'ERROR: {e}')
+        sys.exit(1)
+
+    if args.metrics_jsonl or args.metrics_prom:
+        Metrics.enable(args.metrics_jsonl, args.metrics_prom)
+    ScoringHandler.service = service
+    if args.unix:
+        if os.path.exists(args.unix):
+            os.remove(args.unix)
+        server = ThreadingUnixHTTPServer(args.unix, ScoringHandler)
+        print(f'Model loaded in {detector.load_time:.2f}s, listening on {args.unix}')
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), ScoringHandler)
+        print(f'Model loaded in {detector.load_time:.2f}s, listening on http://{args.host}:{args.port}')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        Metrics.disable()
+        if args.unix and os.path.exists(args.unix):
+            os.remove(args.unix)
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
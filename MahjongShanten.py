@@ -0,0 +1,217 @@
+import sys
+import time
+import argparse
+from functools import lru_cache
+
+import MahjongTile as Mahjong
+import MahjongHandSolver as HandSolver
+import MahjongHandTable as HandTable
+from MahjongFaanCalculator import best_faan, FaanError
+
+# Shanten: the number of tile swaps a hand needs before it is one tile away from winning
+#   -1 : the hand is complete
+#    0 : ready, one of the waits wins
+#
+# A hand is read suit by suit. For every suit pattern the reachable shapes (melds, partials, pair)
+# are enumerated once and cached; a partial is two tiles of a meld (a pair or a chow missing a tile).
+# A hand with m melds, t partials and p eye needs 8 - 2m - min(t, 4 - m) - p swaps,
+# Thirteen Orphans is counted separately.
+
+max_melds = 4
+orphan_indices = [i for i in range(34) if Mahjong.tile_is_terminal[i] or i >= 27]
+
+# keep only the shapes no other shape beats on melds, partials and pair together
+def prune_shapes(shapes):
+    return tuple(sorted(shape for shape in shapes
+                        if not any(other != shape and other[0] >= shape[0] and other[1] >= shape[1] and other[2] >= shape[2]
+                                   for other in shapes)))
+
+# the (melds, partials, pair) shapes of one suit pattern
+@lru_cache(maxsize=None)
+def suit_shapes(counts, allow_chow):
+    first = next((i for i, c in enumerate(counts) if c), None)
+    if first is None:
+        return ((0, 0, 0),)
+
+    shapes = set()
+
+    def take(removed, melds, partials, pair):
+        rest = list(counts)
+        for pos in removed:
+            rest[pos] -= 1
+        for m, t, p in suit_shapes(tuple(rest), allow_chow):
+            if p + pair > 1:
+                continue
+            shapes.add((min(m + melds, max_melds), min(t + partials, max_melds), p + pair))
+
+    # the lowest tile is left alone or starts a group
+    take([first], 0, 0, 0)
+    if counts[first] >= 4:
+        take([first] * 4, 1, 0, 0)
+    if counts[first] >= 3:
+        take([first] * 3, 1, 0, 0)
+    if counts[first] >= 2:
+        take([first] * 2, 0, 0, 1)
+        take([first] * 2, 0, 1, 0)
+    if allow_chow:
+        if first + 1 < len(counts) and counts[first + 1]:
+            take([first, first + 1], 0, 1, 0)
+            if first + 2 < len(counts) and counts[first + 2]:
+                take([first, first + 1, first + 2], 1, 0, 0)
+        if first + 2 < len(counts) and counts[first + 2]:
+            take([first, first + 2], 0, 1, 0)
+    return prune_shapes(shapes)
+
+# shapes of two suits read together
+@lru_cache(maxsize=None)
+def merge_shapes(shapes_a, shapes_b):
+    return prune_shapes({(min(ma + mb, max_melds), min(ta + tb, max_melds), pa + pb)
+                         for ma, ta, pa in shapes_a for mb, tb, pb in shapes_b if pa + pb <= 1})
+
+def shape_shanten(shapes):
+    return min(8 - 2 * m - min(t, max_melds - m) - p for m, t, p in shapes)
+
+def orphan_shanten(counts):
+    kinds = sum(1 for i in orphan_indices if counts[i])
+    pair = any(counts[i] >= 2 for i in orphan_indices)
+    return 13 - kinds - (1 if pair else 0)
+
+def suit_counts(counts, suit):
+    return tuple(counts[HandSolver.suit_offsets[suit]:HandSolver.suit_ends[suit]])
+
+# shanten from the shapes of the 4 suits and the counts they were read from
+def hand_shanten(shapes, counts):
+    merged = merge_shapes(merge_shapes(shapes[0], shapes[1]), merge_shapes(shapes[2], shapes[3]))
+    return min(shape_shanten(merged), orphan_shanten(counts))
+
+# shanten of a 34 count vector, from scratch
+def shanten(counts):
+    return hand_shanten([suit_shapes(suit_counts(counts, suit), HandSolver.suit_chows[suit]) for suit in range(4)], counts)
+
+# Faan of a complete hand, cached so a wait is only scored once
+@lru_cache(maxsize=4096)
+def score_win(hand, game_wind=-1, seat_wind=-1, seat=-1):
+    try:
+        result = best_faan(hand, game_wind, seat_wind, seat)
+    except FaanError as e:
+        return None, str(e)
+    return result['faan'], result['name'].strip()
+
+# A hand on the table that changes one tile at a time
+#
+# The shapes and the hand table row of each suit are kept, a change only reads the
+# suits whose counts changed again. waits() tries every tile against the kept suits.
+class LiveHand:
+
+    def __init__(self, hand=None, game_wind=-1, seat_wind=-1, seat=-1):
+        self.table = HandTable.get_table()
+        self.context = (game_wind, seat_wind, seat)
+        self.hand = Mahjong.Hand()
+        self.shapes = [suit_shapes(suit_counts(self.hand.counts, suit), HandSolver.suit_chows[suit]) for suit in range(4)]
+        self.rows = self.table.rows(self.hand.counts)
+        self.suit_updates = 0
+        if hand is not None:
+            self.update(hand)
+
+    def update_suit(self, suit):
+        counts = suit_counts(self.hand.counts, suit)
+        self.shapes[suit] = suit_shapes(counts, HandSolver.suit_chows[suit])
+        self.rows[suit] = self.table.find(counts, suit == 3)
+        self.suit_updates += 1
+
+    # replace the hand, e.g. with the detections of a new frame, only the changed suits are read
+    def update(self, hand):
+        if not isinstance(hand, Mahjong.Hand):
+            hand = Mahjong.Hand.from_counts(hand)
+        old_counts = self.hand.counts
+        self.hand = hand
+        for suit in range(4):
+            start, end = HandSolver.suit_offsets[suit], HandSolver.suit_ends[suit]
+            if hand[start:end] != old_counts[start:end]:
+                self.update_suit(suit)
+        return self
+
+    def add(self, index):
+        self.hand = self.hand.add(index)
+        self.update_suit(Mahjong.tile_suit[index])
+        return self
+
+    def discard(self, index):
+        self.hand = self.hand.remove(index)
+        self.update_suit(Mahjong.tile_suit[index])
+        return self
+
+    def shanten(self):
+        return hand_shanten(self.shapes, self.hand.counts)
+
+    # {tile index: shanten after discarding it} for every tile in the hand
+    def discard_shanten(self):
+        counts = self.hand.counts
+        result = {}
+        for index in range(34):
+            if not counts[index]:
+                continue
+            suit = Mahjong.tile_suit[index]
+            new_counts = bytearray(counts)
+            new_counts[index] -= 1
+            shapes = list(self.shapes)
+            shapes[suit] = suit_shapes(suit_counts(new_counts, suit), HandSolver.suit_chows[suit])
+            result[index] = hand_shanten(shapes, new_counts)
+        return result
+
+    # is the hand complete with the tile index added, only the suit of the tile is read again
+    def wins_with(self, index):
+        counts = self.hand.counts
+        if counts[index] >= 4:
+            return False
+        suit = Mahjong.tile_suit[index]
+        new_counts = bytearray(counts)
+        new_counts[index] += 1
+        if sum(new_counts) == 14 and orphan_shanten(new_counts) == -1:
+            return True
+        rows = list(self.rows)
+        rows[suit] = self.table.find(suit_counts(new_counts, suit), suit == 3)
+        if min(rows) < 0:
+            return False
+        return bool(self.table.decompose(new_counts, rows))
+
+    # the winning tiles of a ready hand with the Faan each one scores
+    # faan is None when the tiles complete the hand but the calculator rejects it
+    def waits(self):
+        if self.shanten() > 0:
+            return []
+        waits = []
+        for index in range(34):
+            if self.wins_with(index):
+                faan, name = score_win(self.hand.add(index), *self.context)
+                waits.append({'tile': Mahjong.tile_names[index], 'index': index,
+                              'remaining': 4 - self.hand[index], 'faan': faan, 'name': name})
+        return waits
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hand', help='Tiles of the hand separated by spaces (example: "b1 b2 b3 c5 c5 ...")',
+                        required=True)
+    parser.add_argument('--game_wind', help='Wind for this game, can be 1, 2, 3, or 4', type=int, default=-1)
+    parser.add_argument('--seat_wind', help='Wind for this seat, can be 1, 2, 3, or 4', type=int, default=-1)
+    parser.add_argument('--seat', help='Seat : 0 1 2 3 seat off to the dealer', type=int, default=-1)
+    args = parser.parse_args()
+
+    try:
+        hand = Mahjong.Hand.from_names(args.hand.split())
+    except KeyError as e:
+        print(f'ERROR: unknown tile class {e}')
+        sys.exit(1)
+
+    live = LiveHand(hand, args.game_wind, args.seat_wind, args.seat)
+    t_start = time.perf_counter()
+    waits = live.waits()
+    elapsed = time.perf_counter() - t_start
+    print(f'{hand}: shanten {live.shanten()}')
+    for wait in waits:
+        print(f"  {wait['tile']:<3} {wait['remaining']} left, {wait['faan']} Faan {wait['name']}")
+    print(f'waits in {elapsed * 1000:.3f} ms')
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import sys
+import math
+import time
+import random
+import argparse
+from multiprocessing import Pool
+
+import numpy as np
+
+import MahjongTile as Mahjong
+import MahjongHandTable as HandTable
+import MahjongShanten as Shanten
+
+# Monte Carlo estimate of how often a hand wins within a number of self draws and for how many Faan
+#
+# Every trial deals the draws from the tiles not yet seen (4 of each tile minus the hand and
+# the known discards). After each draw the hand wins if the tile completes it and the calculator
+# accepts it, otherwise the tile that leaves the lowest shanten is discarded (ties are broken
+# with the trial's random generator).
+#
+# Trials run in chunks, chunk i always uses the seed (seed, i), and chunks are merged in order,
+# so a run gives the same numbers for any number of workers.
+
+# tile counts left in the wall
+def remaining_wall(hand, discards=()):
+    wall = [4 - count for count in hand.counts]
+    for index in discards:
+        wall[index] -= 1
+    if min(wall) < 0:
+        raise ValueError('The hand and the discards have more than 4 of a tile')
+    return wall
+
+# play one trial, returns the Faan of the win or None
+def run_trial(hand, wall_tiles, draws, context, rng):
+    live = Shanten.LiveHand(hand, *context)
+    for index in rng.sample(wall_tiles, min(draws, len(wall_tiles))):
+        if live.wins_with(index):
+            faan, _ = Shanten.score_win(live.hand.add(index), *context)
+            if faan is not None:
+                return faan
+        live.add(index)
+        options = live.discard_shanten()
+        best = min(options.values())
+        live.discard(rng.choice([tile for tile, value in options.items() if value == best]))
+    return None
+
+def chunk_seed(seed, chunk_index):
+    return int(np.random.SeedSequence([seed, chunk_index]).generate_state(1)[0])
+
+# run one chunk of trials, returns (trials, wins, faan sum, faan square sum, win faan histogram)
+def run_chunk(task):
+    HandTable.check_worker()
+    hand, wall, draws, context, seed, chunk_index, trials = task
+    rng = random.Random(chunk_seed(seed, chunk_index))
+    wall_tiles = [index for index, count in enumerate(wall) for _ in range(count)]
+    wins = 0
+    faan_sum = 0
+    faan_square_sum = 0
+    histogram = {}
+    for _ in range(trials):
+        faan = run_trial(hand, wall_tiles, draws, context, rng)
+        if faan is not None:
+            wins += 1
+            faan_sum += faan
+            faan_square_sum += faan * faan
+            histogram[faan] = histogram.get(faan, 0) + 1
+    return trials, wins, faan_sum, faan_square_sum, histogram
+
+# running totals of the merged chunks
+class SimulationStats:
+
+    def __init__(self):
+        self.trials = 0
+        self.wins = 0
+        self.faan_sum = 0
+        self.faan_square_sum = 0
+        self.histogram = {}
+
+    def merge(self, chunk):
+        trials, wins, faan_sum, faan_square_sum, histogram = chunk
+        self.trials += trials
+        self.wins += wins
+        self.faan_sum += faan_sum
+        self.faan_square_sum += faan_square_sum
+        for faan, count in histogram.items():
+            self.histogram[faan] = self.histogram.get(faan, 0) + count
+
+    def win_rate(self):
+        return self.wins / self.trials if self.trials else 0.0
+
+    # standard error of the win rate
+    def win_rate_se(self):
+        if not self.trials:
+            return math.inf
+        p = self.win_rate()
+        return math.sqrt(p * (1 - p) / self.trials)
+
+    # expected Faan of a trial, a trial without a win scores 0
+    def expected_faan(self):
+        return self.faan_sum / self.trials if self.trials else 0.0
+
+    def expected_faan_se(self):
+        if self.trials < 2:
+            return math.inf
+        mean = self.expected_faan()
+        variance = max(self.faan_square_sum / self.trials - mean * mean, 0.0)
+        return math.sqrt(variance / self.trials)
+
+    # mean Faan of the trials that won
+    def faan_when_won(self):
+        return self.faan_sum / self.wins if self.wins else 0.0
+
+    def summary(self):
+        return {
+            'trials': self.trials,
+            'wins': self.wins,
+            'win_rate': self.win_rate(),
+            'win_rate_se': self.win_rate_se(),
+            'expected_faan': self.expected_faan(),
+            'expected_faan_se': self.expected_faan_se(),
+            'faan_when_won': self.faan_when_won(),
+            'faan_histogram': dict(sorted(self.histogram.items())),
+        }
+
+# Simulate a hand, returns the SimulationStats of the merged chunks
+#
+# Stops after trials, or earlier once the win rate standard error is below target_se
+# (after at least min_trials, the error of a rare win is unreliable before that).
+# progress is called with the stats after every merged chunk.
+def simulate(hand, discards=(), draws=18, trials=100000, game_wind=-1, seat_wind=-1, seat=-1,
+             seed=0, workers=None, chunk_size=500, target_se=None, min_trials=2000, progress=None):
+    if not isinstance(hand, Mahjong.Hand):
+        hand = Mahjong.Hand.from_counts(hand)
+    wall = remaining_wall(hand, discards)
+    context = (game_wind, seat_wind, seat)
+    tasks = [(hand, wall, draws, context, seed, chunk_index, min(chunk_size, trials - start))
+             for chunk_index, start in enumerate(range(0, trials, chunk_size))]
+
+    # the table is built or loaded here first, the workers only map the finished file
+    HandTable.get_table()
+    pool = None
+    if workers != 1 and len(tasks) > 1:
+        pool = Pool(processes=workers, initializer=HandTable.init_worker)
+        chunk_results = pool.imap(run_chunk, tasks)
+    else:
+        chunk_results = map(run_chunk, tasks)
+
+    stats = SimulationStats()
+    try:
+        # imap returns the chunks in order, the merge does not depend on which worker finished first
+        for chunk in chunk_results:
+            stats.merge(chunk)
+            if progress is not None:
+                progress(stats)
+            if target_se is not None and stats.trials >= min_trials and stats.win_rate_se() <= target_se:
+                break
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hand', help='Tiles of the hand separated by spaces (example: "b1 b2 b3 c5 c5 ...")',
+                        required=True)
+    parser.add_argument('--discards', help='Tiles already discarded or otherwise seen, separated by spaces',
+                        default='')
+    parser.add_argument('--draws', help='Number of draws left', type=int, default=18)
+    parser.add_argument('--trials', help='Maximum number of trials', type=int, default=100000)
+    parser.add_argument('--target_se', help='Stop once the standard error of the win rate is below this (example: "0.002")',
+                        type=float, default=None)
+    parser.add_argument('--min_trials', help='Trials to run before --target_se can stop the run', type=int, default=2000)
+    parser.add_argument('--seed', help='Random seed, the same seed gives the same result', type=int, default=0)
+    parser.add_argument('--workers', help='Number of processes, defaults to the number of cores', type=int, default=None)
+    parser.add_argument('--chunk', help='Number of trials per chunk', type=int, default=500)
+    parser.add_argument('--game_wind', help='Wind for this game, can be 1, 2, 3, or 4', type=int, default=-1)
+    parser.add_argument('--seat_wind', help='Wind for this seat, can be 1, 2, 3, or 4', type=int, default=-1)
+    parser.add_argument('--seat', help='Seat : 0 1 2 3 seat off to the dealer', type=int, default=-1)
+    args = parser.parse_args()
+
+    try:
+        hand = Mahjong.Hand.from_names(args.hand.split())
+        discards = [Mahjong.tile_names.index(name) for name in args.discards.split()]
+    except (KeyError, ValueError) as e:
+        print(f'ERROR: unknown tile {e}')
+        sys.exit(1)
+
+    t_start = time.perf_counter()
+
+    def progress(stats):
+        elapsed = time.perf_counter() - t_start
+        print(f'{stats.trials} trials, win {stats.win_rate():.4f} +- {stats.win_rate_se():.4f}, '
+              f'faan {stats.expected_faan():.3f} +- {stats.expected_faan_se():.3f}, '
+              f'{stats.trials / max(elapsed, 1e-9):.0f} trials/sec', file=sys.stderr)
+
+    try:
+        stats = simulate(hand, discards, args.draws, args.trials, args.game_wind, args.seat_wind, args.seat,
+                         args.seed, args.workers, args.chunk, args.target_se, args.min_trials, progress)
+    except (ValueError, RuntimeError, OSError) as e:
+        print(f'ERROR: {e}')
+        sys.exit(1)
+
+    summary = stats.summary()
+    print(f"{hand}: win rate {summary['win_rate']:.4f} +- {summary['win_rate_se']:.4f} within {args.draws} draws")
+    print(f"Expected Faan {summary['expected_faan']:.3f} +- {summary['expected_faan_se']:.3f}, "
+          f"{summary['faan_when_won']:.2f} Faan when won")
+    print(f"Faan histogram: {summary['faan_histogram']}")
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+import cv2
+import numpy as np
+
+from MahjongDetect import TileDetector, iou_matrix, backends
+from MahjongModelRegistry import default_model_path, resolve_model
+from MahjongGameState import GameState, default_confirm_weight
+
+# One tracked tile, the label is the class with the highest summed confidence so far
+class TileTrack:
+    __slots__ = ('id', 'bbox', 'votes', 'hits', 'misses')
+
+    def __init__(self, track_id, bbox, classname, conf):
+        self.id = track_id
+        self.bbox = np.asarray(bbox, dtype=np.float32)
+        self.votes = {classname: conf}
+        self.hits = 1
+        self.misses = 0
+
+    def vote(self, classname, conf):
+        self.votes[classname] = self.votes.get(classname, 0.0) + conf
+
+    @property
+    def label(self):
+        return max(self.votes, key=self.votes.get)
+
+    def to_dict(self):
+        return {'id': self.id, 'class': self.label, 'bbox': [int(v) for v in self.bbox], 'hits': self.hits}
+
+# Keeps tile identities between detections
+# update() matches new detections to the tracks by IoU, propagate() moves the
+# tracks with sparse optical flow on the frames where the model is not run
+class TileTracker:
+
+    def __init__(self, iou_threshold=0.3, max_misses=2):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.tracks = []
+        self.next_id = 0
+
+    def update(self, detections):
+        names = detections.class_names()
+        boxes = detections.xyxy
+        track_boxes = np.array([track.bbox for track in self.tracks], dtype=np.float32).reshape(-1, 4)
+        iou = iou_matrix(track_boxes, boxes)
+
+        # greedy matching, best pairs first
+        matched_tracks = set()
+        matched_boxes = set()
+        if iou.size:
+            order = np.argsort(-iou, axis=None)
+            for t, d in zip(*np.unravel_index(order, iou.shape)):
+                if iou[t, d] < self.iou_threshold:
+                    break
+                if t in matched_tracks or d in matched_boxes:
+                    continue
+                matched_tracks.add(t)
+                matched_boxes.add(d)
+                track = self.tracks[t]
+                track.bbox = boxes[d].astype(np.float32)
+                track.vote(names[d], float(detections.conf[d]))
+                track.hits += 1
+                track.misses = 0
+
+        # unmatched tracks age out, unmatched detections start new tracks
+        kept = []
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    continue
+            kept.append(track)
+        for d in range(len(boxes)):
+            if d not in matched_boxes:
+                kept.append(TileTrack(self.next_id, boxes[d], names[d], float(detections.conf[d])))
+                self.next_id += 1
+        self.tracks = kept
+        return self.tracks
+
+    # shift every track by the median optical flow of 5 points inside its box
+    def propagate(self, prev_gray, gray):
+        if not self.tracks:
+            return self.tracks
+        boxes = np.array([track.bbox for track in self.tracks], dtype=np.float32)
+        w = boxes[:, 2] - boxes[:, 0]
+        h = boxes[:, 3] - boxes[:, 1]
+        cx = boxes[:, 0] + w / 2
+        cy = boxes[:, 1] + h / 2
+        offsets = np.array([(0, 0), (-0.25, -0.25), (0.25, -0.25), (-0.25, 0.25), (0.25, 0.25)], dtype=np.float32)
+        points = np.stack([cx[:, None] + offsets[None, :, 0] * w[:, None],
+                           cy[:, None] + offsets[None, :, 1] * h[:, None]], axis=2).reshape(-1, 1, 2)
+        new_points, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None, winSize=(15, 15), maxLevel=2)
+        flow = (new_points - points).reshape(len(boxes), len(offsets), 2)
+        valid = status.reshape(len(boxes), len(offsets)).astype(bool)
+        for i, track in enumerate(self.tracks):
+            if valid[i].any():
+                dx, dy = np.median(flow[i][valid[i]], axis=0)
+                track.bbox = track.bbox + np.array([dx, dy, dx, dy], dtype=np.float32)
+        return self.tracks
+
+# Frame and latency counters of one stream
+class StreamCounters:
+
+    def __init__(self):
+        self.frames = 0
+        self.detected = 0
+        self.tracked = 0
+        self.dropped = 0
+        self.latencies = []
+
+    def summary(self):
+        latencies = np.array(self.latencies, dtype=np.float64) * 1000
+        return {
+            'frames': self.frames,
+            'detected_frames': self.detected,
+            'tracked_frames': self.tracked,
+            'dropped_frames': self.dropped,
+            'latency_ms_mean': float(latencies.mean()) if len(latencies) else 0.0,
+            'latency_ms_p95': float(np.percentile(latencies, 95)) if len(latencies) else 0.0,
+        }
+
+# Reads frames from a video file or a capture device
+# a capture device is read on a background thread that only keeps the newest frame,
+# every frame replaced before it was used is counted as dropped
+# a video file is read in order, with realtime=True frames are skipped to keep up with the video fps
+class FrameSource:
+
+    def __init__(self, source, realtime=False):
+        self.is_device = source.isdigit()
+        self.capture = cv2.VideoCapture(int(source) if self.is_device else source)
+        if not self.capture.isOpened():
+            raise ValueError(f'Video source {source} could not be opened.')
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 30.0
+        self.realtime = realtime
+        self.dropped = 0
+        self.index = -1
+        self.t_start = None
+
+        if self.is_device:
+            self.lock = threading.Lock()
+            self.latest = None
+            self.running = True
+            self.grabbed = threading.Event()
+            self.thread = threading.Thread(target=self.grab_loop, daemon=True)
+            self.thread.start()
+
+    def grab_loop(self):
+        while self.running:
+            ok, frame = self.capture.read()
+            if not ok:
+                self.running = False
+                self.grabbed.set()
+                break
+            with self.lock:
+                if self.latest is not None:
+                    self.dropped += 1
+                self.index += 1
+                self.latest = (self.index, frame)
+            self.grabbed.set()
+
+    # returns (frame_index, frame), or None at the end of the stream
+    def read(self):
+        if self.is_device:
+            while True:
+                self.grabbed.wait()
+                with self.lock:
+                    latest, self.latest = self.latest, None
+                    self.grabbed.clear()
+                if latest is not None:
+                    return latest
+                if not self.running:
+                    return None
+
+        if self.t_start is None:
+            self.t_start = time.perf_counter()
+        if self.realtime:
+            # skip the frames the video has already moved past
+            behind = int((time.perf_counter() - self.t_start) * self.fps) - (self.index + 1)
+            for _ in range(max(0, behind)):
+                if not self.capture.grab():
+                    return None
+                self.index += 1
+                self.dropped += 1
+        ok, frame = self.capture.read()
+        if not ok:
+            return None
+        self.index += 1
+        return self.index, frame
+
+    def close(self):
+        if self.is_device:
+            self.running = False
+            self.thread.join(timeout=1)
+        self.capture.release()
+
+# Run the detector every stride frames and track the tiles in between
+# yields (frame_index, tracks) for every processed frame
+def run_stream(detector, frame_source, stride=5, tracker=None, counters=None):
+    tracker = tracker or TileTracker()
+    counters = counters or StreamCounters()
+    prev_gray = None
+    last_detect = None
+    while True:
+        item = frame_source.read()
+        if item is None:
+            break
+        t_start = time.perf_counter()
+        frame_index, frame = item
+        gray = cv2.cvtColor(detector.view(frame), cv2.COLOR_BGR2GRAY)
+
+        if last_detect is None or frame_index - last_detect >= stride:
+            tracks = tracker.update(detector.infer(detector.preprocess(frame)))
+            last_detect = frame_index
+            counters.detected += 1
+        else:
+            tracks = tracker.propagate(prev_gray, gray)
+            counters.tracked += 1
+        prev_gray = gray
+
+        counters.frames += 1
+        counters.dropped = frame_source.dropped
+        counters.latencies.append(time.perf_counter() - t_start)
+        yield frame_index, tracks
+
+def main():
+    # Define and parse user input arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', help='Path to YOLO model file or model generation ("5"), defaults to the best model in Model/',
+                        default=default_model_path())
+    parser.add_argument('--source', help='Video file ("table.mp4") or capture device index ("0")',
+                        required=True)
+    parser.add_argument('--threshold', help='Minimum confidence threshold for detected tiles (example: "0.4")',
+                        default=0.2)
+    parser.add_argument('--resolution', help='Resize the frames to WxH before detection (example: "1280x720")',
+                        default=None)
+    parser.add_argument('--ROI', help='Adjust the ROI (example: top-left (100,100), bottom-right (500,400)), \
+                        otherwise, detect on the whole frame',
+                        nargs=4, type=int, metavar=('x1', 'y1', 'x2', 'y2'),
+                        default=(-1,-1,-1,-1))
+    parser.add_argument('--ignore', help='Ignore area: specify as x1 y1 x2 y2. Can be used multiple times.',
+                        nargs=4, type=int, metavar=('x1', 'y1', 'x2', 'y2'),
+                        action='append',
+                        default=[])
+    parser.add_argument('--stride', help='Run the model every N frames and track the tiles in between',
+                        type=int, default=5)
+    parser.add_argument('--realtime', help='Skip video file frames to keep up with the video fps, devices always do',
+                        default=False)
+    parser.add_argument('--device', help='Inference device', default='cpu')
+    parser.add_argument('--game', help='Follow the hand and print draw, discard, meld and win events (see MahjongGameState.py)',
+                        action='store_true')
+    parser.add_argument('--confirm', help='Summed confidence of the frames that confirms a change of the hand',
+                        type=float, default=default_confirm_weight)
+    parser.add_argument('--game_wind', help='Wind for this game, can be 1, 2, 3, or 4 (1: east, 2: south, 3: west, 4: north)',
+                        type=int, default=-1)
+    parser.add_argument('--seat_wind', help='Wind for this seat, can be 1, 2, 3, or 4 (1: east, 2: south, 3: west, 4: north)',
+                        type=int, default=-1)
+    parser.add_argument('--seat', help='Seat : 0 1 2 3 seat off to the dealer, in clockwise direction',
+                        type=int, default=-1)
+    parser.add_argument('--backend', help='Inference backend, the exported model next to --model is used (see MahjongExport.py)',
+                        choices=backends, default=None)
+    args = parser.parse_args()
+
+    try:
+        detector = TileDetector(resolve_model(args.model), args.threshold, args.resolution, args.ROI, args.ignore, device=args.device,
+                                backend=args.backend)
+        frame_source = FrameSource(args.source, bool(args.realtime))
+    except (ValueError, FileNotFoundError) as e:
+        print(f'ERROR: {e}')
+        sys.exit(1)
+
+    counters = StreamCounters()
+    game = GameState(args.game_wind, args.seat_wind, args.seat, args.confirm) if args.game else None
+    try:
+        # one JSON line per frame with the stable tile identities
+        for frame_index, tracks in run_stream(detector, frame_source, max(1, args.stride), counters=counters):
+            line = {'frame': frame_index, 'tiles': [track.to_dict() for track in tracks]}
+            if game is not None:
+                # the tracked labels, with the mean confidence of the votes for them
+                events = game.update([track.label for track in tracks],
+                                     [track.votes[track.label] / track.hits for track in tracks],
+                                     np.array([track.bbox for track in tracks], dtype=np.float32).reshape(-1, 4))
+                if events:
+                    line['events'] = events
+            print(json.dumps(line))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        frame_source.close()
+
+    summary = {'counters': counters.summary()}
+    if game is not None:
+        summary['game'] = game.summary()
+    print(json.dumps(summary))
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
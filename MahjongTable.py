@@ -0,0 +1,145 @@
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+import MahjongLayout as Layout
+import MahjongMetrics as Metrics
+from MahjongBatchScore import score_hands
+from MahjongDetect import Detections, TileDetector, backends
+from MahjongModelRegistry import default_model_path, resolve_model
+
+# Score every hand of a whole table photo with one inference
+#
+# The detector runs once on the whole photo (with --slice for the small tiles of a table shot),
+# MahjongLayout.table_hands splits the tiles into the hands of the bottom, left, top and right
+# seats and every hand is scored with its seat. Seats count clockwise from the dealer like
+# --seat of MahjongFaanCalculator.py, the dealer is east. The discards in the middle of the
+# table are not part of any hand, mask them with --ignore.
+#
+#   python MahjongTable.py --source table.jpg --slice 640x640 --dealer left --game_wind 1
+
+# the tiles of one side of the table
+def subset(detections, indices):
+    indices = np.asarray(indices, dtype=np.int64)
+    return Detections(detections.xyxy[indices], detections.conf[indices], detections.cls[indices], detections.names)
+
+# (seat, seat_wind) of a side when the dealer sits at dealer, -1 when the dealer is not known
+def seat_of(side, dealer=None):
+    if dealer is None:
+        return -1, -1
+    seat = (Layout.table_sides.index(side) - Layout.table_sides.index(dealer)) % 4
+    return seat, seat + 1
+
+# Per side results of the detections of a table photo
+# the hands are scored together by MahjongBatchScore.score_hands, workers > 1 scores them on a process pool
+def score_table(detections, game_wind=-1, dealer=None, workers=1, trace=Metrics.null_trace):
+    names = detections.class_names()
+    hands = Layout.table_hands(detections.xyxy, names)
+    trace.mark('layout')
+
+    results = []
+    hand_rows = []
+    for side, indices in hands:
+        seat, seat_wind = seat_of(side, dealer)
+        hand = subset(detections, indices)
+        hand_names = hand.class_names()
+        layout = hand.layout()
+        rows = layout.sequences(hand_names)
+        if side in ('top', 'right'):
+            # the rows as the player reads them, the top and right hands face the camera or its left
+            rows = [row[::-1] for row in reversed(rows)]
+        result = {'side': side, 'seat': seat, 'seat_wind': seat_wind, 'tiles': hand_names, 'rows': rows,
+                  'exposed': [[hand_names[i] for i in group] for group, _ in layout.exposed_melds(hand_names)]}
+        try:
+            row = np.frombuffer(hand.to_hand(), dtype=np.uint8).astype(np.int16)
+        except ValueError as e:
+            result.update(ok=False, error=str(e))
+        else:
+            hand_rows.append(np.concatenate((row, [game_wind, seat_wind, seat])))
+            result['row'] = len(hand_rows) - 1
+        results.append(result)
+
+    if hand_rows:
+        # one chunk per hand, so the hands of the table are spread over the workers
+        faan, faan_names = score_hands(np.array(hand_rows, dtype=np.int16), workers, chunk_size=1)
+        for result in results:
+            if 'row' not in result:
+                continue
+            index = result.pop('row')
+            if faan[index] < 0:
+                result.update(ok=False, error=faan_names[index].replace('Error: ', '', 1))
+            else:
+                result.update(ok=True, faan=int(faan[index]), name=faan_names[index])
+    trace.mark('scoring')
+    return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source', help='Photo of the whole table', required=True)
+    parser.add_argument('--model', help='Path to YOLO model file or model generation ("5"), defaults to the best model in Model/',
+                        default=None)
+    parser.add_argument('--threshold', help='Minimum confidence threshold for detected tiles (example: "0.4")',
+                        default=0.2)
+    parser.add_argument('--resolution', help='Resize the photo to WxH before detection (example: "1280x1280")',
+                        default=None)
+    parser.add_argument('--ROI', help='Detect in x1 y1 x2 y2 of the photo only, otherwise on the whole photo',
+                        nargs=4, type=int, metavar=('x1', 'y1', 'x2', 'y2'),
+                        default=(-1,-1,-1,-1))
+    parser.add_argument('--ignore', help='Ignore area (the discards): specify as x1 y1 x2 y2. Can be used multiple times.',
+                        nargs=4, type=int, metavar=('x1', 'y1', 'x2', 'y2'),
+                        action='append',
+                        default=[])
+    parser.add_argument('--slice', help='Sliced inference: also run overlapping WxH slices of the photo (example: "640x640")',
+                        default=None)
+    parser.add_argument('--overlap', help='Overlap of neighbouring slices as a fraction of the slice size',
+                        type=float, default=0.2)
+    parser.add_argument('--backend', help='Inference backend, the exported model next to --model is used (see MahjongExport.py)',
+                        choices=backends, default=None)
+    parser.add_argument('--device', help='Inference device', default='cpu')
+    parser.add_argument('--game_wind', help='Wind for this game, can be 1, 2, 3, or 4 (1: east, 2: south, 3: west, 4: north)',
+                        type=int, default=-1)
+    parser.add_argument('--dealer', help='Side of the table the dealer sits at, the seats and seat winds follow from it',
+                        choices=Layout.table_sides, default=None)
+    parser.add_argument('--workers', help='Scoring processes, a pool only pays off over many tables', type=int, default=1)
+    parser.add_argument('--report', help='Write the per seat results to this JSON file', default=None)
+    args = parser.parse_args()
+
+    model_path = resolve_model(args.model) if args.model else default_model_path()
+    try:
+        detector = TileDetector(model_path, args.threshold, args.resolution, args.ROI, args.ignore, device=args.device,
+                                backend=args.backend, slice_size=args.slice, slice_overlap=args.overlap)
+        trace = Metrics.start(args.source)
+        t_start = time.perf_counter()
+        detections = detector.detect_file(args.source, trace=trace)
+        t_detect = time.perf_counter()
+    except (ValueError, FileNotFoundError) as e:
+        print(f'ERROR: {e}')
+        sys.exit(1)
+
+    results = score_table(detections, args.game_wind, args.dealer, args.workers, trace)
+    t_end = time.perf_counter()
+    Metrics.finish(trace)
+    if not results:
+        print('ERROR: No tiles detected.')
+        sys.exit(1)
+
+    for result in results:
+        seat = f"seat {result['seat']}" if result['seat'] >= 0 else 'seat ?'
+        outcome = f"{result['faan']} faan, {result['name']}" if result['ok'] else f"Error: {result['error']}"
+        print(f"{result['side']:<7}{seat:<8}{len(result['tiles']):>3} tiles  {outcome}")
+        for row in result['rows']:
+            print(f"{'':<15}{' '.join(row)}")
+    print(f'{len(detections)} tiles, detection {(t_detect - t_start) * 1000:.0f} ms, '
+          f'layout and scoring {(t_end - t_detect) * 1000:.1f} ms')
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'source': args.source, 'model': detector.model_path, 'seats': results,
+                       'detection_ms': (t_detect - t_start) * 1000, 'scoring_ms': (t_end - t_detect) * 1000}, f, indent=2)
+    sys.exit(0 if all(result['ok'] for result in results) else 1)
+
+if __name__ == '__main__':
+    main()
@@ -58,3 +58,102 @@ class Meld(Enum):
     CHOW = 1
     PONG = 2
     KONG = 3
+
+# The 34 distinct tiles in index order, used by the tile count vectors
+# 0-8: b1-b9, 9-17: c1-c9, 18-26: d1-d9, 27-29: dr dg dw, 30-33: we ws ww wn
+tile_values = [tile.value for tile in Tile]
+tile_names = [tile.name for tile in Tile]
+tile_index = {value: i for i, value in enumerate(tile_values)}
+
+# per tile index facts, looked up instead of recomputed from the tile values
+tile_suit = [i // 9 for i in range(27)] + [3] * 7   # 0: b, 1: c, 2: d, 3: honors
+tile_is_terminal = [i < 27 and i % 9 in (0, 8) for i in range(34)]
+tile_is_dragon = [27 <= i < 30 for i in range(34)]
+tile_is_wind = [30 <= i < 34 for i in range(34)]
+
+# slot of every class name in a Hand: tiles 0-33, flowers 34-41 (Flower value 1-8)
+flower_offset = 34
+hand_size = flower_offset + 8
+class_slot = {tile.name: i for i, tile in enumerate(Tile)}
+class_slot.update({name: flower_offset + flower.value - 1 for name, flower in Flower.__members__.items()})
+
+# masks over Hand.present(), byte i of the mask is 1 for tile index i
+def index_mask(indices):
+    return int.from_bytes(bytes(1 if i in indices else 0 for i in range(34)), 'little')
+
+suit_masks = [index_mask(range(s * 9, s * 9 + 9)) for s in range(3)]
+honor_mask = index_mask(range(27, 34))
+dragon_mask = index_mask(range(27, 30))
+wind_mask = index_mask(range(30, 34))
+terminal_mask = index_mask([i for i in range(34) if tile_is_terminal[i]])
+simple_mask = index_mask([i for i in range(27) if not tile_is_terminal[i]])
+presence_table = bytes([0] + [1] * 255)
+
+# Tile and flower counts of one hand, 34 tile counts followed by 8 flower counts
+# immutable bytes, so it is hashable and can be used directly as a cache key
+class Hand(bytes):
+    __slots__ = ()
+
+    def __new__(cls, data=bytes(hand_size)):
+        if len(data) != hand_size:
+            raise ValueError(f'A hand has {hand_size} counts, got {len(data)}')
+        return super().__new__(cls, data)
+
+    @classmethod
+    def from_counts(cls, counts, flowers=()):
+        data = bytearray(hand_size)
+        data[:34] = bytes(counts)
+        for flower_index in flowers:
+            data[flower_offset + flower_index - 1] += 1
+        return cls(data)
+
+    # build a hand from class names such as 'b1', 'dr' or 'f1_s', unknown names raise KeyError
+    @classmethod
+    def from_names(cls, class_names):
+        data = bytearray(hand_size)
+        for class_name in class_names:
+            data[class_slot[class_name]] += 1
+        return cls(data)
+
+    @property
+    def counts(self):
+        return self[:34]
+
+    @property
+    def flower_counts(self):
+        return self[flower_offset:]
+
+    # Flower values of the flowers in the hand, e.g. [1, 3]
+    def flowers(self):
+        return [value for value, count in enumerate(self[flower_offset:], 1) for _ in range(count)]
+
+    def tile_total(self):
+        return sum(self[:34])
+
+    # byte i is 1 when tile index i is in the hand, test it with the masks above
+    def present(self):
+        return int.from_bytes(self[:34].translate(presence_table), 'little')
+
+    def suits(self):
+        present = self.present()
+        return [s for s in range(3) if present & suit_masks[s]]
+
+    def add(self, index, count=1):
+        data = bytearray(self)
+        data[index] += count
+        return Hand(data)
+
+    def remove(self, index, count=1):
+        data = bytearray(self)
+        if data[index] < count:
+            raise ValueError(f'Hand has no {tile_names[index] if index < 34 else index} to remove')
+        data[index] -= count
+        return Hand(data)
+
+    def names(self):
+        return [tile_names[i] for i in range(34) for _ in range(self[i])]
+
+    def __repr__(self):
+        return f"Hand({' '.join(self.names())}{' flowers ' + str(self.flowers()) if any(self[flower_offset:]) else ''})"
+
+    __str__ = __repr__
@@ -0,0 +1,27 @@
+import numpy as np
+
+import MahjongTile as Mahjong
+import MahjongBatchScore as BatchScore
+
+def hand_rows(text, copies):
+    counts = np.bincount([Mahjong.class_slot[name] for name in text.split()], minlength=34)[:34]
+    # distinct rows, identical ones are scored once and would not reach the pool
+    rows = BatchScore.to_batch(np.repeat(counts[None], copies, axis=0))
+    rows[:, -3] = np.arange(copies) % 4 + 1
+    return rows
+
+def test_pool_scores_like_one_process():
+    rows = hand_rows('b1 b1 b1 b2 b2 b2 b3 b3 b3 c5 c5 c5 dr dr', 4)
+    inline = BatchScore.score_hands(rows, workers=1, chunk_size=1)
+    pooled = BatchScore.score_hands(rows, workers=2, chunk_size=1)
+    assert inline[0].tolist() == pooled[0].tolist() and inline[1] == pooled[1]
+
+def test_bad_flower_counts_are_rejected():
+    rows = hand_rows('b1 b1 b1 b2 b2 b2 b3 b3 b3 c5 c5 c5 dr dr', 3)
+    flowers = slice(BatchScore.tile_columns, BatchScore.tile_columns + BatchScore.flower_columns)
+    # eight copies of f1 are not All Flowers, a negative season does not wrap around to 255
+    rows[0, flowers] = [8, 0, 0, 0, 0, 0, 0, 0]
+    rows[1, flowers] = [1, -1, 0, 0, 0, 0, 0, 0]
+    faan, names = BatchScore.score_hands(rows, workers=1)
+    assert faan.tolist() == [-1, -1, 4]
+    assert all(name.startswith('Error: a flower') for name in names[:2])
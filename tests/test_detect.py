@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+import MahjongDetect as Detect
+
+frame = np.random.default_rng(0).integers(0, 255, (300, 500, 3), dtype=np.uint8)
+roi = (50, 20, 450, 280)
+
+def test_stretch_fills_the_input():
+    prepared = Detect.prepare_frame(frame, 640, roi=roi)
+    assert prepared.input.shape == (640, 640, 3)
+    # no grey padding rows, the ROI covers the whole input
+    assert not (prepared.input[:8] == 114).all()
+    boxes = prepared.map_boxes(np.array([[0, 0, 640, 640], [320, 320, 640, 640]], dtype=np.float32))
+    np.testing.assert_allclose(boxes, [[0, 0, 400, 260], [200, 130, 400, 260]], atol=0.5)
+
+def test_letterbox_keeps_the_aspect_ratio():
+    prepared = Detect.prepare_frame(frame, 640, roi=roi, resize_mode='letterbox')
+    # 400x260 scaled by 1.6 is 640x416, padded by 112 rows above and below
+    assert (prepared.input[:112] == 114).all()
+    boxes = prepared.map_boxes(np.array([[0, 112, 640, 528], [320, 320, 640, 528]], dtype=np.float32))
+    np.testing.assert_allclose(boxes, [[0, 0, 400, 260], [200, 130, 400, 260]], atol=0.5)
+
+def test_unknown_resize_mode():
+    with pytest.raises(ValueError):
+        Detect.prepare_frame(frame, 640, resize_mode='crop')
+
+# a detector with the settings reduction reads, without loading a model
+def bare_detector(resize_mode, roi=None, imgsz=640):
+    detector = object.__new__(Detect.TileDetector)
+    detector.roi, detector.resize, detector.slice_size = roi, False, None
+    detector.imgsz, detector.resize_mode = imgsz, resize_mode
+    return detector
+
+def test_reduction_of_a_wide_roi():
+    # a 4032 x 945 hand strip of a 4032 x 3024 photo: stretching keeps all 945 rows,
+    # letterboxing only needs the long side to stay above 640
+    roi = (0, 2000, 4032, 2945)
+    assert bare_detector('stretch', roi).reduction((4032, 3024)) == 1
+    assert bare_detector('letterbox', roi).reduction((4032, 3024)) == 4
+
+def test_reduction_of_the_whole_photo():
+    assert bare_detector('stretch').reduction((4032, 3024)) == 4
+    assert bare_detector('letterbox').reduction((4032, 3024)) == 4
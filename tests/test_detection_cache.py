@@ -0,0 +1,39 @@
+import pytest
+
+import MahjongDetectionCache as Cache
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = Cache.DetectionCache(str(tmp_path / 'cache.sqlite'))
+    yield cache
+    cache.close()
+
+@pytest.fixture
+def model_path(tmp_path):
+    path = tmp_path / 'my_model.pt'
+    path.write_bytes(b'weights')
+    (tmp_path / 'my_model.onnx').write_bytes(b'weights')
+    return str(path)
+
+def key(detector):
+    return Cache.entry_key('image', detector.model, detector.params(False, None, None))
+
+def test_key_follows_the_input_size(cache, model_path):
+    assert key(Cache.CachedDetector(cache, model_path)) == key(Cache.CachedDetector(cache, model_path, imgsz=640))
+    assert key(Cache.CachedDetector(cache, model_path)) != key(Cache.CachedDetector(cache, model_path, imgsz=320))
+
+def test_key_follows_the_backend_file(cache, model_path):
+    # the same bytes exported for another backend still get their own entries
+    pytorch = Cache.CachedDetector(cache, model_path)
+    onnx = Cache.CachedDetector(cache, model_path, backend='onnx')
+    assert pytorch.model == onnx.model
+    assert key(pytorch) != key(onnx)
+
+def test_key_follows_the_preprocess_version(cache, model_path, monkeypatch):
+    detector = Cache.CachedDetector(cache, model_path)
+    before = key(detector)
+    monkeypatch.setattr(Cache, 'preprocess_version', Cache.preprocess_version + 1)
+    assert key(detector) != before
+
+def test_key_follows_the_resize_mode(cache, model_path):
+    assert key(Cache.CachedDetector(cache, model_path)) != key(Cache.CachedDetector(cache, model_path, resize_mode='letterbox'))
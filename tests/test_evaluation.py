@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+import MahjongEvaluation as Evaluation
+
+# boxes of upright tiles side by side in one row
+def row(count, x=0):
+    return np.array([[x + i * 40, 0, x + (i + 1) * 40, 55] for i in range(count)], dtype=np.float64)
+
+def test_average_precision():
+    assert Evaluation.average_precision(np.array([0.5, 1.0]), np.array([1.0, 1.0])) == 1.0
+    # precision 1 up to recall 0.5 (51 of the 101 points), 0.5 above it
+    assert Evaluation.average_precision(np.array([0.5, 1.0]), np.array([1.0, 0.5])) == pytest.approx(76 / 101)
+    # recall never above 0.5, the rest of the curve counts as 0
+    assert Evaluation.average_precision(np.array([0.5]), np.array([1.0])) == pytest.approx(51 / 101)
+
+def test_match_pairs_is_one_to_one():
+    iou = np.array([[0.9, 0.6], [0.8, 0.1], [0.2, 0.7]])
+    pred_idx, gt_idx = Evaluation.match_pairs(iou, 0.5)
+    assert sorted(zip(pred_idx.tolist(), gt_idx.tolist())) == [(0, 0), (2, 1)]
+    assert len(Evaluation.match_pairs(iou, 0.95)[0]) == 0
+
+def test_match_image_needs_the_class():
+    tp = Evaluation.match_image(row(2), ['b1', 'b3'], row(2), ['b1', 'b2'])
+    assert tp[:, 0].tolist() == [True, False]
+
+def test_exact_boxes():
+    ground_truth = [('a.jpg', row(2), ['b1', 'b2'])]
+    report = Evaluation.evaluate([(row(2), [0.9, 0.8], ['b1', 'b2'])], ground_truth)
+    assert (report['mAP50'], report['mAP50-95'], report['precision'], report['recall']) == (1.0, 1.0, 1.0, 1.0)
+    assert report['hand_exact_match'] == 1.0
+
+def test_false_positive():
+    # one extra b3 on a b1 b2 image
+    ground_truth = [('a.jpg', row(2), ['b1', 'b2'])]
+    report = Evaluation.evaluate([(row(3), [0.9, 0.8, 0.7], ['b1', 'b2', 'b3'])], ground_truth)
+    assert Evaluation.background not in report['per_class']
+    assert report['per_class']['b3'] == {'ground_truth': 0, 'ap50': 0.0, 'ap50_95': 0.0,
+                                         'correct': 0, 'missed': 0, 'confused': 0, 'false_positives': 1}
+    assert report['per_class']['b1']['confused'] == 0
+    assert report['precision'] == pytest.approx(2 / 3) and report['recall'] == 1.0
+    assert report['mAP50'] == 1.0 and report['hand_exact_match'] == 0.0
+
+def test_confused_and_missed_tiles():
+    ground_truth = [('a.jpg', row(3), ['b1', 'b2', 'b3'])]
+    report = Evaluation.evaluate([(row(2), [0.9, 0.8], ['b1', 'c2'])], ground_truth)
+    per_class = report['per_class']
+    assert (per_class['b2']['confused'], per_class['b3']['missed'], per_class['c2']['false_positives']) == (1, 1, 1)
+    assert report['mixups'] == [{'truth': 'b2', 'predicted': 'c2', 'count': 1}]
+    assert report['precision'] == 0.5 and report['recall'] == pytest.approx(1 / 3)
+    # b1 is found, b2 and b3 never: mAP over the 3 classes with ground truth
+    assert report['mAP50'] == pytest.approx(1 / 3)
+
+def test_loose_box_counts_at_the_low_iou_thresholds():
+    # shifted by 4 pixels: IoU 36 / 44 = 0.82, a match from 0.5 to 0.8, 7 of the 10 thresholds
+    ground_truth = [('a.jpg', row(1), ['b1'])]
+    report = Evaluation.evaluate([(row(1, x=4), [0.9], ['b1'])], ground_truth)
+    assert report['mAP50'] == 1.0
+    assert report['mAP50-95'] == pytest.approx(0.7)
+
+def test_confidence_threshold_and_hand_match():
+    ground_truth = [('a.jpg', row(2), ['b1', 'b2']), ('b.jpg', row(2), ['b1', 'b1'])]
+    predictions = [
+        # a low confidence extra box is left out of precision and the hand
+        (row(3), [0.9, 0.8, 0.1], ['b1', 'b2', 'b3']),
+        (row(1), [0.9], ['b1']),
+    ]
+    report = Evaluation.evaluate(predictions, ground_truth, conf_threshold=0.25)
+    assert report['hand_exact_match'] == 0.5
+    assert report['precision'] == 1.0 and report['recall'] == 0.75
+    assert report['per_class']['b1']['missed'] == 1
@@ -0,0 +1,57 @@
+import pytest
+
+import MahjongTile as Mahjong
+import MahjongHandTable as HandTable
+from MahjongFaanCalculator import best_faan, FaanError
+
+def hand(names):
+    return Mahjong.Hand.from_names(names.split())
+
+nine_gates_hand = 'c1 c1 c1 c2 c3 c4 c5 c6 c7 c8 c9 c9 c9 c5'
+
+@pytest.mark.parametrize('names, winds, faan, name', [
+    ('b1 b1 b1 b2 b2 b2 b3 b3 b3 c5 c5 c5 dr dr', (1, 1, 0), 4, 'triplets'),
+    ('b1 b1 b1 b2 b2 b2 b3 b3 b3 c5 c5 c5 dr dr f1', (1, 1, 0), 3, 'triplets'),
+    ('c2 c3 c4 c5 c6 c7 d1 d2 d3 d7 d8 d9 we we', (1, 1, 0), 2, 'common hand'),
+    ('c2 c3 c4 c5 c6 c7 d1 d1 d1 d9 d9 d9 we we', (1, 1, 0), 1, ''),
+    ('d2 d2 d2 d3 d3 d3 d4 d4 d4 d5 d5 d5 d6 d6', (1, 1, 0), 11, 'one suit triplets'),
+    ('dr dr dr dg dg dg dw dw dw b1 b1 b1 b2 b2', (1, 1, 0), 15, 'big dragon triplets'),
+    # a pong of the game and seat wind counts twice, of neither wind not at all
+    ('we we we c2 c3 c4 c5 c6 c7 d1 d1 d1 b5 b5', (1, 1, 0), 3, ''),
+    ('we we we c2 c3 c4 c5 c6 c7 d1 d1 d1 b5 b5', (2, 3, 2), 1, ''),
+])
+def test_known_hands(names, winds, faan, name):
+    result = best_faan(hand(names), *winds)
+    assert (result['faan'], result['name'].strip()) == (faan, name)
+
+def test_thirteen_orphans():
+    result = best_faan(hand('b1 b9 c1 c9 d1 d9 we ws ww wn dr dg dw dw'), 1, 1, 0)
+    assert (result['faan'], result['name']) == (13, 'Thirteen Orphans')
+    assert result['melds'] == [] and result['eye'] is None
+
+def test_thirteen_orphans_needs_every_orphan():
+    with pytest.raises(FaanError):
+        best_faan(hand('b1 b9 c1 c9 d1 d9 we ws ww wn dr dg dg dg'), 1, 1, 0)
+
+def test_nine_gates_flag():
+    table = HandTable.get_table()
+    assert table.hand_flags(hand(nine_gates_hand).counts)['nine_gates']
+    assert not table.hand_flags(hand('c1 c1 c1 c2 c3 c4 c5 c6 c7 c8 c9 c9 b9 b9').counts)['nine_gates']
+
+def test_nine_gates_needs_a_concealed_hand():
+    # a photo does not tell whether the hand is concealed, so it scores as one suit
+    result = best_faan(hand(nine_gates_hand), 1, 1, 0)
+    assert (result['faan'], result['name']) == (8, 'one suit')
+
+@pytest.mark.parametrize('names', [
+    'b1 b1 b1 b2 b2 b2 b3 b3 b3 c5 c5 c5 dr',
+    'b1 b2 b4 b5 b6 b7 b8 b9 c1 c1 c1 dr dr d5',
+    'b1 b2 b3',
+])
+def test_non_winning_hands(names):
+    with pytest.raises(FaanError, match="didn't match any melds"):
+        best_faan(hand(names), 1, 1, 0)
+
+def test_counts_above_4():
+    with pytest.raises(FaanError, match='more than 4'):
+        best_faan(hand('b1 b1 b1 b1 b1 b2 b3 b4 b5 b6 b7 b8 b9 b9'), 1, 1, 0)
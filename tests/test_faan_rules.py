@@ -0,0 +1,70 @@
+import pytest
+
+import MahjongTile as Mahjong
+import MahjongHandTable as HandTable
+import MahjongFaanCalculator as Calculator
+import MahjongFaanRules as FaanRules
+
+# the features of a chow / pong hand without flowers, honors or a known seat
+def features(**changes):
+    hand = {
+        'flowers': 0, 'odd_flowers': 0, 'even_flowers': 0, 'nice_flowers': 0,
+        'detected_dragon': False, 'detected_dragon_set': [0, 0], 'dragon_sets': 0,
+        'detected_wind': False, 'detected_winds_set': [0, 0], 'wind_sets': 0, 'cool_wind': 0,
+        'words_only': False, 'melds': [0, 2, 2, 0, 0], 'chows': 2, 'pongs': 2, 'kongs': 0, 'eye_type': 0,
+        'orphan': False, 'one_suit': False, 'thirteen_orphans': False, 'nine_gates': False, 'door_free': False,
+    }
+    hand.update(changes)
+    return hand
+
+def test_every_feature_is_named():
+    assert set(features()) == set(FaanRules.feature_names)
+
+def test_cumulative_rules_add_up():
+    result = FaanRules.faan_engine.evaluate(features(chows=0, pongs=4, cool_wind=2, detected_wind=True, wind_sets=1))
+    assert result['rules'] == ['No flowers', 'winds', 'triplets']
+    assert (result['faan'], result['name']) == (6, ' triplets')
+
+def test_set_title_comes_before_the_appended_ones():
+    result = FaanRules.faan_engine.evaluate(features(one_suit=True, chows=4, pongs=0))
+    assert (result['faan'], result['name']) == (9, 'one suit common hand')
+
+def test_limit_hand_replaces_the_cumulative_rules():
+    result = FaanRules.faan_engine.evaluate(features(orphan=True, thirteen_orphans=True, chows=0, pongs=0))
+    assert result == {'faan': 13, 'name': 'Thirteen Orphans', 'rules': ['Thirteen Orphans'],
+                      'debug': '\nDebug:\nThirteen Orphans, = 13 Faan.\n'}
+
+def test_first_limit_hand_wins():
+    # four wind pongs are honors only too, Words Only is declared before Great Winds
+    hand = features(words_only=True, wind_sets=4, detected_wind=True, chows=0, pongs=4)
+    assert FaanRules.faan_engine.evaluate(hand)['name'] == 'Words Only'
+
+def test_nine_gates_on_a_concealed_hand():
+    tiles = Mahjong.Hand.from_names('c1 c1 c1 c2 c3 c4 c5 c6 c7 c8 c9 c9 c9 c5'.split())
+    table = HandTable.get_table()
+    flags = table.hand_flags(tiles.counts)
+    hand = Calculator.hand_features(tiles, table.decompose(tiles.counts)[0], flags, 1, 1, 0)
+    assert FaanRules.faan_engine.evaluate(hand)['name'] == 'one suit'
+    hand['door_free'] = True
+    result = FaanRules.faan_engine.evaluate(hand)
+    assert (result['faan'], result['name']) == (10, 'Nine Gates')
+
+def test_rule_with_an_unknown_feature():
+    with pytest.raises(ValueError, match='unknown features'):
+        FaanRules.RuleEngine([FaanRules.Rule('Moon', 1, lambda h: h['moon'], ['moon'])])
+
+def test_profiled_engine_counts_every_rule():
+    engine = FaanRules.RuleEngine(FaanRules.faan_rules, profile=True)
+    engine.reset_stats()
+    hands = [features(), features(chows=0, pongs=4), features(flowers=7)]
+    try:
+        for hand in hands:
+            assert engine.evaluate(hand) == FaanRules.faan_engine.evaluate(hand)
+        stats = {row['rule']: row for row in engine.stats()}
+    finally:
+        engine.reset_stats()
+    # every hand tries the limit hands up to the one that fires, the cumulative rules only without one
+    assert stats['Seven Flowers']['evaluations'] == 3 and stats['Seven Flowers']['hits'] == 1
+    assert stats['All Flowers']['evaluations'] == 2
+    assert stats['No flowers']['evaluations'] == 2 and stats['No flowers']['hits'] == 2
+    assert stats['triplets']['hits'] == 1 and stats['triplets']['hit_rate'] == 0.5
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+import MahjongTile as Mahjong
+import MahjongHandTable as HandTable
+from MahjongFaanCalculator import best_faan, FaanError
+
+# five b1 would carry into the b2 digit of the base 5 key and read as b1 b2 ...
+five_b1 = 'b1 b1 b1 b1 b1 b3 b4 c1 c1 c1 c5 c5 c5 d2 d3 d4 dr dr'
+
+def test_find_rejects_counts_above_4():
+    table = HandTable.get_table()
+    hand = Mahjong.Hand.from_names(five_b1.split())
+    assert table.find(hand.counts[0:9]) == -1
+    assert table.rows(hand.counts)[0] == -1
+    assert table.decompose(hand.counts) == []
+
+def test_best_faan_rejects_counts_above_4():
+    with pytest.raises(FaanError):
+        best_faan(Mahjong.Hand.from_names(five_b1.split()))
+
+def test_find_keeps_valid_patterns():
+    table = HandTable.get_table()
+    assert table.find((3, 1, 1, 1, 1, 1, 1, 1, 4)) >= 0
+    assert table.find((4, 0, 0, 0, 0, 0, 0, 0, 0)) >= 0
+
+def load_rows(path):
+    HandTable.loaded_tables.clear()
+    return len(HandTable.get_table(path).keys)
+
+def test_first_use_from_many_processes(tmp_path):
+    from multiprocessing import get_context
+    path = str(tmp_path / 'MahjongHandTable.bin')
+    with get_context('spawn').Pool(3) as pool:
+        counts = pool.map(load_rows, [path] * 3)
+    assert len(set(counts)) == 1 and counts[0] > 0
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['MahjongHandTable.bin']
+
+def test_rebuilds_a_truncated_table(tmp_path, monkeypatch):
+    path = tmp_path / 'MahjongHandTable.bin'
+    path.write_bytes(b'')
+    monkeypatch.setattr(HandTable, 'loaded_tables', {})
+    assert len(HandTable.get_table(str(path)).keys) > 0
+    monkeypatch.setattr(HandTable, 'loaded_tables', {})
+
+def checked_pid(_):
+    HandTable.check_worker()
+    return os.getpid()
+
+def test_worker_table_failure_stops_the_run(monkeypatch):
+    # the parent has its table, every forked worker fails to get one
+    from multiprocessing import get_context
+    HandTable.get_table()
+    parent = os.getpid()
+    real_get_table = HandTable.get_table
+
+    def get_table(*args):
+        if os.getpid() != parent:
+            raise ValueError('cannot mmap an empty file')
+        return real_get_table(*args)
+
+    monkeypatch.setattr(HandTable, 'get_table', get_table)
+    with get_context('fork').Pool(2, initializer=HandTable.init_worker) as pool:
+        with pytest.raises(RuntimeError, match='Hand table'):
+            list(pool.imap(checked_pid, range(4)))
+    HandTable.check_worker()
+
+def test_worker_with_its_table():
+    from multiprocessing import get_context
+    with get_context('fork').Pool(2, initializer=HandTable.init_worker) as pool:
+        assert all(pid != os.getpid() for pid in pool.map(checked_pid, range(4)))
+
+def test_tables_are_kept_by_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(HandTable, 'loaded_tables', {})
+    default = HandTable.get_table()
+    other = HandTable.get_table(str(tmp_path / 'MahjongHandTable.bin'))
+    assert other is not default and (tmp_path / 'MahjongHandTable.bin').exists()
+    assert HandTable.get_table() is default
+    assert HandTable.get_table(str(tmp_path / 'MahjongHandTable.bin')) is other
+
+def test_table_flags():
+    table = HandTable.get_table()
+    assert table.pattern_flags(table.find((1, 0, 0, 0, 0, 0, 0, 0, 2))) == HandTable.ORPHAN_PART
+    assert table.pattern_flags(table.find((3, 1, 1, 1, 1, 1, 1, 1, 4))) == HandTable.NINE_GATES
+    assert table.pattern_flags(table.find((1, 1, 1, 0, 0, 0, 0, 0, 0))) == 0
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+import MahjongTile as Mahjong
+import MahjongLayout as Layout
+
+# an upright tile is 40 x 55 pixels, a lying flower 55 x 40
+W, H = 40, 55
+
+hands = {
+    'bottom': 'b1 b1 b1 b2 b2 b2 b3 b3 b3 c5 c5 c5 dr dr',
+    'left': 'c2 c3 c4 c5 c6 c7 d1 d1 d1 d9 d9 d9 we we',
+    'top': 'b1 b9 c1 c9 d1 d9 we ws ww wn dr dg dw dw',
+    'right': 'd2 d2 d2 d3 d3 d3 d4 d4 d4 d5 d5 d5 d6 d6',
+}
+
+# boxes of upright tiles side by side from x, y, a gap of one tile after every index in gaps
+def row_boxes(count, x=100, y=100, gaps=()):
+    boxes = []
+    for i in range(count):
+        left = x + i * W + sum(W for gap in gaps if i > gap)
+        boxes.append([left, y, left + W, y + H])
+    return np.array(boxes, dtype=np.float64)
+
+# the boxes of a photo turned 90 degrees clockwise, height is the height of the photo before
+def turn(xyxy, height=1000):
+    return np.stack([height - xyxy[:, 3], xyxy[:, 0], height - xyxy[:, 1], xyxy[:, 2]], axis=1)
+
+# the boxes moved as their centers turn by degrees around the first box, the box sizes stay
+def skew(xyxy, degrees):
+    angle = np.radians(degrees)
+    centers = (xyxy[:, :2] + xyxy[:, 2:]) / 2
+    offset = centers - centers[0]
+    moved = centers[0] + offset @ np.array([[np.cos(angle), np.sin(angle)], [-np.sin(angle), np.cos(angle)]])
+    return np.concatenate((moved - (xyxy[:, 2:] - xyxy[:, :2]) / 2, moved + (xyxy[:, 2:] - xyxy[:, :2]) / 2), axis=1)
+
+def shuffled(xyxy, names, seed=0):
+    order = np.random.default_rng(seed).permutation(len(names))
+    return xyxy[order], [names[i] for i in order]
+
+def test_straight_row():
+    names = hands['bottom'].split()
+    xyxy, shuffled_names = shuffled(row_boxes(len(names)), names)
+    layout = Layout.tile_layout(xyxy, shuffled_names)
+    assert not layout.vertical and layout.angle == 0.0
+    assert layout.sequences(shuffled_names) == [names]
+    assert len(layout.groups()) == 1 and layout.exposed_melds(shuffled_names) == []
+
+@pytest.mark.parametrize('degrees', [-10, 6, 12])
+def test_skewed_row(degrees):
+    names = hands['left'].split()
+    xyxy, shuffled_names = shuffled(skew(row_boxes(len(names)), degrees), names)
+    layout = Layout.tile_layout(xyxy, shuffled_names)
+    assert layout.sequences(shuffled_names) == [names]
+    assert abs(abs(np.degrees(layout.angle)) - abs(degrees)) < 1
+
+def test_photo_turned_90_degrees():
+    names = hands['right'].split()
+    xyxy, shuffled_names = shuffled(turn(row_boxes(len(names))), names)
+    layout = Layout.tile_layout(xyxy, shuffled_names)
+    assert layout.vertical
+    assert layout.sequences(shuffled_names) == [names]
+
+def test_lying_flower_stays_in_its_row():
+    names = hands['bottom'].split() + ['f1']
+    xyxy = row_boxes(14)
+    # the flower lies after the last tile, centered on the row
+    flower = [[100 + 14 * W, 100 + (H - W) / 2, 100 + 14 * W + H, 100 + (H + W) / 2]]
+    xyxy, shuffled_names = shuffled(np.concatenate((xyxy, flower)), names)
+    layout = Layout.tile_layout(xyxy, shuffled_names)
+    assert not layout.vertical
+    assert layout.sequences(shuffled_names) == [names]
+
+def test_lying_flowers_do_not_turn_a_short_row():
+    # more flowers than tiles, the upright tiles still decide the row direction
+    names = ['f1', 'f2', 's1', 'b5', 'b5']
+    xyxy = np.array([[100 + i * H, 100 + (H - W) / 2, 100 + (i + 1) * H, 100 + (H + W) / 2] for i in range(3)] +
+                    [[100 + 3 * H + i * W, 100, 100 + 3 * H + (i + 1) * W, 100 + H] for i in range(2)], dtype=np.float64)
+    layout = Layout.tile_layout(xyxy, names)
+    assert not layout.vertical
+    assert layout.sequences(names) == [names]
+
+def test_two_rows_and_an_exposed_meld():
+    concealed = 'b1 b2 b3 c4 c5 c6 d7 d8 d9 we we'.split()
+    exposed = 'dr dr dr'.split()
+    # the exposed meld is its own row in front of the concealed tiles, set apart from its neighbour group
+    xyxy = np.concatenate((row_boxes(11, y=100), row_boxes(3, x=100, y=100 + H + 15)))
+    names = concealed + exposed
+    xyxy, shuffled_names = shuffled(xyxy, names)
+    layout = Layout.tile_layout(xyxy, shuffled_names)
+    assert layout.sequences(shuffled_names) == [concealed, exposed]
+    melds = layout.exposed_melds(shuffled_names)
+    assert [([shuffled_names[i] for i in group], meld) for group, meld in melds] == [(exposed, Mahjong.Meld.PONG)]
+
+def test_exposed_meld_apart_in_the_same_row():
+    names = 'b1 b2 b3 c4 c5 c6 d7 d8 d9 we we c1 c1 c1'.split()
+    xyxy, shuffled_names = shuffled(row_boxes(14, gaps=(10,)), names)
+    layout = Layout.tile_layout(xyxy, shuffled_names)
+    assert len(layout.rows()) == 1
+    assert [[shuffled_names[i] for i in group] for group in layout.groups()] == [names[:11], names[11:]]
+    assert [meld for _, meld in layout.exposed_melds(shuffled_names)] == [Mahjong.Meld.PONG]
@@ -0,0 +1,67 @@
+import time
+import threading
+
+import pytest
+
+import MahjongModelRegistry as Registry
+
+class FakeDetector:
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.model = None
+
+# a registry whose loads take delay seconds, ModelRegistry.load is the only part replaced
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name in ('fast.pt', 'slow.pt', 'a.pt', 'b.pt', 'c.pt'):
+        (tmp_path / name).write_bytes(b'weights')
+    registry = Registry.ModelRegistry(str(tmp_path))
+    registry.started = []
+
+    def load(model_path, backend):
+        registry.started.append(model_path)
+        time.sleep(0.3 if model_path.endswith('slow.pt') else 0.0)
+        if model_path.endswith('broken.pt'):
+            raise FileNotFoundError('Model path is invalid or model was not found.')
+        return Registry.ResidentModel(FakeDetector(model_path), 0.0, None)
+
+    monkeypatch.setattr(registry, 'load', load)
+    return registry
+
+def test_resident_model_is_not_blocked_by_a_load(registry):
+    registry.get('fast.pt')
+    loader = threading.Thread(target=registry.get, args=('slow.pt',))
+    loader.start()
+    time.sleep(0.05)
+    t_start = time.perf_counter()
+    assert registry.get('fast.pt').model_path == 'fast.pt'
+    # stats is answered at once too, like /health
+    assert registry.stats()['loading'] == 1
+    assert time.perf_counter() - t_start < 0.2
+    loader.join()
+    assert registry.stats()['loading'] == 0
+
+def test_concurrent_gets_load_once(registry):
+    detectors = []
+    threads = [threading.Thread(target=lambda: detectors.append(registry.get('slow.pt'))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert registry.started == ['slow.pt']
+    assert len(detectors) == 4 and all(detector is detectors[0] for detector in detectors)
+    assert registry.stats()['resident'][0]['uses'] == 4
+
+def test_failed_load_is_retried(registry):
+    for _ in range(2):
+        with pytest.raises(FileNotFoundError):
+            registry.get('broken.pt')
+    assert registry.started == ['broken.pt', 'broken.pt']
+    assert registry.stats()['loads'] == 0
+
+def test_least_recently_used_is_evicted(registry):
+    for model in ('a.pt', 'b.pt', 'a.pt', 'c.pt'):
+        registry.get(model)
+    assert [entry['model'] for entry in registry.stats()['resident']] == ['c.pt', 'a.pt']
+    assert registry.stats()['evictions'] == 1
@@ -0,0 +1,97 @@
+import json
+import threading
+import http.client
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import MahjongService as Service
+
+# every request here is rejected before a model is needed, the registry is never asked
+class NoRegistry:
+    def get(self, model=None, backend=None):
+        raise AssertionError('a malformed request reached the registry')
+
+    def stats(self):
+        return {'capacity': 2, 'loads': 0, 'evictions': 0, 'loading': 0, 'resident': []}
+
+@pytest.fixture(scope='module')
+def server():
+    Service.ScoringHandler.service = Service.ScoringService(NoRegistry())
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Service.ScoringHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def get(server, path):
+    connection = http.client.HTTPConnection(*server.server_address, timeout=10)
+    connection.request('GET', path)
+    response = connection.getresponse()
+    result = response.status, json.loads(response.read())
+    connection.close()
+    return result
+
+def post(server, path, body):
+    connection = http.client.HTTPConnection(*server.server_address, timeout=10)
+    connection.request('POST', path, json.dumps(body), {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    result = response.status, json.loads(response.read())
+    connection.close()
+    return result
+
+@pytest.mark.parametrize('path, body', [
+    ('/score', []),
+    ('/score', 'b1 b2 b3'),
+    ('/score', {'image_path': 'hand.jpg', 'ROI': [0, 0, 100]}),
+    ('/score', {'image_path': 'hand.jpg', 'ROI': 'all'}),
+    ('/score', {'image_path': 'hand.jpg', 'ROI': [100, 0, 50, 100]}),
+    ('/score', {'image_path': 'hand.jpg', 'ignore': [0, 0, 10, 10]}),
+    ('/score', {'image_path': 'hand.jpg', 'ignore': [[0, 0, 10]]}),
+    ('/score', {'image_path': 'hand.jpg', 'game_wind': [1]}),
+    ('/score', {'image_path': 3}),
+    ('/score', {'image': None}),
+    ('/score', {'image': None, 'image_path': 'hand.jpg'}),
+    ('/score_batch', {'hands': [{'image_path': None}]}),
+    ('/score_table', {'image': None}),
+    ('/score_batch', []),
+    ('/score_batch', {'hands': {'image_path': 'hand.jpg'}}),
+    ('/score_batch', {'hands': [{'image_path': 'hand.jpg'}, 'hand.jpg']}),
+    ('/score_batch', {'hands': [{'image_path': 'hand.jpg', 'ignore': [[0, 0, 'x', 10]]}]}),
+    ('/score_table', {'image_path': 'table.jpg', 'dealer': 'east'}),
+    ('/score_table', {'image_path': 'table.jpg', 'ROI': [0, 0, None, 10]}),
+])
+def test_malformed_requests_are_rejected(server, path, body):
+    status, result = post(server, path, body)
+    assert status == 400
+    assert result['ok'] is False
+
+def test_batch_error_names_the_hand(server):
+    status, result = post(server, '/score_batch', {'hands': [{'image_path': 'a.jpg'}, {'image_path': 'b.jpg', 'seat': 'x'}]})
+    assert status == 400
+    assert result['error'].startswith('hands[1]')
+
+def test_well_formed_request_passes():
+    Service.check_request({'image_path': 'hand.jpg', 'ROI': [0, 0, 100, 100], 'ignore': [[0, 0, 10, 10]],
+                           'game_wind': 1, 'seat_wind': '2', 'seat': -1, 'model': '4'})
+
+def test_health_does_not_load_a_model(server):
+    status, result = get(server, '/health')
+    assert status == 200
+    assert result['models']['resident'] == []
+
+# a detector that reads nothing, enough for ScoringService.prepare
+class PathDetector:
+    def load_file(self, path, roi=None):
+        return path, None
+
+    def load_bytes(self, data, roi=None):
+        raise AssertionError('a null image was decoded')
+
+    def preprocess(self, frame, roi=None, source_size=None, ignore_areas=None):
+        return frame
+
+def test_prepare_skips_a_null_image():
+    service = Service.ScoringService(NoRegistry())
+    assert service.prepare({'image': None, 'image_path': 'hand.jpg'}, PathDetector()) == 'hand.jpg'
@@ -0,0 +1,10 @@
+import MahjongTile as Mahjong
+import MahjongSimulator as Simulator
+
+ready_hand = 'b1 b1 b1 b2 b2 b2 b3 b3 b3 c5 c5 c5 dr'
+
+def test_pool_matches_one_process():
+    hand = Mahjong.Hand.from_names(ready_hand.split())
+    inline = Simulator.simulate(hand, draws=6, trials=400, seed=3, workers=1, chunk_size=100)
+    pooled = Simulator.simulate(hand, draws=6, trials=400, seed=3, workers=2, chunk_size=100)
+    assert inline.summary() == pooled.summary()
@@ -0,0 +1,63 @@
+import numpy as np
+
+import MahjongLayout as Layout
+import MahjongTable as Table
+from MahjongDetect import Detections
+
+# an upright tile is 40 x 55 pixels, a lying flower 55 x 40
+W, H = 40, 55
+
+hands = {
+    'bottom': 'b1 b1 b1 b2 b2 b2 b3 b3 b3 c5 c5 c5 dr dr',
+    'left': 'c2 c3 c4 c5 c6 c7 d1 d1 d1 d9 d9 d9 we we',
+    'top': 'b1 b9 c1 c9 d1 d9 we ws ww wn dr dg dw dw',
+    'right': 'd2 d2 d2 d3 d3 d3 d4 d4 d4 d5 d5 d5 d6 d6',
+}
+
+# a whole table photo: the bottom hand read left to right, the top one upside down, the left and
+# right ones in columns, the right hand with an exposed pong set apart and the bottom one with a lying flower
+def table_boxes():
+    xyxy, names, sides = [], [], []
+    def add(box, name, side):
+        xyxy.append(box)
+        names.append(name)
+        sides.append(side)
+    for i, name in enumerate(hands['bottom'].split()):
+        add([200 + i * W, 900, 240 + i * W, 955], name, 'bottom')
+    add([200 + 14 * W + 10, 910, 200 + 14 * W + 65, 950], 'f1', 'bottom')
+    for i, name in enumerate(hands['top'].split()):
+        add([800 - i * W, 50, 840 - i * W, 105], name, 'top')
+    for i, name in enumerate(hands['left'].split()):
+        add([40, 200 + i * W, 95, 240 + i * W], name, 'left')
+    for i, name in enumerate(reversed(hands['right'].split())):
+        top = 800 - i * W - (W if i >= 11 else 0)
+        add([905, top, 960, top + W], name, 'right')
+    order = np.random.default_rng(1).permutation(len(names))
+    return (np.array(xyxy, dtype=np.float64)[order], [names[i] for i in order], [sides[i] for i in order])
+
+def test_four_hand_table():
+    xyxy, names, sides = table_boxes()
+    found = Layout.table_hands(xyxy, names)
+    assert [side for side, _ in found] == list(Layout.table_sides)
+    for side, indices in found:
+        assert indices == [i for i, truth in enumerate(sides) if truth == side]
+
+def test_single_hand_is_the_bottom_one():
+    names = hands['top'].split()
+    xyxy = np.array([[100 + i * W, 50, 100 + (i + 1) * W, 50 + H] for i in range(len(names))], dtype=np.float64)
+    found = Layout.table_hands(xyxy, names)
+    assert found == [('bottom', list(range(len(names))))]
+
+def test_four_hand_table_scores_every_seat():
+    xyxy, names, _ = table_boxes()
+    class_names = np.array(sorted(set(names)), dtype=object)
+    index = {name: i for i, name in enumerate(class_names)}
+    detections = Detections(xyxy.astype(np.int32), np.ones(len(names), dtype=np.float32),
+                            np.array([index[name] for name in names]), class_names)
+    results = {result['side']: result for result in Table.score_table(detections, game_wind=1, dealer='bottom')}
+    assert {side: (result['seat'], result['seat_wind']) for side, result in results.items()} == {
+        'bottom': (0, 1), 'left': (1, 2), 'top': (2, 3), 'right': (3, 4)}
+    assert results['top']['name'] == 'Thirteen Orphans'
+    assert results['top']['rows'] == [hands['top'].split()]
+    assert results['right']['exposed'] == [['d2', 'd2', 'd2']]
+    assert all(result['ok'] for result in results.values())